@@ -0,0 +1,116 @@
+# **************************************************
+#
+# Filename: AsyncClientDataCRUD.py
+# Version: 1.0.0
+# Purpose: Provide an asyncio interface to the ClientDataCRUD layer so async callbacks and background jobs can run many queries concurrently.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Calls are offloaded to a bounded thread pool over the blocking PyMongo driver rather than using a native async driver,
+#   so the project doesn't need a second MongoDB driver. Concurrency is capped at maxWorkers per instance.
+#
+# **************************************************
+
+# General utility imports
+import asyncio                                      # For the async interface itself
+import functools                                    # For binding arguments to the offloaded calls
+from concurrent.futures import ThreadPoolExecutor   # For the bounded pool the blocking calls run on
+
+# CRUD Layer
+from ClientDataCRUD import ClientDataCRUD
+
+class AsyncClientDataCRUD(object):
+
+    """ Async CRUD operations for CS499_client_database, offloaded to a bounded executor """
+
+    #########################
+    # Initialization
+    #########################
+
+    # Takes the same arguments as ClientDataCRUD. maxWorkers caps how many operations run at once;
+    # anything beyond that waits its turn in the executor queue instead of tying up more threads or pooled connections.
+    def __init__(self, securityLayer, session, username, password, maxWorkers=8, crud=None):
+
+        # Reuse an existing CRUD layer if we were handed one, otherwise build our own.
+        self.crud = crud if crud is not None else ClientDataCRUD(securityLayer, session, username, password)
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="AsyncClientDataCRUD")
+
+    # Wraps an existing ClientDataCRUD instance rather than opening a new one.
+    @classmethod
+    def FromCRUD(cls, crud, maxWorkers=8):
+        return cls(None, None, None, None, maxWorkers, crud)
+
+    # Runs a blocking CRUD call on the executor and waits for it without blocking the event loop.
+    async def Run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    # Shuts down the executor. Pending calls are allowed to finish.
+    def Close(self):
+        self.executor.shutdown(wait=True)
+
+    #######################################################################################################################################
+
+    #########################
+    # CRUD Layer
+    #########################
+
+    # Each method mirrors its ClientDataCRUD counterpart, including return values and error handling.
+
+    async def create(self, collectionName, data):
+        return await self.Run(self.crud.create, collectionName, data)
+
+    async def create_many(self, collectionName, documents, chunkSize=None):
+        return await self.Run(self.crud.create_many, collectionName, documents, chunkSize)
+
+    async def read(self, collectionName, data, projection=None):
+        return await self.Run(self.crud.read, collectionName, data, projection)
+
+    async def read_page(self, collectionName, data, pageSize=None, sortKey="_id", sortDirection=1, continuationToken=None, includeTotal=False, projection=None):
+        return await self.Run(self.crud.read_page, collectionName, data, pageSize, sortKey, sortDirection, continuationToken, includeTotal, projection)
+
+    async def aggregate(self, collectionName, pipeline, batch_size=None, allowDiskUse=False):
+        return await self.Run(self.crud.aggregate, collectionName, pipeline, batch_size, allowDiskUse)
+
+    async def update(self, collectionName, target, updatedData, upsert=False):
+        return await self.Run(self.crud.update, collectionName, target, updatedData, upsert)
+
+    async def update_with_counts(self, collectionName, target, updatedData, upsert=False):
+        return await self.Run(self.crud.update_with_counts, collectionName, target, updatedData, upsert)
+
+    async def bulk_update(self, collectionName, pairs, upsert=False, chunkSize=None):
+        return await self.Run(self.crud.bulk_update, collectionName, pairs, upsert, chunkSize)
+
+    async def delete(self, collectionName, target):
+        return await self.Run(self.crud.delete, collectionName, target)
+
+    async def delete_many(self, collectionName, target):
+        return await self.Run(self.crud.delete_many, collectionName, target)
+
+    async def bulk_delete(self, collectionName, targets, chunkSize=None):
+        return await self.Run(self.crud.bulk_delete, collectionName, targets, chunkSize)
+
+    async def bulk_write(self, collectionName, operations, chunkSize=None):
+        return await self.Run(self.crud.bulk_write, collectionName, operations, chunkSize)
+
+    # Async version of iter_read. Each batch is fetched on the executor, so the event loop is never held while the cursor waits on the server.
+    # Yields lists of up to batch_size documents.
+    async def iter_read(self, collectionName, data, batch_size=None, projection=None):
+        batches = self.crud.iter_read(collectionName, data, batch_size, True, projection)
+        try:
+            while True:
+                batch = await self.Run(next, batches, None)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            # Close the underlying generator (and its cursor) on the executor too, since closing may talk to the server.
+            await self.Run(batches.close)
+
+    # Runs several reads concurrently and returns their results in the same order.
+    # requests is a list of (collectionName, filter) pairs.
+    async def read_many(self, requests):
+        return await asyncio.gather(*(self.read(collectionName, data) for collectionName, data in requests))
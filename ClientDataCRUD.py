@@ -18,15 +18,28 @@
 # coding: utf-8
 
 # PyMongo
-from pymongo import MongoClient
 from pymongo import errors
+from pymongo import UpdateMany, DeleteMany
 
 # General utility imports
 from bson.objectid import ObjectId      # Necessary to strip the ObjectID from the MongoDB data before JSON serialization.
+from bson import json_util              # For encoding BSON values (ObjectIds, dates) into pagination tokens
+import base64                           # For making pagination tokens opaque and URL-safe
 import configparser                     # For parsing the configuration file
+import datetime                         # For stamping documents with their last-modified time
+from concurrent.futures import ThreadPoolExecutor   # For dispatching bulk write chunks in parallel over the connection pool
 
-# SecurityLayer
-from CS499_Security import SecurityLayer
+# Shared connection pool
+from ClientDataConnection import GetConnectionManager
+
+# Index registry
+from ClientDataIndexes import EnsureIndexes, CheckQueryPlans, KNOWN_QUERIES
+
+# Query result cache
+from ClientDataCache import QueryCache, GetSharedQueryCache, PipelineCollections
+
+# Materialized book summary
+from ClientDataSummary import BookSummary
 
 class ClientDataCRUD(object):
     
@@ -44,6 +57,30 @@ class ClientDataCRUD(object):
         self.TOKEN = session["token"]
         print(f"Session details: {self.SESSION} -- {self.TOKEN}")
         
+        # Store some default values for streaming reads.
+        self.defaultBatchSize = 1000        # Number of documents per cursor batch (and per yielded chunk) in iter_read.
+        self.defaultPageSize = 50           # Matches the dashboard DataTable's page_size.
+        
+        # Store some default values for bulk writes.
+        self.defaultChunkSize = 1000        # Number of documents or operations sent per bulk write command.
+        self.defaultBulkWorkers = 4         # Number of chunks in flight at once when a bulk write runs in parallel.
+        
+        # Results of read() and aggregate() are cached here until they age out or a write touches their collection.
+        # Once connected, this is the cache every CRUD layer on the database shares (see GetSharedQueryCache), with this user's entries kept apart.
+        self.cache = QueryCache()
+        self.cacheOwner = username
+        
+        # Every document written through create/update is stamped with its last-modified time in this field,
+        # which lets incremental refreshes poll for changes. Set to None to disable stamping.
+        self.updatedAtField = "updated_at"
+        
+        # create/update/delete on accounts or clients apply their change to the book_summary collection as they happen.
+        # The bulk methods, and writes touching more than summaryDeltaLimit accounts, mark it stale instead, which has it
+        # rebuilt in the background shortly afterwards. Set maintainSummary to False to mark it stale on every write.
+        self.maintainSummary = True
+        self.summaryDeltaLimit = 1000
+        self.summary = None
+        
         # Load the configuration details into a ConfigParser
         self.config = self.LoadConfig("./config/CS499_secure.ini")
         
@@ -51,6 +88,13 @@ class ClientDataCRUD(object):
         if (self.config is None):
             print("Failed to load configuration file. Closing the CRUD layer.")
             return
+        
+        # Size the cache from the optional [Cache] section, keeping the defaults for anything that isn't specified.
+        try:
+            self.cache.maxEntries = self.config.getint("Cache", "MAX_ENTRIES", fallback=self.cache.maxEntries)
+            self.cache.ttlSeconds = self.config.getfloat("Cache", "TTL_SECONDS", fallback=self.cache.ttlSeconds)
+        except ValueError as e:     # Thrown if one of the values isn't a number.
+            print(f"Invalid cache setting in the configuration file, keeping the defaults: {e}")
                     
         # Establish a connection to the database using the credentials provided and server details from the configuration file.
         self.database = self.ConnectToDatabase(self.config, username, password)
@@ -59,6 +103,14 @@ class ClientDataCRUD(object):
         if (self.database is None):
             print("Failed to connect the the database. Closing the CRUD layer.")
             return
+        
+        # Switch to the database's shared cache, so writes through other sessions' CRUD layers invalidate what this one reads.
+        self.cache = GetSharedQueryCache(self.database.name, self.cache.maxEntries, self.cache.ttlSeconds)
+        
+        # Make sure the dashboard's filters and joins are index-backed. This is a no-op once the indexes exist.
+        self.EnsureIndexes()
+        
+        self.summary = BookSummary(self.database)
             
         print("Initialization complete.")
 
@@ -94,37 +146,20 @@ class ClientDataCRUD(object):
         return config
         
     # Similar to the LoadConfig function, this is primarily used during initialization but has been separated out for maintainability and encapsulation.
-    # This function returns a MongoClient that connects to the server and can be used for the rest of the class.
-    # <IMPROVEMENT> Separate out into a Connection module and generalize for re-use here and in the other modules.
+    # This function returns the database from the shared, pooled MongoClient for these credentials so repeated logins reuse the same pool.
     def ConnectToDatabase(self, config, username, password):
         
         # Username and Password should only be passed in this manner if they are login verified.
-        # Database details are pulled from the config file.
-        # While it's no longer an external file, try-except is still good practice for the likely scenarios.
-        try:
-            USER = username
-            PASS = password
-            HOST = config.get("Server", "HOST")
-            PORT = config.getint("Server", "PORT")
-            DB = config.get("Server", "DB")
-            
-        except configparser.NoSectionError:     # Thrown if 'CRUDLogin' or 'Server' are not sections within the config file.
-            print("Unable to connect to the database. One of the specified sections does not exist in the configuration file.")
-            return None
-        except configparser.NoOptionError:      # Thrown if 'USER', 'HOST', etc. are not keys within the config file.
-            print("Unable to connect to the database. One of the specified keys does not exist in the configuration file.")
-            return None
-        
-        # Connect to MongoDB using those credentials.
+        # Server and pool details are pulled from the config file by the shared connection manager.
         try:
-            database = MongoClient('mongodb://%s:%s@%s:%d/%s' % (USER,PASS,HOST,PORT,DB))[DB]
+            database = GetConnectionManager().GetDatabase(username, password)
             
             # Verify success, then return the database for use.
             if database is not None:
-                print(f"Connected to database: {DB}, type {type(database)}")
+                print(f"Connected to database: {database.name}, type {type(database)}")
                 return database
             else:
-                print(f"Failed to connected to the {DB} database.")
+                print(f"Failed to connect to the database.")
                 return None
             
         except errors.ConnectionFailure as e:     # Thrown if there is some kind of connection error.
@@ -134,6 +169,16 @@ class ClientDataCRUD(object):
             print(f"An unexpected exception occurred while connecting to the database: {e}")
             return None
 
+    # Ensures the registered indexes for the collections the CRUD layer serves.
+    # Returns {collectionName: [index names]}.
+    def EnsureIndexes(self, collectionNames=("accounts", "clients")):
+        return {collectionName: EnsureIndexes(self.database, collectionName) for collectionName in collectionNames}
+    
+    # Explains each known dashboard query and reports whether it still uses a collection scan.
+    # See ClientDataIndexes.CheckQueryPlans for the report format.
+    def CheckIndexes(self):
+        return CheckQueryPlans(self.database, queries=[query for query in KNOWN_QUERIES if query["collection"] != "logins"])
+
     #######################################################################################################################################
 
     #########################
@@ -150,10 +195,13 @@ class ClientDataCRUD(object):
             try:
                 collection = self.database[collectionName]
                 # print(f"Attempting to access the collection: {collection}")
+                self.StampDocument(data)
+                pendingSummary = self.BeginSummaryUpdate(collectionName, None)
                 insertResult = collection.insert_one(data)  # data should be dictionary
                 # If successful, explicitly acknowledge success.
                 if insertResult.acknowledged:
                     print("Insertion acknowledged by server.")
+                    self.FinishSummaryUpdate(pendingSummary, [insertResult.inserted_id])
                     return True
                 # If unsuccessful, explicitly acknowledge failure.
                 else:
@@ -164,21 +212,141 @@ class ClientDataCRUD(object):
                 print(f"Operation failure during create: {operationFailure}")
             except Exception as exception:
                 print(f"An unexpected exception occurred during creation: {exception}")
+            finally:
+                # Any cached reads of this collection may now be out of date.
+                self.cache.Invalidate(collectionName)
         else:
             raise Exception("Nothing to save because data parameter is empty.")
             return False
 
+    # Bulk version of create for loading many documents at once.
+    # The documents are split into chunks of chunkSize and each chunk is sent as a single unordered insert_many,
+    # so one bad document doesn't stop the rest of its chunk from being written.
+    # With parallel=True the chunks are dispatched concurrently over the shared connection pool.
+    # Returns one report per chunk: {"chunk", "offset", "size", "insertedCount", "errors"},
+    # where each error's "index" is the document's position in the original documents list.
+    def create_many(self, collectionName, documents, chunkSize=None, parallel=False, maxWorkers=None):
+        # First, validate that the 'documents' are present and 'collection' has been designated
+        if documents is None or collectionName is None:
+            raise Exception("Nothing to save because documents parameter is empty.")
+        
+        collection = self.database[collectionName]
+        
+        def InsertChunk(chunkNumber, offset, chunk):
+            report = {"chunk": chunkNumber, "offset": offset, "size": len(chunk), "insertedCount": 0, "errors": []}
+            try:
+                insertResult = collection.insert_many(chunk, ordered=False)
+                report["insertedCount"] = len(insertResult.inserted_ids)
+            
+            # Unordered bulk writes keep going past failures and report them all together at the end.
+            except errors.BulkWriteError as bulkWriteError:
+                details = bulkWriteError.details
+                report["insertedCount"] = details.get("nInserted", 0)
+                report["errors"] = self.CollectWriteErrors(details, offset)
+            except errors.OperationFailure as operationFailure:
+                print(f"Operation failure during create_many: {operationFailure}")
+                report["errors"] = [{"index": None, "code": operationFailure.code, "message": str(operationFailure)}]
+            except Exception as exception:
+                print(f"An unexpected exception occurred during create_many: {exception}")
+                report["errors"] = [{"index": None, "code": None, "message": str(exception)}]
+            return report
+        
+        documents = list(documents)
+        for document in documents:
+            self.StampDocument(document)
+        
+        reports = self.RunChunks(documents, InsertChunk, chunkSize, parallel, maxWorkers)
+        self.cache.Invalidate(collectionName)
+        self.MarkSummaryStale(collectionName)
+        print(f"{sum(report['insertedCount'] for report in reports)} record(s) inserted across {len(reports)} chunk(s).")
+        return reports
+    
+    # Runs a list of PyMongo write operations (InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ReplaceOne)
+    # as unordered bulk writes, chunkSize operations per command, optionally with the chunks dispatched in parallel.
+    # The operations are sent as given, so they are not stamped with updatedAtField; bulk_update and create_many do that for you.
+    # Returns one report per chunk: {"chunk", "offset", "size", "insertedCount", "matchedCount", "modifiedCount",
+    # "deletedCount", "upsertedCount", "errors"}, with error indexes relative to the original operations list.
+    def bulk_write(self, collectionName, operations, chunkSize=None, parallel=False, maxWorkers=None):
+        # First, validate that the 'operations' are present and 'collection' has been designated
+        if operations is None or collectionName is None:
+            raise Exception("No bulk write can be run because the operations parameter is empty or no collection was specified.")
+        
+        collection = self.database[collectionName]
+        
+        def WriteChunk(chunkNumber, offset, chunk):
+            report = {"chunk": chunkNumber, "offset": offset, "size": len(chunk), "insertedCount": 0, "matchedCount": 0,
+                      "modifiedCount": 0, "deletedCount": 0, "upsertedCount": 0, "errors": []}
+            try:
+                writeResult = collection.bulk_write(chunk, ordered=False)
+                report["insertedCount"] = writeResult.inserted_count
+                report["matchedCount"] = writeResult.matched_count
+                report["modifiedCount"] = writeResult.modified_count
+                report["deletedCount"] = writeResult.deleted_count
+                report["upsertedCount"] = writeResult.upserted_count
+            
+            except errors.BulkWriteError as bulkWriteError:
+                details = bulkWriteError.details
+                report["insertedCount"] = details.get("nInserted", 0)
+                report["matchedCount"] = details.get("nMatched", 0)
+                report["modifiedCount"] = details.get("nModified", 0)
+                report["deletedCount"] = details.get("nRemoved", 0)
+                report["upsertedCount"] = details.get("nUpserted", 0)
+                report["errors"] = self.CollectWriteErrors(details, offset)
+            except errors.OperationFailure as operationFailure:
+                print(f"Operation failure during bulk_write: {operationFailure}")
+                report["errors"] = [{"index": None, "code": operationFailure.code, "message": str(operationFailure)}]
+            except Exception as exception:
+                print(f"An unexpected exception occurred during bulk_write: {exception}")
+                report["errors"] = [{"index": None, "code": None, "message": str(exception)}]
+            return report
+        
+        reports = self.RunChunks(list(operations), WriteChunk, chunkSize, parallel, maxWorkers)
+        self.cache.Invalidate(collectionName)
+        self.MarkSummaryStale(collectionName)
+        return reports
+    
+    # Splits items into chunks and runs worker(chunkNumber, offset, chunk) over each, returning the reports in chunk order.
+    # MongoClient is thread-safe, so parallel chunks simply draw separate connections from the shared pool.
+    def RunChunks(self, items, worker, chunkSize=None, parallel=False, maxWorkers=None):
+        if chunkSize is None:
+            chunkSize = self.defaultChunkSize
+        if chunkSize <= 0:
+            raise ValueError(f"chunkSize must be positive, not {chunkSize}.")
+        
+        chunks = [(number, offset, items[offset:offset + chunkSize]) for number, offset in enumerate(range(0, len(items), chunkSize))]
+        
+        if not parallel or len(chunks) <= 1:
+            return [worker(*chunk) for chunk in chunks]
+        
+        with ThreadPoolExecutor(max_workers=maxWorkers or self.defaultBulkWorkers) as executor:
+            return list(executor.map(lambda chunk: worker(*chunk), chunks))
+    
+    # Converts the writeErrors of a BulkWriteError into simple dictionaries, shifting each index by the chunk's offset.
+    def CollectWriteErrors(self, details, offset):
+        return [{"index": offset + writeError.get("index", 0), "code": writeError.get("code"), "message": writeError.get("errmsg")}
+                for writeError in details.get("writeErrors", [])]
+
     # Create method to implement the R in CRUD.
-    def read(self, collectionName, data):
+    # Results are served from the query cache when the same filter was read recently. The documents are shared with the cache, so treat them as read-only.
+    # projection optionally limits the fields returned, e.g. {"client_id": 1, "account_value": 1}.
+    def read(self, collectionName, data, projection=None):
         # First, validate that the 'data' is present.
         if data is not None and collectionName is not None:
+            # Check the cache before going to the database.
+            cacheKey = self.cache.MakeKey("find", collectionName, [data, projection], self.cacheOwner)
+            cached = self.cache.Get(cacheKey)
+            if cached is not None:
+                return list(cached)
+            generation = self.cache.Generation({collectionName})
+            
             # Then attempt to read the requested data from the database.
             try:
                 collection = self.database[collectionName]
                 # print(f"Attempting to access collection: {collection}")
                 # This should return a list that either contains the results or is empty
-                results = [entry for entry in collection.find(data)]
-                return results
+                results = [entry for entry in collection.find(data, projection)]
+                self.cache.Put(cacheKey, results, {collectionName}, generation)
+                return list(results)
             
             except errors.OperationFailure as operationFailure:
                 print(f"Operation failure during read: {operationFailure} in {type(self.database[collectionName])}")
@@ -191,89 +359,533 @@ class ClientDataCRUD(object):
             raise Exception("No entry can be returned due to the data parameter being empty or no collection being specified.")
             return []
         
-    # Create method to implement the U in CRUD.
-    def update(self, collectionName, target, updatedData):
-        # First, validate that the incoming data is present.
-        if target is not None and updatedData is not None and collectionName is not None:
+    # Streaming version of read for result sets too large to hold as a single list.
+    # Yields documents straight from the cursor, or lists of up to batch_size documents when batched is True,
+    # so callers can build DataFrames chunk by chunk or write results out with bounded memory.
+    # batch_size also sets how many documents the cursor pulls from the server per round trip.
+    def iter_read(self, collectionName, data, batch_size=None, batched=False, projection=None):
+        # First, validate that the 'data' is present.
+        if data is None or collectionName is None:
+            raise Exception("No entry can be returned due to the data parameter being empty or no collection being specified.")
+        
+        if batch_size is None:
+            batch_size = self.defaultBatchSize
+        if batch_size <= 0:
+            raise ValueError(f"batch_size must be positive, not {batch_size}.")
+        
+        # Then attempt to stream the requested data from the database.
+        # A generator can't hand back an error value, so failures are logged and the stream simply ends early.
+        try:
+            collection = self.database[collectionName]
+            cursor = collection.find(data, projection, batch_size=batch_size)
             
-            # Then find the record(s) we need to update.
-            targetRecords = None
-            try:
-                collection = self.database[collectionName]
-                # This should put a cursor into targetRecords that contains the matches to iterate through, if any
-                targetRecords = collection.find(target)
+            # The with block closes the server-side cursor even if the caller stops iterating part way through.
+            with cursor:
+                if not batched:
+                    for entry in cursor:
+                        yield entry
+                    return
                 
-            except errors.OperationFailure as operationFailure:
-                print(f"Operation failure while locating records: {operationFailure}")
-            except Exception as exception:
-                print(f"An unexpected exception occurred while locating records: {exception}") 
+                batch = []
+                for entry in cursor:
+                    batch.append(entry)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during iter_read: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during iter_read: {exception}")
+    
+    # Paginated version of read using keyset (seek) pagination.
+    # Rather than skipping over earlier pages, each page resumes from the last sort key seen, so any page costs one index range scan.
+    # sortKey should be indexed for this to stay cheap; _id is always appended as a tie-breaker so the ordering is total.
+    # Returns {"results": [...], "nextToken": str or None, "totalCount": int or None}.
+    # Pass nextToken back in as continuationToken to get the following page; it is None on the last page.
+    def read_page(self, collectionName, data, pageSize=None, sortKey="_id", sortDirection=1, continuationToken=None, includeTotal=False, projection=None):
+        # First, validate that the 'data' is present.
+        if data is None or collectionName is None:
+            raise Exception("No entry can be returned due to the data parameter being empty or no collection being specified.")
+        
+        if pageSize is None:
+            pageSize = self.defaultPageSize
+        if pageSize <= 0:
+            raise ValueError(f"pageSize must be positive, not {pageSize}.")
+        if sortDirection not in (1, -1):
+            raise ValueError(f"sortDirection must be 1 or -1, not {sortDirection}.")
+        
+        page = {"results": [], "nextToken": None, "totalCount": None}
+        
+        # Resume after the last row of the previous page, if there was one.
+        query = data
+        if continuationToken is not None:
+            lastValue, lastId = self.DecodePageToken(continuationToken, sortKey, sortDirection)
+            seek = self.BuildKeysetFilter(sortKey, sortDirection, lastValue, lastId)
+            query = {"$and": [data, seek]} if data else seek
+        
+        sortSpec = [("_id", sortDirection)] if sortKey == "_id" else [(sortKey, sortDirection), ("_id", sortDirection)]
+        
+        try:
+            collection = self.database[collectionName]
             
-            # Now that we have the record(s), we want to try to update accordingly.
-            # I'm under the belief that proper try-catch structure regarding databases means that
-            # you should have each database operation in a separate try-catch block.
-            try:
-                # Iterate through the matches and update accordingly.
-                if targetRecords.count() > 0:
-                    updateResult = collection.update_many(target, {"$set": updatedData})
-                    
-                    # If the update is successful, explicitly confirm that.
-                    if updateResult.acknowledged:
-                        print(f"{updateResult.modified_count} record(s) updated.")
-                        # Return -> The number of objects modified in the collection.
-                        return updateResult.modified_count
-                    # If the update was unsuccessful, indicate explicitly.
-                    else:
-                        print("Update failed; server did not acknowledge update request.")
-                        return 0
-                else:
-                    print("No matching records found.")
-                    return 0
-                
-            except errors.OperationFailure as operationFailure:
-                print(f"Operation failure during update: {operationFailure}")
-            except Exception as exception:
-                print(f"An unexpected exception occurred during update: {exception}")
-        else:
-            raise Exception("No entry can be updated due to the data parameter being empty or no collection being specified.")
+            # Ask for one row more than the page holds. If it comes back, there's another page after this one.
+            results = list(collection.find(query, projection).sort(sortSpec).limit(pageSize + 1))
+            if len(results) > pageSize:
+                results = results[:pageSize]
+                lastEntry = results[-1]
+                page["nextToken"] = self.EncodePageToken(sortKey, sortDirection, lastEntry.get(sortKey), lastEntry["_id"])
+            page["results"] = results
+            
+            # Counting is a separate (and potentially much more expensive) operation, so only do it on request.
+            if includeTotal:
+                page["totalCount"] = collection.count_documents(data)
+            
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during read_page: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during read_page: {exception}")
+        
+        return page
+    
+    # Builds the filter that matches every document after (lastValue, lastId) in the given sort order.
+    # MongoDB sorts null/missing values before everything else, so those need their own handling;
+    # otherwise a range comparison against null would match nothing at all.
+    def BuildKeysetFilter(self, sortKey, sortDirection, lastValue, lastId):
+        after = "$gt" if sortDirection == 1 else "$lt"
+        
+        if sortKey == "_id":
+            return {"_id": {after: lastId}}
+        
+        # Rows sharing the last sort value continue by _id.
+        sameValue = {sortKey: lastValue, "_id": {after: lastId}}
+        
+        if lastValue is None:
+            # Ascending, nulls come first, so everything non-null still lies ahead. Descending, nulls are the tail.
+            if sortDirection == 1:
+                return {"$or": [sameValue, {sortKey: {"$ne": None}}]}
+            return sameValue
+        
+        if sortDirection == 1:
+            return {"$or": [{sortKey: {after: lastValue}}, sameValue]}
+        # Descending, the null/missing rows are still to come after every real value.
+        return {"$or": [{sortKey: {after: lastValue}}, sameValue, {sortKey: None}]}
+    
+    # Packs the resume position into an opaque, URL-safe token.
+    # The sort key and direction are included so a token can't silently be replayed against a different ordering.
+    def EncodePageToken(self, sortKey, sortDirection, lastValue, lastId):
+        payload = json_util.dumps({"k": sortKey, "d": sortDirection, "v": lastValue, "i": lastId}, json_options=json_util.CANONICAL_JSON_OPTIONS)
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+    
+    # Unpacks a token produced by EncodePageToken, returning (lastValue, lastId).
+    def DecodePageToken(self, token, sortKey, sortDirection):
+        try:
+            payload = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        except Exception as exception:
+            raise ValueError(f"Invalid continuation token: {exception}")
+        
+        if payload.get("k") != sortKey or payload.get("d") != sortDirection:
+            raise ValueError("Continuation token was issued for a different sort order.")
+        return payload.get("v"), payload.get("i")
+        
+    # Returns the number of documents matching the filter, e.g. to size a paged table. Cached like read().
+    def count(self, collectionName, data):
+        # First, validate that the 'data' is present.
+        if data is None or collectionName is None:
+            raise Exception("No count can be returned due to the data parameter being empty or no collection being specified.")
+        
+        cacheKey = self.cache.MakeKey("count", collectionName, data, self.cacheOwner)
+        cached = self.cache.Get(cacheKey)
+        if cached is not None:
+            return cached
+        generation = self.cache.Generation({collectionName})
+        
+        try:
+            result = self.database[collectionName].count_documents(data)
+            self.cache.Put(cacheKey, result, {collectionName}, generation)
+            return result
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during count: {operationFailure}")
+            return 0
+        except Exception as exception:
+            print(f"An unexpected exception occurred during count: {exception}")
             return 0
+    
+    # Runs an aggregation pipeline against the collection and returns the resulting documents as a list.
+    # This lets joins, projections and derived fields run inside MongoDB rather than in the web process.
+    # Like read(), results are cached and the documents should be treated as read-only.
+    # Pass useCache=False when the result must reflect the very latest writes, e.g. when applying a change notification.
+    def aggregate(self, collectionName, pipeline, batch_size=None, allowDiskUse=False, useCache=True):
+        # First, validate that the 'pipeline' is present.
+        if pipeline is None or collectionName is None:
+            raise Exception("No aggregation can be run due to the pipeline parameter being empty or no collection being specified.")
+        
+        # Check the cache before going to the database. The entry is invalidated by writes to any collection the pipeline reads.
+        cacheKey = self.cache.MakeKey("aggregate", collectionName, pipeline, self.cacheOwner)
+        cached = self.cache.Get(cacheKey) if useCache else None
+        if cached is not None:
+            return list(cached)
+        collections = PipelineCollections(collectionName, pipeline)
+        generation = self.cache.Generation(collections)
+        
+        try:
+            collection = self.database[collectionName]
+            cursor = collection.aggregate(pipeline, batchSize=batch_size or self.defaultBatchSize, allowDiskUse=allowDiskUse)
+            with cursor:
+                results = list(cursor)
+            self.cache.Put(cacheKey, results, collections, generation)
+            return list(results)
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during aggregate: {operationFailure}")
+            return []
+        except Exception as exception:
+            print(f"An unexpected exception occurred during aggregate: {exception}")
+            return []
+    
+    # Builds the accounts -> clients join that the dashboard displays, to be run with aggregate() on the accounts collection.
+    # accountFilter narrows the accounts before the join so only matching accounts look up their client.
+    # The output keeps only accountFields and clientFields (no ObjectIds), plus the derived days_since_last_review.
+    # keepIds keeps the account _id and client_id as well, for callers that need to match rows back to documents.
+    def BuildMergedPipeline(self, accountFilter, accountFields, clientFields, clientCollection="clients", keepIds=False):
+        pipeline = []
+        
+        # Filter first so the join only touches the accounts we actually need.
+        if accountFilter:
+            pipeline.append({"$match": accountFilter})
+        
+        # Left join each account to its client. localField/foreignField lets the lookup use the clients' _id index.
+        pipeline.append({"$lookup": {"from": clientCollection, "localField": "client_id", "foreignField": "_id", "as": "client"}})
+        pipeline.append({"$unwind": {"path": "$client", "preserveNullAndEmptyArrays": True}})
+        
+        # Keep just the displayed fields. last_review_date is always carried along so the review age can be derived.
+        projection = {"_id": 1, "client_id": 1} if keepIds else {"_id": 0}
+        for field in accountFields:
+            projection[field] = 1
+        for field in set(clientFields) | {"last_review_date"}:
+            projection[field] = f"$client.{field}"
+        pipeline.append({"$project": projection})
+        
+        # Whole days since the last review.
+        pipeline.append({"$addFields": {"days_since_last_review": self.DaysSinceExpression("$last_review_date")}})
+        
+        # Drop the helper field again unless it was asked for.
+        if "last_review_date" not in clientFields:
+            pipeline.append({"$project": {"last_review_date": 0}})
+        
+        return pipeline
+
+    # Returns the aggregation expression for whole days between a date field (e.g. "$last_review_date") and now.
+    # $convert copes with the date being stored either as a date or as a date string.
+    def DaysSinceExpression(self, fieldPath):
+        date = {"$convert": {"input": fieldPath, "to": "date", "onError": None, "onNull": None}}
+        return {"$floor": {"$divide": [{"$subtract": ["$$NOW", date]}, 86400000]}}
+
+    # Builds a filter matching documents whose date field is at least minDays whole days in the past,
+    # i.e. the server-side equivalent of (now - field).days >= minDays. Useful for any date-derived dashboard filter.
+    # Rather than computing the difference per document with $expr, the comparison is turned around into a cutoff on the field itself,
+    # which an index on the field can serve. Dates may be stored either as BSON dates or as ISO "YYYY-MM-DD" strings, so both are matched.
+    # The cutoff is truncated to the minute so repeated clicks produce the same filter (and hit the query cache).
+    def DaysSinceFilter(self, field, minDays, now=None):
+        return self.DaysRangeFilter(field, minDays, None, now)
+    
+    # The general form of DaysSinceFilter: whole days since the date field between minDays and maxDays inclusive. Either bound may be None.
+    # (now - field).days <= maxDays is the same as the field falling after a cutoff maxDays + 1 days ago, so this is index-friendly too.
+    # now defaults to the current UTC time, since BSON dates are stored in UTC and DaysSinceExpression counts from the server's UTC $$NOW.
+    def DaysRangeFilter(self, field, minDays=None, maxDays=None, now=None):
+        now = (now or datetime.datetime.now(datetime.timezone.utc)).replace(second=0, microsecond=0)
+        dateRange = {}
+        stringRange = {}
+        if minDays is not None:
+            cutoff = now - datetime.timedelta(days=minDays)
+            dateRange["$lte"] = cutoff
+            stringRange["$lte"] = cutoff.date().isoformat()
+        if maxDays is not None:
+            cutoff = now - datetime.timedelta(days=maxDays + 1)
+            dateRange["$gt"] = cutoff
+            stringRange["$gt"] = cutoff.date().isoformat()
+        
+        # No bounds at all still requires a date to be present.
+        if not dateRange:
+            dateRange["$type"] = "date"
+        stringRange["$type"] = "string"
+        return {"$or": [
+            {field: dateRange},
+            {field: stringRange}
+        ]}
+
+    # Create method to implement the U in CRUD.
+    # Runs as a single update_many, so the match and the modification happen in one atomic server command.
+    # updatedData may be a plain {field: value} dictionary (applied with $set), an update operator document, or an aggregation pipeline list.
+    # Every update also stamps updatedAtField (see BuildUpdateDocument). Plain dictionaries only stamp documents they actually change,
+    # so the modified count stays accurate. Operator documents and pipelines always stamp, so for them every matched document counts as modified.
+    # Return -> The number of objects modified in the collection.
+    def update(self, collectionName, target, updatedData, upsert=False):
+        return self.update_with_counts(collectionName, target, updatedData, upsert)["modifiedCount"]
+    
+    # Same single-round-trip update as update(), but returns the full result:
+    # {"matchedCount": int, "modifiedCount": int, "upsertedId": the new document's _id or None}.
+    # modifiedCount follows the stamping rules described on update().
+    def update_with_counts(self, collectionName, target, updatedData, upsert=False):
+        counts = {"matchedCount": 0, "modifiedCount": 0, "upsertedId": None}
+        
+        # First, validate that the incoming data is present.
+        if target is None or updatedData is None or collectionName is None:
+            raise Exception("No entry can be updated due to the data parameter being empty or no collection being specified.")
+        
+        try:
+            collection = self.database[collectionName]
+            pendingSummary = self.BeginSummaryUpdate(collectionName, target)
+            updateResult = collection.update_many(target, self.BuildUpdateDocument(updatedData), upsert=upsert)
+            
+            # If the update is successful, explicitly confirm that.
+            if updateResult.acknowledged:
+                self.FinishSummaryUpdate(pendingSummary, [updateResult.upserted_id])
+                counts["matchedCount"] = updateResult.matched_count
+                counts["modifiedCount"] = updateResult.modified_count
+                counts["upsertedId"] = updateResult.upserted_id
+                if updateResult.matched_count == 0 and updateResult.upserted_id is None:
+                    print("No matching records found.")
+                else:
+                    print(f"{updateResult.modified_count} record(s) updated.")
+            # If the update was unsuccessful, indicate explicitly.
+            else:
+                print("Update failed; server did not acknowledge update request.")
+            
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during update: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during update: {exception}")
+        finally:
+            # Any cached reads of this collection may now be out of date.
+            self.cache.Invalidate(collectionName)
+        
+        return counts
+    
+    # Applies a list of (target, updatedData) pairs as one unordered bulk_write, instead of a separate round trip per pair.
+    # Each pair behaves like a call to update(), including the optional upsert.
+    # Returns the totals: {"matchedCount", "modifiedCount", "upsertedCount", "errors"}.
+    def bulk_update(self, collectionName, pairs, upsert=False, chunkSize=None, parallel=False, maxWorkers=None):
+        # First, validate that the incoming data is present.
+        if pairs is None or collectionName is None:
+            raise Exception("No entries can be updated due to the pairs parameter being empty or no collection being specified.")
+        
+        operations = [UpdateMany(target, self.BuildUpdateDocument(updatedData), upsert=upsert) for target, updatedData in pairs]
+        
+        # Unless told otherwise, send everything as a single bulk_write. The driver still splits it at the server's batch limit.
+        reports = self.bulk_write(collectionName, operations, chunkSize or max(len(operations), 1), parallel, maxWorkers)
+        
+        totals = {"matchedCount": 0, "modifiedCount": 0, "upsertedCount": 0, "errors": []}
+        for report in reports:
+            totals["matchedCount"] += report["matchedCount"]
+            totals["modifiedCount"] += report["modifiedCount"]
+            totals["upsertedCount"] += report["upsertedCount"]
+            totals["errors"].extend(report["errors"])
+        
+        print(f"{totals['modifiedCount']} record(s) updated by bulk_update.")
+        return totals
+    
+    # Turns the updatedData accepted by the update methods into a MongoDB update document.
+    # Plain field dictionaries are applied as $set, as they always have been; operator documents and pipelines pass through unchanged.
+    # The result is stamped with updatedAtField.
+    # Plain dictionaries of top-level fields become a pipeline that only stamps documents whose values actually change,
+    # so a no-op update isn't counted as a modification. Anything else is stamped unconditionally.
+    def BuildUpdateDocument(self, updatedData):
+        if isinstance(updatedData, list):
+            return self.StampUpdate(updatedData)
+        
+        operatorKeys = [key for key in updatedData if key.startswith("$")]
+        if not operatorKeys:
+            if self.updatedAtField and updatedData and self.updatedAtField not in updatedData and not any("." in key for key in updatedData):
+                return self.ConditionalStampUpdate(updatedData)
+            return self.StampUpdate({"$set": updatedData})
+        if len(operatorKeys) != len(updatedData):
+            raise ValueError("updatedData cannot mix update operators with plain fields.")
+        return self.StampUpdate(updatedData)
+    
+    # Sets updatedAtField on a document about to be inserted, unless the caller already set it.
+    def StampDocument(self, document):
+        if self.updatedAtField and isinstance(document, dict) and self.updatedAtField not in document:
+            document[self.updatedAtField] = datetime.datetime.now(datetime.timezone.utc)
+    
+    # Returns a copy of an update document (or pipeline) that also sets updatedAtField to the server's current time.
+    # Left alone if the update already writes that field itself, since MongoDB rejects two operators on one path.
+    def StampUpdate(self, updateDocument):
+        field = self.updatedAtField
+        if not field:
+            return updateDocument
+        
+        if isinstance(updateDocument, list):
+            return updateDocument + [{"$set": {field: "$$NOW"}}]
+        
+        for fields in updateDocument.values():
+            if isinstance(fields, dict) and field in fields:
+                return updateDocument
+        
+        stamped = dict(updateDocument)
+        stamped["$currentDate"] = dict(updateDocument.get("$currentDate", {}), **{field: True})
+        return stamped
+
+    # Returns a pipeline update that sets the plain fields in updatedData and stamps updatedAtField only if one of them changes value.
+    # Values are wrapped in $literal so strings starting with "$" and nested documents are stored as given, not evaluated.
+    def ConditionalStampUpdate(self, updatedData):
+        field = self.updatedAtField
+        changed = {"$or": [{"$ne": [f"${key}", {"$literal": value}]} for key, value in updatedData.items()]}
+        return [
+            {"$set": {"_stampUpdate": changed}},
+            {"$set": dict({key: {"$literal": value} for key, value in updatedData.items()},
+                          **{field: {"$cond": ["$_stampUpdate", "$$NOW", f"${field}"]}})},
+            {"$unset": "_stampUpdate"}
+        ]
 
     # Create method to implement the D in CRUD.
+    # Removes the first document matching target in a single delete_one; the deleted count already tells us whether it existed.
+    # Return -> The number of objects removed from the collection.
     def delete(self, collectionName, target):
         # First, validate that the 'target' is present.
-        if target is not None and collectionName is not None:
-            # Then confirm that 'target' is in the database.
-            try:
-                collection = self.database[collectionName]
-                targetExists = collection.find_one(target)
-
-            except errors.OperationFailure as operationFailure:
-                print(f"Operation failure while locating records: {operationFailure}")
-            except Exception as exception:
-                print(f"An unexpected exception occurred while locating records: {exception}")             
-                
-            # If 'target' is in the database, purge it.
-            try:
-                if targetExists:
-                    deleteResult = collection.delete_one(target)
-                    if deleteResult.acknowledged:
-                        print(f"{deleteResult.deleted_count} record(s) deleted successfully.")
-                        # Return -> The number of objects removed from the collection.
-                        return deleteResult.deleted_count
-                    else: 
-                        print("Deletion failed; server did not acknowledge delete request.")
-                        return 0
-                # Otherwise, indicate explicitly.
-                else:
-                    print("Target record not found.")
-                    return 0
-                    
-            except errors.OperationFailure as operationFailure:
-                print(f"Operation failure during update: {operationFailure}")
-            except Exception as exception:
-                print(f"An unexpected exception occurred during deletion: {exception}")
-        else:
+        if target is None or collectionName is None:
             raise Exception("No entry can be deleted due to the data parameter being empty or no collection being specified.")
+        
+        try:
+            collection = self.database[collectionName]
+            pendingSummary = self.BeginSummaryUpdate(collectionName, target, limit=1)
+            deletedCount = self.ReportDeleteResult(collection.delete_one(target))
+            self.FinishSummaryUpdate(pendingSummary)
+            return deletedCount
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during deletion: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during deletion: {exception}")
+        finally:
+            # Any cached reads of this collection may now be out of date.
+            self.cache.Invalidate(collectionName)
+        return 0
+    
+    # Removes every document matching target in a single delete_many.
+    # Return -> The number of objects removed from the collection.
+    def delete_many(self, collectionName, target):
+        # First, validate that the 'target' is present.
+        if target is None or collectionName is None:
+            raise Exception("No entries can be deleted due to the data parameter being empty or no collection being specified.")
+        
+        try:
+            collection = self.database[collectionName]
+            pendingSummary = self.BeginSummaryUpdate(collectionName, target)
+            deletedCount = self.ReportDeleteResult(collection.delete_many(target))
+            self.FinishSummaryUpdate(pendingSummary)
+            return deletedCount
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure during delete_many: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during delete_many: {exception}")
+        finally:
+            # Any cached reads of this collection may now be out of date.
+            self.cache.Invalidate(collectionName)
+        return 0
+    
+    # Removes every document matching any of the given filters as one unordered bulk_write.
+    # Return -> {"deletedCount": int, "errors": [...]}, with error indexes pointing into targets.
+    def bulk_delete(self, collectionName, targets, chunkSize=None, parallel=False, maxWorkers=None):
+        # First, validate that the 'targets' are present.
+        if targets is None or collectionName is None:
+            raise Exception("No entries can be deleted due to the targets parameter being empty or no collection being specified.")
+        
+        operations = [DeleteMany(target) for target in targets]
+        
+        # Unless told otherwise, send everything as a single bulk_write. The driver still splits it at the server's batch limit.
+        reports = self.bulk_write(collectionName, operations, chunkSize or max(len(operations), 1), parallel, maxWorkers)
+        
+        totals = {"deletedCount": 0, "errors": []}
+        for report in reports:
+            totals["deletedCount"] += report["deletedCount"]
+            totals["errors"].extend(report["errors"])
+        
+        print(f"{totals['deletedCount']} record(s) deleted by bulk_delete.")
+        return totals
+    
+    # Logs the outcome of a delete_one/delete_many and returns the number of documents removed.
+    def ReportDeleteResult(self, deleteResult):
+        if not deleteResult.acknowledged:
+            print("Deletion failed; server did not acknowledge delete request.")
             return 0
+        
+        if deleteResult.deleted_count == 0:
+            print("Target record not found.")
+        else:
+            print(f"{deleteResult.deleted_count} record(s) deleted successfully.")
+        return deleteResult.deleted_count
+    
+    #########################
+    # Book Summary Maintenance
+    #########################
+    
+    # Marks the book summary stale if collectionName is one it depends on, so it's rebuilt in the background.
+    def MarkSummaryStale(self, collectionName):
+        if self.summary is not None and collectionName in (self.summary.accountsCollection, self.summary.clientsCollection):
+            self.summary.MarkStale()
+    
+    # Records what the accounts a write is about to touch currently contribute to the book summary.
+    # target=None means the write only adds new documents. limit=1 is for writes that only touch the first match (delete_one).
+    # Returns the pending state for FinishSummaryUpdate, or None if the write doesn't affect the summary.
+    # When per-write deltas are off, or the write could touch more than summaryDeltaLimit accounts, nothing is read and
+    # FinishSummaryUpdate just marks the summary stale.
+    def BeginSummaryUpdate(self, collectionName, target, limit=0):
+        if self.summary is None or collectionName not in (self.summary.accountsCollection, self.summary.clientsCollection):
+            return None
+        pending = {"collectionName": collectionName, "accountIds": None, "before": None}
+        if not self.maintainSummary or (target is None and collectionName != self.summary.accountsCollection):
+            return pending
+        
+        try:
+            accountIds = [] if target is None else self.summary.AffectedAccounts(collectionName, target, limit, self.summaryDeltaLimit)
+            if accountIds is None:
+                return pending
+            pending["accountIds"] = accountIds
+            pending["before"] = self.summary.Contributions(accountIds)
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure while reading the book summary contribution: {operationFailure}")
+            pending["accountIds"] = None
+        except Exception as exception:
+            print(f"An unexpected exception occurred while reading the book summary contribution: {exception}")
+            pending["accountIds"] = None
+        return pending
+    
+    # Applies the change in the affected accounts' contribution to the book summary once the write is done,
+    # or marks the summary stale if BeginSummaryUpdate didn't record a contribution (or applying the change fails).
+    # newIds are the _ids of documents the write created (inserts and upserts); they only count when the write was to accounts.
+    def FinishSummaryUpdate(self, pending, newIds=()):
+        if pending is None:
+            return
+        if pending["accountIds"] is None:
+            self.MarkSummaryStale(pending["collectionName"])
+            return
+        
+        try:
+            accountIds = list(pending["accountIds"])
+            if pending["collectionName"] == self.summary.accountsCollection:
+                accountIds += [newId for newId in newIds if newId is not None]
+            self.summary.ApplyDelta(pending["before"], self.summary.Contributions(accountIds))
+        
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure while updating the book summary: {operationFailure}")
+            self.MarkSummaryStale(pending["collectionName"])
+        except Exception as exception:
+            print(f"An unexpected exception occurred while updating the book summary: {exception}")
+            self.MarkSummaryStale(pending["collectionName"])
+    
+    #########################
+    # Diagnostics
+    #########################
+    
+    # Returns the query cache's hit/miss counters and size, for tuning the [Cache] settings.
+    def GetCacheStats(self):
+        return self.cache.GetStats()
     
     # Function to update the security token for the CRUD layer instance.
     # Used for refreshing security tokens for existing users, if needed.
@@ -0,0 +1,329 @@
+# **************************************************
+#
+# Filename: ClientDataCache.py
+# Version: 1.0.0
+# Purpose: Provide an in-process, size- and age-limited cache of query results for the CRUD layer, and a versioned in-memory copy of the clients collection.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Every CRUD layer connected to a database shares that database's QueryCache (see GetSharedQueryCache), so a write through any session
+#   invalidates every session's entries. Writes from other processes are only picked up once the entry's TTL runs out.
+# * Cached results are shared between callers, so they must be treated as read-only.
+# * ClientDimensionCache spots edits through updated_at stamps. Edits made without one (outside tools) are only seen on the next insert or delete.
+#   An unstamped insert paired with a delete leaves the document count unchanged and goes unnoticed until one of them is stamped.
+#
+# **************************************************
+
+# PyMongo
+from pymongo import errors
+
+# Plotting Routines for graphs, charts, etc.
+import pandas as pd
+
+# General utility imports
+from bson import json_util          # For turning filters (which may contain ObjectIds and dates) into stable cache keys
+from collections import OrderedDict # For least-recently-used ordering
+import datetime                     # For the updated_at overlap window
+import threading                    # For guarding the cache against concurrent callbacks
+import time                         # For entry ages
+
+# One QueryCache per database, shared by every CRUD layer in the process, so a write made through one session's CRUD layer
+# invalidates the entries every other session has cached. database name -> QueryCache
+sharedQueryCaches = {}
+sharedQueryCachesLock = threading.Lock()
+
+# Returns the process's QueryCache for databaseName, creating it with the given size and age limits if this is the first caller.
+def GetSharedQueryCache(databaseName, maxEntries=128, ttlSeconds=30):
+
+    with sharedQueryCachesLock:
+        cache = sharedQueryCaches.get(databaseName)
+        if cache is None:
+            cache = QueryCache(maxEntries, ttlSeconds)
+            sharedQueryCaches[databaseName] = cache
+        return cache
+
+class QueryCache:
+
+    """ LRU + TTL cache of query results, invalidated per collection """
+
+    def __init__(self, maxEntries=128, ttlSeconds=30):
+
+        self.maxEntries = maxEntries        # Least-recently-used entries are evicted past this many.
+        self.ttlSeconds = ttlSeconds        # Entries older than this are treated as misses.
+
+        # key -> (storedAt, collections, value). Most recently used entries are kept at the end.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # collection -> number of times it has been invalidated. A read takes these before it queries and hands them back to Put(),
+        # so a result that was read while a write was landing is not cached over the top of that write's invalidation.
+        self.generations = {}
+
+        # Counters for sizing the cache.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.staleResults = 0
+
+    # Builds a cache key from the kind of query, the collection it runs on and its filter or pipeline.
+    # Dictionary keys are sorted so that filters differing only in key order share an entry.
+    # owner keeps results read with different database credentials apart, since a shared cache holds entries for every user.
+    def MakeKey(self, kind, collectionName, query, owner=None):
+        return (owner, kind, collectionName, json_util.dumps(query, sort_keys=True))
+
+    # Returns the cached value for key, or None on a miss or an expired entry.
+    def Get(self, key):
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            storedAt, collections, value = entry
+            if time.monotonic() - storedAt > self.ttlSeconds:
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Returns the current generation of each of the collections. Take it before running the query the result will come from.
+    def Generation(self, collections):
+
+        with self.lock:
+            return {collectionName: self.generations.get(collectionName, 0) for collectionName in collections}
+
+    # Stores value under key. collections is every collection the result was read from,
+    # so that a write to any of them invalidates it.
+    # generation is what Generation(collections) returned before the query ran. If any of the collections has been invalidated since,
+    # the result may predate that write, so it is not stored.
+    def Put(self, key, value, collections, generation=None):
+
+        if self.maxEntries <= 0:
+            return
+
+        with self.lock:
+            if generation is not None and any(self.generations.get(collectionName, 0) != number for collectionName, number in generation.items()):
+                self.staleResults += 1
+                return
+
+            self.entries[key] = (time.monotonic(), frozenset(collections), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drops every entry that was read from collectionName. Called after any write to that collection.
+    def Invalidate(self, collectionName):
+
+        with self.lock:
+            self.generations[collectionName] = self.generations.get(collectionName, 0) + 1
+            stale = [key for key, (storedAt, collections, value) in self.entries.items() if collectionName in collections]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    # Empties the cache entirely. The counters are kept.
+    def Clear(self):
+
+        with self.lock:
+            self.entries.clear()
+
+    # Returns the hit/miss counters and current size.
+    def GetStats(self):
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "maxEntries": self.maxEntries,
+                "ttlSeconds": self.ttlSeconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "staleResults": self.staleResults
+            }
+
+# Returns every collection an aggregation pipeline reads from: the one it runs on plus any $lookup/$unionWith/$graphLookup sources.
+def PipelineCollections(collectionName, pipeline):
+
+    collections = {collectionName}
+
+    def Walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in ("$lookup", "$graphLookup") and isinstance(value, dict) and "from" in value:
+                    collections.add(value["from"])
+                elif key == "$unionWith":
+                    collections.add(value if isinstance(value, str) else value.get("coll"))
+                Walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                Walk(value)
+
+    Walk(pipeline)
+    collections.discard(None)
+    return collections
+
+# Returns the documents in collection stamped since watermark, and the new watermark.
+# The query looks back overlapSeconds, since inserts are stamped by the application's clock and updates by the server's,
+# and writes landing at the same moment can commit slightly out of stamp order. applied maps _id -> the stamp already seen
+# for it within that window, so re-read documents aren't returned twice; it is updated in place and pruned to the window.
+# projection picks the fields returned; the stamp field is always included.
+def ChangedSinceWatermark(collection, field, watermark, applied, overlapSeconds, projection=None):
+
+    query = {field: {"$gte": watermark - datetime.timedelta(seconds=overlapSeconds)}} if watermark else {field: {"$type": "date"}}
+
+    changed = []
+    for document in collection.find(query, dict(projection or {}, **{field: 1})):
+        stamp = document[field]
+        if applied.get(document["_id"]) == stamp:
+            continue
+        applied[document["_id"]] = stamp
+        changed.append(document)
+        if watermark is None or stamp > watermark:
+            watermark = stamp
+
+    # Forget stamps that have fallen out of the overlap window.
+    if watermark is not None:
+        horizon = watermark - datetime.timedelta(seconds=overlapSeconds)
+        for documentId in [documentId for documentId, stamp in applied.items() if stamp < horizon]:
+            del applied[documentId]
+
+    return changed, watermark
+
+class ClientDimensionCache:
+
+    """ In-memory copy of the clients collection keyed by _id, kept current by a cheap version check """
+
+    # fields are the client fields to keep. The version check needs crud.updatedAtField to be stamped on client writes.
+    def __init__(self, crud, fields, collectionName="clients", minCheckSeconds=1.0):
+
+        self.crud = crud
+        self.fields = list(fields)
+        self.collectionName = collectionName
+        self.minCheckSeconds = minCheckSeconds      # Version checks closer together than this reuse the last answer.
+        self.overlapSeconds = 2                     # Re-check this far behind the newest stamp, as the merged frame refresher does.
+
+        # The clients, as a DataFrame indexed by _id so a merge is a single index lookup per account.
+        self.frame = None
+        # The newest updated_at stamp applied, and the stamps applied inside the overlap window behind it.
+        self.latestStamp = None
+        self.recentStamps = {}
+        self.lastChecked = None
+        # Bumped whenever the frame changes.
+        self.version = 0
+        self.lock = threading.Lock()
+
+        # Counters, so we can see how often the cache has to go back to the database.
+        self.fullLoads = 0
+        self.partialRefreshes = 0
+
+    # Returns the clients DataFrame (indexed by _id), refreshing it first if the collection has changed.
+    # The frame is shared, so it must be treated as read-only.
+    def GetFrame(self):
+
+        with self.lock:
+            self.EnsureFresh()
+            return self.frame
+
+    # Reloads only the clients that changed since the last check.
+    # Clients stamped since the newest stamp seen (less the overlap window) are re-read. Deletions leave no stamp, so if the collection's count
+    # no longer matches the frame, the _ids are compared (an index-only read) to drop deleted clients and load any unstamped new ones.
+    def EnsureFresh(self):
+
+        now = time.monotonic()
+        if self.frame is not None and now - self.lastChecked < self.minCheckSeconds:
+            return
+        self.lastChecked = now
+
+        collection = self.crud.database[self.collectionName]
+        field = self.crud.updatedAtField
+
+        try:
+            if self.frame is None:
+                self.FullLoad()
+                return
+
+            changed = False
+            if field:
+                documents, self.latestStamp = ChangedSinceWatermark(collection, field, self.latestStamp, self.recentStamps, self.overlapSeconds, self.Projection())
+                if documents:
+                    updates = self.BuildFrame(documents)
+                    self.frame = pd.concat([self.frame.drop(index=updates.index, errors="ignore"), updates])
+                    changed = True
+
+            if collection.estimated_document_count() != len(self.frame):
+                knownIds = set(self.frame.index)
+                currentIds = {document["_id"] for document in collection.find({}, {"_id": 1})}
+                deletedIds = knownIds - currentIds
+                addedIds = currentIds - knownIds
+                if deletedIds:
+                    self.frame = self.frame.drop(index=list(deletedIds))
+                    changed = True
+                if addedIds:
+                    self.frame = pd.concat([self.frame, self.BuildFrame(list(collection.find({"_id": {"$in": list(addedIds)}}, self.Projection())))])
+                    changed = True
+
+            if changed:
+                self.version += 1
+                self.partialRefreshes += 1
+
+        except errors.PyMongoError as pyMongoError:
+            # Serving slightly stale client names is better than failing the merge, so keep what we have.
+            print(f"Client dimension version check failed; keeping the cached clients: {pyMongoError}")
+
+    # Reloads every client. The stamp watermark is taken first, so anything written during the load is re-read on the next check.
+    def FullLoad(self):
+
+        field = self.crud.updatedAtField
+        collection = self.crud.database[self.collectionName]
+        if field:
+            latest = collection.find_one({field: {"$type": "date"}}, {field: 1}, sort=[(field, -1)])
+            self.latestStamp = latest[field] if latest else None
+
+        documents = list(collection.find({}, self.Projection()))
+        self.frame = self.BuildFrame(documents)
+
+        # Clients already loaded with their current stamp aren't re-read by the next check.
+        self.recentStamps = {}
+        if self.latestStamp is not None:
+            horizon = self.latestStamp - datetime.timedelta(seconds=self.overlapSeconds)
+            self.recentStamps = {document["_id"]: document[field] for document in documents
+                                 if isinstance(document.get(field), datetime.datetime) and document[field] >= horizon}
+        self.version += 1
+        self.fullLoads += 1
+        print(f"Client dimension loaded ({len(self.frame)} clients, version {self.version}).")
+
+    def Projection(self):
+
+        projection = {field: 1 for field in self.fields}
+        if self.crud.updatedAtField:
+            projection[self.crud.updatedAtField] = 1
+        return projection
+
+    def BuildFrame(self, documents):
+
+        return pd.DataFrame(documents, columns=["_id"] + self.fields).set_index("_id")
+
+    # Returns the cache's counters and current version.
+    def GetStats(self):
+
+        with self.lock:
+            return {
+                "version": self.version,
+                "clients": 0 if self.frame is None else len(self.frame),
+                "fullLoads": self.fullLoads,
+                "partialRefreshes": self.partialRefreshes
+            }
@@ -26,6 +26,7 @@ from dash import Dash
 from dash import dcc, html, callback_context
 from dash import dash_table
 from dash.dependencies import Input, Output, State
+from flask import request       # For the client address of login attempts
 import dash_leaflet as dl
 import plotly.express as px
 
@@ -40,6 +41,7 @@ from pymongo import errors
 # General utility imports
 import base64                   # Image encoding
 from datetime import datetime   # Datetime encoding
+import configparser             # For parsing the dashboard settings in the configuration file
 
 # Configure OS routines
 import os
@@ -48,7 +50,32 @@ import os
 from ClientDataCRUD import ClientDataCRUD
 
 # Import Security Layer
-from CS499_Security import SecurityLayer
+from ClientDataSecurity import SecurityLayer
+
+# Import the shared connection pool so it can be shut down with the app
+from ClientDataConnection import GetConnectionManager
+
+# Import the column-wise DataTable serializer
+from ClientDataSerialization import SerializeTableRecords, ConfigureJsonEngine
+
+# Import the memory-compact merged frame schema
+from ClientDataSchema import ApplyFrameSchema
+
+# Import the client dimension cache used by mergeRead
+from ClientDataCache import ClientDimensionCache
+
+# Import the incremental merged-frame refresher and the snapshot engine that serves filters from it
+from ClientDataRefresh import MergedFrameRefresher
+from ClientDataEngine import DashboardDataEngine
+
+# Import the per-session state registry
+from ClientDataSessions import SessionState, SessionStateRegistry
+
+# Import the server-side DataTable query backend
+from ClientDataTableQuery import DataTableQuery
+
+# Import the login rate limiter
+from ClientDataRateLimiter import LoginRateLimiter
 
 #######################################################################################################################################
 
@@ -57,6 +84,8 @@ from CS499_Security import SecurityLayer
 # sl = Integrate the SecurityLayer for verification.
 
 # Whenever initiating contact with external elements, try-catch is a good idea.
+# sl stays None if the SecurityLayer can't be created, so the rest of the module can still load and report it.
+sl = None
 try:
     sl = SecurityLayer()
     
@@ -65,11 +94,38 @@ except errors.OperationFailure as operationFailure:
 except Exception as exception:
     print(f"An unexpected exception occurred during dashboard initialization: {exception}") 
 
-# These will be established once login is verified:
-# db = Connect to database via CRUD Module
-# df = A DataFrame containing the data from the database
-db = None
-df = None
+# Dashboard settings. Missing settings fall back to rebuilding the data from scratch on every filter change.
+dashboardConfig = configparser.ConfigParser()
+dashboardConfig.read("./config/CS499_secure.ini")
+incrementalRefresh = dashboardConfig.getboolean("Refresh", "INCREMENTAL", fallback=False)
+refreshMode = dashboardConfig.get("Refresh", "MODE", fallback="auto")
+refreshInterval = dashboardConfig.getfloat("Refresh", "INTERVAL_SECONDS", fallback=5)
+
+# Table mode. "native" sends the whole filtered book to the browser, which sorts, filters and pages it itself.
+# "server" has MongoDB sort, filter and page it instead, and only sends the page being looked at.
+serverTable = dashboardConfig.get("Table", "MODE", fallback="native").strip().lower() == "server"
+tableAction = "custom" if serverTable else "native"
+
+# The two modes are exclusive: the server-side table reads every page from MongoDB, so the incremental refresher would only sit idle.
+if serverTable and incrementalRefresh:
+    print("Warning: [Table] MODE = server and [Refresh] INCREMENTAL = true are both set. The server-side table takes precedence; incremental refresh is off.")
+    incrementalRefresh = False
+
+# Login attempts are limited per client address and per username before anything reaches the database,
+# so a credential-stuffing burst is turned away in memory. See the [RateLimit] settings.
+loginLimiter = LoginRateLimiter.FromConfig(dashboardConfig)
+
+# Each logged-in session's CRUD layer and data live in the session registry, keyed by the SecurityLayer session UUID,
+# so concurrent users never overwrite each other's connection or dataset. See InitializeCRUDLayer and GetSessionState.
+# Idle sessions are dropped when the SecurityLayer would expire them anyway (after its default 600 seconds if it failed to start),
+# and identical filter results are shared between the same user's sessions for as long as the CRUD layer would cache them.
+sessions = SessionStateRegistry(
+    maxSessions=dashboardConfig.getint("Sessions", "MAX_SESSIONS", fallback=256),
+    maxFrames=dashboardConfig.getint("Sessions", "MAX_FRAMES", fallback=16),
+    idleSeconds=sl.sessionLifespan if sl is not None else 600,
+    snapshotSeconds=dashboardConfig.getfloat("Sessions", "SNAPSHOT_SECONDS", fallback=dashboardConfig.getfloat("Cache", "TTL_SECONDS", fallback=30)),
+    warmupWorkers=dashboardConfig.getint("Sessions", "WARMUP_WORKERS", fallback=4)
+)
 
 
 #########################
@@ -79,6 +135,9 @@ df = None
 # Set up the Dash framework, layout declarations, and state storage.
 app = Dash(__name__)
 
+# Have Dash encode callback responses with orjson when it's installed.
+ConfigureJsonEngine()
+
 #########################
 # Login Layout / View
 #########################
@@ -136,6 +195,12 @@ dashboardLayout = html.Div(style={'max-width':'80%', 'margin':'auto'}, children=
     html.Center(html.B(html.H1('CS-499 Dashboard'))),
     html.Center(html.H3('Written by Jason Holmes')),
     html.Hr(),
+    # Progress of the session's data warm-up after login. The interval polls it until the data is ready.
+    html.Div(id='warmup-status'),
+    dcc.Interval(id='warmup-interval', interval=500, disabled=True),
+    # Headline numbers per account class, read from the book_summary collection.
+    html.Div(id='summary-tiles', style={'display':'flex','flexDirection':'row','justifyContent':'space-between'}),
+    html.Hr(),
     html.Div(
         # Radio buttons used for the custom filters.
         dcc.RadioItems(
@@ -167,17 +232,17 @@ dashboardLayout = html.Div(style={'max-width':'80%', 'margin':'auto'}, children=
                             {"name": "RMD Amount", "id":"rmd_amount", "deletable": False, "selectable": True},
                             {"name": "Days since Last Review", "id":"days_since_last_review", "deletable": False, "selectable": True}
                         ],
-                         data=df.to_dict('records') if df is not None else {},
+                         data=[],
                          editable=False,
-                         filter_action="native",
-                         sort_action="native",
+                         filter_action=tableAction,
+                         sort_action=tableAction,
                          sort_mode="multi",
                          column_selectable=False,
                          row_selectable="single",
                          selected_rows=[0],
                          row_deletable=False,
                          selected_columns=[],
-                         page_action="native",
+                         page_action=tableAction,
                          page_current=0,
                          page_size=50
                         ),
@@ -189,6 +254,8 @@ dashboardLayout = html.Div(style={'max-width':'80%', 'margin':'auto'}, children=
 
 app.layout = html.Div([
     dcc.Store(id='login-state', data='login'),
+    dcc.Store(id='session-store', storage_type='session'),     # The SecurityLayer session (UUID and token) for this browser tab.
+    dcc.Store(id='data-ready'),                                 # Set to the session UUID once the session's data has finished warming up.
     dcc.Location(id='url'),
     
     html.Div(id='login-layout', style={'display':'block'}, children=[
@@ -214,6 +281,7 @@ app.layout = html.Div([
 # Pass the login credentials that were input into the SecurityLayer for verification.
 @app.callback(
     Output('login-state', 'data', allow_duplicate=True),              # Updates the dcc.Store login-state on success.
+    Output('session-store', 'data'),          # Hands the session UUID and token to this browser tab, identifying it on later callbacks.
     [Input('login-button', 'n_clicks')],     # Activates upon the login-button's 'n_clicks' value changing
     # Pulls the value of these inputs as arguments for the function.
     [State('login-state', 'data'), State('username-input', 'value'), State('password-input', 'value')],
@@ -223,26 +291,33 @@ def AuthenticateUser(n_clicks, loginState, username, password):
     print(f"Login button click detected. Authenticating {username} input credentials.")
     # Only authenticate once the login button has been clicked
     if n_clicks > 0:
+        # Turn the attempt away if this address or username has been trying too often, before any database work.
+        if not loginLimiter.Allow(request.remote_addr, username):
+            return "rateLimited", None
+        
+        # Without a security layer there is nothing to check the credentials against.
+        if sl is None:
+            print(f"Login for user {username} refused: the security layer failed to initialize.")
+            return "failedLogin", None
+        
         # Request the security layer authenticate the provided credentials.
-        # Returns True on valid credentials, False otherwise.
+        # Returns True on valid credentials, False otherwise. Failed attempts and lockouts are recorded by the security layer itself.
         if sl.AuthenticateUser(username, password):
             # Login successful
             print(f"Login validation successful for user {username}.")
             # Store the security token from the security layer.
             session = sl.LoginSuccess(username)
-            # Initialize the CRUD layer using the verified credentials
+            # Initialize this session's CRUD layer using the verified credentials
             InitializeCRUDLayer(username, password, session)
-            # Return the string that requests the dashboard layout.
-            return "dashboard"
+            # Return the string that requests the dashboard layout, along with the session for the browser to hold on to.
+            return "dashboard", session
         else:
-            # Login failed
+            # Login failed. The security layer has already recorded the failure against the user.
             print(f"Login validation failed for user {username}.")
-            # Report the login failure.
-            sl.LoginFailure(username)
-            return "failedLogin"
+            return "failedLogin", None
     # If somehow we get here and don't have the credentials to login, return to the login layout.
     else:
-        return "login"
+        return "login", None
         
 # Update a div indicating a failed login.
 @app.callback(
@@ -258,6 +333,8 @@ def UpdateLoginResults(loginState):
         return html.Div("Registration failed. Please try again.")
     elif loginState == "loginFailure":
         return html.Div("Login failed. Incorrect username or password.")
+    elif loginState == "rateLimited":
+        return html.Div("Too many login attempts. Please wait a minute and try again.")
     else:
         return html.Div("Login failed. Please try again.")
     
@@ -275,6 +352,9 @@ def HandleRegistration(registerClicks, username, password):
 
     # Handle the user registration through the security layer.
     # All new users have the readWrite permissions for now, but it would be simple to expand this with proper read-only functionality.
+    if sl is None:
+        print(f"Registration of {username} refused: the security layer failed to initialize.")
+        return "registrationFailure"
     result = sl.RegisterUser(username, password, "readWriteCustom")
     if (result):
         print(f"Success in registering admin {username}.")
@@ -284,19 +364,18 @@ def HandleRegistration(registerClicks, username, password):
         print(f"Failure to register admin {username}.")
         return "registrationFailure"
 
-# Function to initialize CRUD layer. Called only after login verification of the credentials is successful.
-def InitializeCRUDLayer(username, password, token):
-    
-    # Pull references to these from the overall program to prevent them from being locked in this scope.
-    global db
-    global df
+# Function to initialize a session's CRUD layer. Called only after login verification of the credentials is successful.
+# Each session gets its own CRUD layer, registered under its session UUID. The data services behind the filters are shared between sessions
+# of the same user (see SharedKey).
+# Opening the CRUD layer and loading the data happen on a background worker (see WarmUpSession), so the login returns straight away
+# and the dashboard polls the session's progress until the data is ready.
+def InitializeCRUDLayer(username, password, session):
     
     try:
-        print(f"Initializing CRUD layer.")
-        db = ClientDataCRUD(sl, token, username, password)
-        print(f"Initializing mergeRead.")
-        df = mergeRead()
-        return html.Div("CRUD layer initialized.")
+        print(f"Initializing CRUD layer for session {session['UUID']}.")
+        state = sessions.Register(SessionState(session["UUID"], username))
+        sessions.StartWarmup(state, lambda state: WarmUpSession(state, username, password, session))
+        return html.Div("CRUD layer initializing.")
     
     except errors.OperationFailure as operationFailure:
         print(f"Operation failure during CRUD initialization: {operationFailure}")
@@ -305,6 +384,105 @@ def InitializeCRUDLayer(username, password, token):
         
     return html.Div()
 
+# Opens a session's CRUD layer and loads the data its first view needs, reporting progress as it goes. Runs on a warm-up worker.
+# Anything raised here marks the session's data as failed to load.
+def WarmUpSession(state, username, password, session):
+    
+    state.ReportProgress(0.1, "Connecting to the database")
+    crud = ClientDataCRUD(sl, session, username, password)
+    if crud.database is None:
+        raise Exception("Unable to connect to the database.")
+    state.crud = crud
+    
+    # In incremental mode, one refresher loads the merged frame once and then applies changes in the background,
+    # while one engine answers the user's filter clicks from a snapshot of it without going back to the database.
+    # Both are shared by all of the user's sessions and stopped once the last of them is gone.
+    if serverTable:
+        # The server-side table reads each page as it's asked for, so only the first page is fetched (and cached) up front.
+        state.ReportProgress(0.5, "Reading the first page")
+        state.tableQuery = DataTableQuery(crud, accountColumns, clientColumns)
+        state.tableQuery.GetPage(0, crud.defaultPageSize)
+    elif incrementalRefresh:
+        state.ReportProgress(0.3, "Loading the book")
+        engine = GetEngine(state)
+        state.ReportProgress(0.8, "Building the snapshot")
+        engine.GetView('reset')
+    else:
+        state.ReportProgress(0.3, "Loading clients")
+        GetClientDimension(state).GetFrame()
+        state.ReportProgress(0.6, "Loading accounts")
+        sessions.GetSnapshot(state, SharedKey(state, "filter", "reset"), lambda: FilterFrame(state, "reset"))
+
+# Returns the registry key for a shared service or snapshot. Keys include the username, because a shared service reads through
+# the CRUD layer (and so the MongoDB credentials) of the session that built it. Sessions of different users never share one,
+# so nobody is served data through someone else's credentials, even after the session that built it has gone.
+def SharedKey(state, *parts):
+    
+    return (state.username,) + parts
+
+# Returns the user's shared snapshot engine, starting the incremental refresher behind it if this is the first of their sessions to need it.
+# The refresher is stopped once the last session holding the engine is gone.
+def GetEngine(state):
+    
+    def StartEngine():
+        print(f"Initializing incremental refresher.")
+        refresher = MergedFrameRefresher(state.crud, accountColumns, clientColumns, refreshMode)
+        refresher.Load()
+        refresher.Start(refreshInterval)
+        return DashboardDataEngine(refresher)
+    
+    return sessions.GetShared(state, SharedKey(state, "engine"), StartEngine, lambda engine: engine.refresher.Stop())
+
+# Returns the user's shared client dimension cache used by mergeRead, loading it if this is the first of their sessions to need it.
+def GetClientDimension(state):
+    
+    return sessions.GetShared(state, SharedKey(state, "clientDimension"), lambda: ClientDimensionCache(state.crud, clientColumns + ["last_review_date"]))
+
+# Returns the registered state for the session a browser tab is holding, or None if the session isn't valid (anymore).
+# Every data callback goes through this, so each request is checked against the SecurityLayer.
+# Unless requireReady is False, sessions whose data is still warming up are treated as not there yet.
+def GetSessionState(session, requireReady=True):
+    
+    if not session:
+        return None
+    
+    # No session can be validated without a security layer.
+    if sl is None:
+        print(f"Session {session.get('UUID')} refused: the security layer failed to initialize.")
+        return None
+    
+    if not sl.ValidateSession(session.get("UUID"), session.get("token")):
+        print(f"Session {session.get('UUID')} failed validation.")
+        sessions.Remove(session.get("UUID"))
+        return None
+    
+    state = sessions.Get(session["UUID"])
+    if state is None or (requireReady and not state.IsReady()):
+        return None
+    return state
+
+# Reports the session's data warm-up progress while it loads, and marks the data ready once it has.
+# The login sets the session store and returns immediately; this keeps polling until the warm-up finishes.
+@app.callback(
+    Output('warmup-status', 'children'),
+    Output('data-ready', 'data'),
+    Output('warmup-interval', 'disabled'),
+    [Input('session-store', 'data'), Input('warmup-interval', 'n_intervals')]
+)
+def PollWarmup(session, n_intervals):
+    
+    state = GetSessionState(session, requireReady=False)
+    if state is None:
+        return html.Div(), None, True
+    
+    if state.IsReady():
+        return html.Div(), state.sessionID, True
+    if state.status == "failed":
+        return html.Div(f"Unable to load the dashboard data. {state.message}"), None, True
+    
+    # Still loading: show how far along it is and keep polling.
+    return html.Div(f"Loading dashboard data: {state.message} ({state.progress:.0%})"), None, False
+
 # Finally, After login verification, return the correct layout based on the login result.
 @app.callback(
     Output('login-layout', 'style'),
@@ -314,7 +492,7 @@ def InitializeCRUDLayer(username, password, token):
 def SwitchLayout(loginState):
     # The login function should return either "/login" or "/dashboard" for a failed or successful login respectively.
     print(f"Login state is {loginState}")
-    if loginState == "login" or loginState == "failedLogin":    
+    if loginState == "login" or loginState == "failedLogin" or loginState == "rateLimited":    
         print(f"Displaying login layout.")
         
         # We return both of the layouts simultaneously through the callback.
@@ -337,89 +515,128 @@ def SwitchLayout(loginState):
 # Data Manipulation / Model
 ###########################
 
+# The account and client fields the DataTable displays. days_since_last_review is derived alongside them.
+accountColumns = ["account_nickname", "account_class", "account_value", "cash_available", "ytd_distributions", "rmd_amount"]
+clientColumns = ["first_name", "last_name"]
+displayColumns = clientColumns + accountColumns + ["days_since_last_review"]
+
 # The mergeRead function reduces redundancy, since we'll need to pull data like this quite often for most dashboard purposes.
 # It will let us request data and strip it of ObjectIds before it goes to the dashboard.
-def mergeRead(filter_data=None):
+# client_filter optionally restricts the results to accounts whose client matches it, evaluated in MongoDB.
+# state is the session's registered state; its CRUD layer does the reading.
+def mergeRead(state, filter_data=None, client_filter=None):
 
-    if db is None:
+    if state is None or state.crud is None:
         print("MergeRead called before database connection. Returning.")
         return
+    
+    db = state.crud
         
     if filter_data is None:
         print("Filter data is empty. Returning all results.")
         filter_data = {}
         
+    # Client-side conditions are resolved to a list of matching client _ids first, so the accounts query stays a plain indexed filter.
+    if client_filter is not None:
+        clientIds = [client["_id"] for client in db.read("clients", client_filter, {"_id": 1})]
+        clientMatch = {"client_id": {"$in": clientIds}}
+        filter_data = {"$and": [filter_data, clientMatch]} if filter_data else clientMatch
+        
     print(f"MergeRead called. filter_data: {filter_data}")
-    # Since the dashboard will be using data from both collections, we'll get data frames from both collections according to the requisite data.
-    accounts_df = pd.DataFrame(db.read("accounts",filter_data))
-    clients_df = pd.DataFrame(db.read("clients",{}))
+    # The dashboard uses data from both collections. Only the filtered accounts are read from the database;
+    # their clients come from the client dimension cache, which only goes back to the database when the clients collection has changed.
+    accountProjection = dict.fromkeys(["client_id"] + accountColumns, 1)
+    accounts_df = pd.DataFrame(db.read("accounts", filter_data, accountProjection), columns=["client_id"] + accountColumns)
+    clients_df = GetClientDimension(state).GetFrame()
     
-    # We'll merge the two into a single data frame based on the shared client_id fields.
-    merged_df = pd.merge(accounts_df, clients_df, left_on="client_id", right_on="_id", how="left")
-        
-    # Finally, we'll double-check and make sure to strip the ObjectId fields before returning it. inplace allows us to do so with the existing data object.
-    merged_df.drop(columns=['_id_x', '_id_y', 'client_id'],inplace=True)
+    # Join each account to its client with an index lookup on the client's _id.
+    if clients_df is None:
+        print("Client dimension unavailable. Client columns will be empty.")
+        clients_df = pd.DataFrame(columns=clientColumns + ["last_review_date"])
+    merged_df = accounts_df.join(clients_df, on="client_id")
     
     # This is a good place to insert derived values that depend on both the client and account data.
-    # We're just going to add days_since_last_review here but this would be a good place for other elements too.
-    
-    # First we have to convert the last_review_date to a proper datetime
-    merged_df['last_review_date'] = pd.to_datetime(merged_df['last_review_date'])
-    
-    # Now we get the difference between the last_review_date and today. We'll make a new, temporary column to store the days_since_last_review field.
+    # days_since_last_review is the difference between the last_review_date and today, in whole days.
     today = datetime.now()
-    merged_df['days_since_last_review'] = (today - merged_df['last_review_date']).dt.days
+    merged_df['days_since_last_review'] = (today - pd.to_datetime(merged_df['last_review_date'], errors='coerce')).dt.days
     
-    # With the derived data added, we're now safe to return the data for any use.
+    # With the derived data added, strip everything the table doesn't display (including the ObjectIds and SSNs)
+    # and convert the rest to the compact merged-frame schema before returning it.
     
-    return merged_df
+    return ApplyFrameSchema(merged_df)
 
 ###########################
 # Dashboard Callbacks
 ###########################
    
 # Update Dashboard on filter application
-@app.callback(
-    Output('datatable-id','data'),
-    [Input('filter-type', 'value')]
-)
-def update_dashboard(filter_type):
+# Registered for the native table mode at the end of this section; the data-ready input also fills the table as soon as the session's data has loaded.
+def update_dashboard(filter_type, ready, session):
     print(f"Attempting to update_dashboard. Filter type: {filter_type}")
     
+    # Everything below runs against this session's own state. No valid session, no data.
+    state = GetSessionState(session)
+    if state is None:
+        print("No valid session. Returning no data.")
+        return []
+    
+    # In incremental mode, the shared engine slices its in-memory snapshot with a precomputed mask for the filter.
+    # The database is only read by the background refresher, and only when something has changed.
+    if incrementalRefresh:
+        return SerializeTableRecords(GetEngine(state).GetView(filter_type), displayColumns)
+    
+    # Otherwise, every one of the user's sessions asking for the same filter shares one read-only snapshot of its results,
+    # built by whichever session asks first and rebuilt once it's older than the registry's snapshot age.
+    df = sessions.GetSnapshot(state, SharedKey(state, "filter", filter_type), lambda: FilterFrame(state, filter_type))
+    
+    # Now we just need to return the data to be displayed per the provided specifications.
+    # The serializer builds the rows column by column, rounds money to cents and leaves out anything the table doesn't show.
+    data=SerializeTableRecords(df, displayColumns)
+    
+    #return (data,columns)
+    # print(f"Data returning from update_dashboard callback: {data}")
+    return data
+
+# Reads the merged rows for one of the dashboard's filter options from the database, using the session's CRUD layer.
+def FilterFrame(state, filter_type):
+    
+    filter_data, client_filter = FilterConditions(state, filter_type)
+    return pd.DataFrame(mergeRead(state, filter_data, client_filter))
+
+# Returns the (account filter, client filter) pair for one of the dashboard's filter options.
+# Both mergeRead and the server-side table query apply these, so each filter is only defined once.
+def FilterConditions(state, filter_type):
+    
     # We prepared various filter options for accounts and clients, as well as a reset option. We will need to implement filters for each of these options using the 'value' we designated for each button.
     
     # Retirement Accounts
     if filter_type == 'retirement':
         # Using the same setup that called the records before, we can apply the specific filter details.
-        df = pd.DataFrame(mergeRead({
+        return {
             "account_class": "retirement"
-        }))    
-        #df.drop(columns=['_id', 'client_id'],inplace=True)
+        }, None
 
     # Non-Retirement Accounts
     elif filter_type == 'nonRetirement':
         # Each filter functions the same as the first but with different filter details.
-        df = pd.DataFrame(mergeRead({
+        return {
             "account_class": "non-retirement"
-        }))
-        
-        # Using a similar action as the RMDs editing columns, we can drop irrelevant details.
-        # df.drop(columns=['rmd_amount'], inplace=True)
+        }, None
     
     # Required Minimum Distributions
     elif filter_type == "RMDs":
-        df = pd.DataFrame(mergeRead({
+        return {
             "account_class": "retirement",
             "rmd_amount":{"$gt":0}        # An RMD amount should only be calculated for eligible accounts, so we can just look for a positive value.
-        }))
+        }, None
                 
     # Overdue Reviews - accounts with days_since_last_review over 365.
     # However, days_since_last_review is best as a derived value, so it isn't stored.
     # This makes the request a little more complicated, but not by much.
     elif filter_type == "reviews":
-        # MergeRead derives the information for us, but since it's derived, we can't submit it as a filter, so we have to get the whole group and then do our own filtering.
-        df = pd.DataFrame(mergeRead())
-        df = df[df["days_since_last_review"] >= 365]
+        # days_since_last_review >= 365 is the same as last_review_date falling on or before a cutoff a year ago,
+        # so MongoDB can select the overdue clients by index and only their accounts ever leave the database.
+        return None, state.crud.DaysSinceFilter("last_review_date", 365)
                
     # Reset
     else:
@@ -427,16 +644,87 @@ def update_dashboard(filter_type):
         # Since the result of a reset shows everything, it works just fine to only check for the specific filters
         # and treat all other results as a reset command.
         # To reset we just need to remove the filters, so we just need to get the 'all records' read again.
-        
-        df = pd.DataFrame(mergeRead())
-        
-    # Now we just need to return the data to be displayed per the provided specifications
-    data=df.to_dict('records')
+        return None, None
+
+# Update one page of the table in the server-side table mode.
+# The filter buttons, the table's own filter and sort, and its page controls all land here, and only the requested page is read.
+def update_table_page(filter_type, ready, page_current, page_size, sort_by, filter_query, session):
+    print(f"Attempting to update_table_page. Filter type: {filter_type}, page: {page_current}, sort: {sort_by}, filter: {filter_query}")
     
-    #return (data,columns)
-    # print(f"Data returning from update_dashboard callback: {data}")
-    return data
+    state = GetSessionState(session)
+    if state is None:
+        print("No valid session. Returning no data.")
+        return [], 1, 0
+    
+    # A new filter changes which rows there are, so start again from the first page.
+    triggered = [trigger["prop_id"] for trigger in callback_context.triggered]
+    if "filter-type.value" in triggered or "datatable-id.filter_query" in triggered:
+        page_current = 0
+    
+    # The session keeps one table query, so paging forward resumes from where the previous page ended.
+    if state.tableQuery is None:
+        state.tableQuery = DataTableQuery(state.crud, accountColumns, clientColumns)
+    
+    filter_data, client_filter = FilterConditions(state, filter_type)
+    page = state.tableQuery.GetPage(page_current, page_size, sort_by, filter_query, filter_data, client_filter)
+    
+    # The page goes through the same schema and serializer as the native table, so the values look identical in both modes.
+    data = SerializeTableRecords(ApplyFrameSchema(pd.DataFrame(page["rows"])), displayColumns)
+    return data, page["pageCount"], page["pageCurrent"]
+
+# Register whichever table callback the configured table mode uses. Both write the table's data, so only one can be registered.
+if serverTable:
+    app.callback(
+        Output('datatable-id', 'data'),
+        Output('datatable-id', 'page_count'),
+        Output('datatable-id', 'page_current'),
+        [Input('filter-type', 'value'), Input('data-ready', 'data'),
+         Input('datatable-id', 'page_current'), Input('datatable-id', 'page_size'),
+         Input('datatable-id', 'sort_by'), Input('datatable-id', 'filter_query')],
+        [State('session-store', 'data')]
+    )(update_table_page)
+else:
+    app.callback(
+        Output('datatable-id','data'),
+        [Input('filter-type', 'value'), Input('data-ready', 'data')],
+        [State('session-store', 'data')]
+    )(update_dashboard)
+    
+# Update the summary tiles once the session's data is ready, and again whenever a filter is clicked.
+# The tiles come from the materialized book_summary collection, so this is one small read however large the book is.
+@app.callback(
+    Output('summary-tiles', 'children'),
+    [Input('data-ready', 'data'), Input('filter-type', 'value')],
+    [State('session-store', 'data')]
+)
+def update_summary_tiles(ready, filter_type, session):
+    print(f"Attempting to update_summary_tiles.")
     
+    state = GetSessionState(session)
+    if state is None or state.crud.summary is None:
+        return []
+    
+    try:
+        tiles = state.crud.summary.Read()
+    except errors.OperationFailure as operationFailure:
+        print(f"Operation failure while reading the book summary: {operationFailure}")
+        return []
+    except Exception as exception:
+        print(f"An unexpected exception occurred while reading the book summary: {exception}")
+        return []
+    
+    return [SummaryTile(row) for row in tiles["classes"] + [tiles["total"]]]
+
+# Lays out one summary tile.
+def SummaryTile(row):
+    return html.Div(style={'border':'2px solid #2196F3', 'border-radius':'8px', 'margin':'5px', 'padding':'10px', 'flex':'1'}, children=[
+        html.B(str(row["account_class"]).replace("-", " ").title()),
+        html.Div(f"AUM: ${row['totalValue']:,.2f} ({row['accountCount']} accounts)"),
+        html.Div(f"Cash Available: ${row['cashAvailable']:,.2f}"),
+        html.Div(f"Outstanding RMDs: ${row['rmdOutstanding']:,.2f} ({row['rmdAccounts']} accounts)"),
+        html.Div(f"Overdue Reviews: {row['overdueReviews']} accounts")
+    ])
+
 #############################################
 # Interaction Between Components / Controller
 # Style Callbacks
@@ -474,4 +762,16 @@ def update_styles(selected_columns):
 # app.run_server must be called last.
 #########################
 
-app.run_server(debug=False)
\ No newline at end of file
+app.run_server(debug=False)
+
+# Drop every session, which stops the shared background refresher before the connection pool goes away underneath it.
+sessions.CloseAll()
+
+# Stop the session reaper and write any pending session activity back to the session store,
+# then shut down the password hashing workers.
+if sl is not None:
+    sl.CloseSessions()
+    sl.ClosePasswordHasher()
+
+# Once the server stops, close every pooled database client so sockets and monitor threads are released cleanly.
+GetConnectionManager().CloseAll()
@@ -0,0 +1,101 @@
+# **************************************************
+#
+# Filename: ClientDataEngine.py
+# Version: 1.0.0
+# Purpose: Serve every dashboard filter from one in-memory snapshot of the merged book, so switching filters never touches the database.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The snapshot is only as fresh as the refresher behind it. With the background refresh running, that is at most one refresh interval old.
+#
+# **************************************************
+
+# General utility imports
+import threading    # For guarding snapshot rebuilds against concurrent callbacks
+
+#########################
+# Built-in Filters
+#########################
+
+# Each filter maps the dashboard's radio button value to a function returning a boolean mask over the merged frame.
+# 'reset' (or any unknown value) shows every row and needs no mask.
+# Missing values (e.g. no rmd_amount on a non-retirement account) never match.
+BUILTIN_FILTERS = {
+    "retirement": lambda frame: (frame["account_class"] == "retirement").to_numpy(dtype=bool, na_value=False),
+    "nonRetirement": lambda frame: (frame["account_class"] == "non-retirement").to_numpy(dtype=bool, na_value=False),
+    "RMDs": lambda frame: ((frame["account_class"] == "retirement") & (frame["rmd_amount"] > 0)).to_numpy(dtype=bool, na_value=False),
+    "reviews": lambda frame: (frame["days_since_last_review"] >= 365).to_numpy(dtype=bool, na_value=False),
+}
+
+class DashboardDataEngine:
+
+    """ One merged snapshot per data version, with a precomputed mask for each filter """
+
+    def __init__(self, refresher, filters=None):
+
+        # The refresher owns the data and bumps its version whenever the data changes.
+        self.refresher = refresher
+        self.filters = dict(BUILTIN_FILTERS if filters is None else filters)
+
+        # The current snapshot: the data version it was built from, the frame, each filter's mask, and each filter's sliced view.
+        self.version = None
+        self.frame = None
+        self.masks = {}
+        self.views = {}
+        self.lock = threading.Lock()
+
+        # Counters, so we can see how often clicks are served straight from the snapshot.
+        self.snapshotBuilds = 0
+        self.viewHits = 0
+
+    # Rebuilds the snapshot if the refresher has moved on to a new data version. This is purely in-memory.
+    def EnsureSnapshot(self):
+
+        if self.version == self.refresher.version and self.frame is not None:
+            return
+
+        # Read the version first. If the data changes while we build, the newer version is picked up on the next call.
+        version = self.refresher.version
+        frame = self.refresher.Frame()
+        if frame is None:
+            return
+
+        self.masks = {name: mask(frame) for name, mask in self.filters.items()}
+        self.views = {}
+        self.frame = frame
+        self.version = version
+        self.snapshotBuilds += 1
+        print(f"Dashboard snapshot rebuilt for data version {version} ({len(frame)} rows).")
+
+    # Returns the rows for a filter option as a DataFrame. Unknown filter values return every row, like 'reset'.
+    # The returned frame is shared with the snapshot, so it must be treated as read-only.
+    def GetView(self, filterType):
+
+        with self.lock:
+            self.EnsureSnapshot()
+            if self.frame is None:
+                return None
+
+            view = self.views.get(filterType)
+            if view is not None:
+                self.viewHits += 1
+                return view
+
+            mask = self.masks.get(filterType)
+            view = self.frame if mask is None else self.frame[mask]
+            self.views[filterType] = view
+            return view
+
+    # Returns the engine's counters and current version.
+    def GetStats(self):
+
+        with self.lock:
+            return {
+                "version": self.version,
+                "rows": 0 if self.frame is None else len(self.frame),
+                "snapshotBuilds": self.snapshotBuilds,
+                "viewHits": self.viewHits
+            }
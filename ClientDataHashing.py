@@ -0,0 +1,183 @@
+# **************************************************
+#
+# Filename: ClientDataHashing.py
+# Version: 1.0.0
+# Purpose: Hash and verify login passwords with a salted, tunable key derivation function (scrypt or PBKDF2),
+#          run in a bounded pool of worker processes so the dashboard's request threads aren't tied up doing the math.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The caller still waits for its own hash to finish; the pool only keeps the work (and its CPU) off the web process
+#   and caps how many hashes run at once.
+# * Worker processes are forked. Where fork isn't available (Windows), the dashboard script would be re-imported in every spawned worker,
+#   so the pool falls back to threads there. hashlib releases the GIL while it derives keys, so threads still run hashes in parallel.
+# * Legacy unsalted SHA-256 hashes are still accepted so existing users can log in. They are replaced on each user's next successful login.
+#
+# **************************************************
+
+# General utility imports
+import base64                                       # For storing salts and hashes as text
+import hashlib                                      # For scrypt, PBKDF2 and the legacy SHA-256
+import multiprocessing                              # For choosing how worker processes are started
+import os                                           # For the worker count
+import secrets                                      # For salts and constant-time comparison
+import threading                                    # For bounding the number of hashes in flight
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor   # For running the key derivation off the caller's thread
+
+# Default cost settings. These are used unless the [Hashing] section of the configuration file overrides them.
+# scrypt's memory use is 128 * n * r bytes per hash (16 MiB with these values).
+DEFAULT_PARAMETERS = {
+    "scrypt": {"n": 16384, "r": 8, "p": 1},
+    "pbkdf2_sha256": {"i": 600000},
+}
+
+# Bytes of salt and of derived key.
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+# Derives the key for a password. Runs in a worker process, so it must stay a plain module-level function.
+def DeriveKey(algorithm, parameters, password, salt):
+
+    if algorithm == "scrypt":
+        n, r, p = parameters["n"], parameters["r"], parameters["p"]
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=KEY_SIZE)
+    if algorithm == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, parameters["i"], dklen=KEY_SIZE)
+    raise ValueError(f"Unknown password hashing algorithm: {algorithm}")
+
+# Formats a stored hash: algorithm$parameters$salt$hash, e.g. scrypt$n=16384,r=8,p=1$<salt>$<hash>.
+def FormatHash(algorithm, parameters, salt, key):
+
+    parameterText = ",".join(f"{name}={value}" for name, value in parameters.items())
+    return f"{algorithm}${parameterText}${base64.b64encode(salt).decode()}${base64.b64encode(key).decode()}"
+
+# Splits a stored hash back into (algorithm, parameters, salt, key). Returns None if it isn't in the algorithm$parameters$salt$hash format.
+def ParseHash(storedHash):
+
+    parts = (storedHash or "").split("$")
+    if len(parts) != 4 or parts[0] not in DEFAULT_PARAMETERS:
+        return None
+
+    try:
+        parameters = {name: int(value) for name, value in (pair.split("=") for pair in parts[1].split(","))}
+        return parts[0], parameters, base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    except ValueError:
+        return None
+
+# True if a stored hash is a legacy, unsalted SHA-256 hex digest.
+def IsLegacyHash(storedHash):
+
+    return isinstance(storedHash, str) and len(storedHash) == 64 and all(character in "0123456789abcdef" for character in storedHash)
+
+class PasswordHasher:
+
+    """ Salted KDF password hashing in a bounded process pool """
+
+    def __init__(self, algorithm="scrypt", parameters=None, maxWorkers=None, maxPending=None):
+
+        if algorithm not in DEFAULT_PARAMETERS:
+            raise ValueError(f"Unknown password hashing algorithm: {algorithm}")
+
+        # The algorithm and cost new hashes are made with. Stored hashes made with anything else are upgraded on login.
+        self.algorithm = algorithm
+        self.parameters = dict(DEFAULT_PARAMETERS[algorithm], **(parameters or {}))
+
+        # At most maxWorkers hashes run at once, and at most maxPending are queued or running. Beyond that, callers wait their turn
+        # here rather than piling work into the pool, so a burst of logins can't take over the machine.
+        self.maxWorkers = maxWorkers or max(1, (os.cpu_count() or 2) // 2)
+        self.maxPending = maxPending or self.maxWorkers * 4
+        self.slots = threading.BoundedSemaphore(self.maxPending)
+
+        # The pool is started on first use, so importing this module (or building a hasher that is never used) costs nothing.
+        self.pool = None
+        self.poolLock = threading.Lock()
+
+    # Builds a hasher from the optional [Hashing] section of a ConfigParser, keeping the defaults for anything that isn't specified.
+    @classmethod
+    def FromConfig(cls, config):
+
+        algorithm = config.get("Hashing", "ALGORITHM", fallback="scrypt").strip().lower()
+        parameters = {}
+        if algorithm == "scrypt":
+            for name in ("n", "r", "p"):
+                value = config.getint("Hashing", f"SCRYPT_{name.upper()}", fallback=None)
+                if value is not None:
+                    parameters[name] = value
+        elif algorithm == "pbkdf2_sha256":
+            value = config.getint("Hashing", "PBKDF2_ITERATIONS", fallback=None)
+            if value is not None:
+                parameters["i"] = value
+
+        return cls(algorithm, parameters,
+                   maxWorkers=config.getint("Hashing", "WORKERS", fallback=None),
+                   maxPending=config.getint("Hashing", "MAX_PENDING", fallback=None))
+
+    # Returns the pool, starting it if necessary.
+    def GetPool(self):
+
+        with self.poolLock:
+            if self.pool is None:
+                if "fork" in multiprocessing.get_all_start_methods():
+                    self.pool = ProcessPoolExecutor(max_workers=self.maxWorkers, mp_context=multiprocessing.get_context("fork"))
+                else:
+                    self.pool = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="password-hashing")
+            return self.pool
+
+    # Starts the pool's workers now rather than on the first login.
+    # Call this before the application opens database connections or starts threads, so the forked workers don't inherit them.
+    def Start(self):
+
+        pool = self.GetPool()
+        for future in [pool.submit(DeriveKey, "pbkdf2_sha256", {"i": 1}, "", b"") for _ in range(self.maxWorkers)]:
+            future.result()
+
+    # Runs DeriveKey in the pool once a slot is free and returns the derived key.
+    def Derive(self, algorithm, parameters, password, salt):
+
+        with self.slots:
+            return self.GetPool().submit(DeriveKey, algorithm, parameters, password, salt).result()
+
+    #########################
+    # Hashing and Verification
+    #########################
+
+    # Returns the stored form of a new hash of password, with a fresh salt and the current algorithm and cost.
+    def Hash(self, password):
+
+        salt = secrets.token_bytes(SALT_SIZE)
+        return FormatHash(self.algorithm, self.parameters, salt, self.Derive(self.algorithm, self.parameters, password, salt))
+
+    # Checks password against a stored hash. Returns (matches, needsRehash).
+    # needsRehash is True when the stored hash is legacy SHA-256 or was made with a different algorithm or cost than the current one,
+    # so the caller can replace it with Hash(password) once the password is known to be right.
+    def Verify(self, password, storedHash):
+
+        if IsLegacyHash(storedHash):
+            legacyHash = hashlib.sha256(password.encode()).hexdigest()
+            return secrets.compare_digest(legacyHash, storedHash), True
+
+        parsed = ParseHash(storedHash)
+        if parsed is None:
+            print("Stored password hash is in an unrecognized format.")
+            return False, False
+
+        algorithm, parameters, salt, key = parsed
+        matches = secrets.compare_digest(self.Derive(algorithm, parameters, password, salt), key)
+        return matches, (algorithm != self.algorithm or parameters != self.parameters)
+
+    # True if a stored hash should be replaced with one made by the current algorithm and cost.
+    def NeedsRehash(self, storedHash):
+
+        parsed = ParseHash(storedHash)
+        return parsed is None or parsed[0] != self.algorithm or parsed[1] != self.parameters
+
+    # Shuts the worker processes down.
+    def Close(self):
+
+        with self.poolLock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+                self.pool = None
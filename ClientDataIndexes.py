@@ -0,0 +1,212 @@
+# **************************************************
+#
+# Filename: ClientDataIndexes.py
+# Version: 1.0.0
+# Purpose: Declare the indexes the CRUD and security layers rely on, ensure them at startup, and verify that the dashboard's queries actually use them.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Indexes are only ever added. An index that is removed from the registry has to be dropped by hand.
+#
+# **************************************************
+
+# PyMongo
+from pymongo import IndexModel
+from pymongo import errors
+
+# General utility imports
+import configparser     # For parsing the configuration file when run as a script
+import datetime         # For sample watermark values in the known queries
+import sys              # For command line arguments when run as a script
+
+#########################
+# Index Registry
+#########################
+
+# Every index the application depends on, keyed by the logical collection name.
+# "logins" is whatever collection the [SLLogin] COL setting names; the others are used by name.
+# Each entry is passed straight through to IndexModel, so any IndexModel option (unique, sparse, ...) can be added.
+INDEX_REGISTRY = {
+    "logins": [
+        # VerifyUser looks every login up by username, and usernames must never be duplicated.
+        {"keys": [("username", 1)], "name": "username_unique", "unique": True},
+    ],
+    "accounts": [
+        # The $lookup join and any per-client account lookup.
+        {"keys": [("client_id", 1)], "name": "client_id"},
+        # The retirement / non-retirement filters, and the RMD filter (account_class + rmd_amount range).
+        {"keys": [("account_class", 1), ("rmd_amount", 1)], "name": "account_class_rmd_amount"},
+        # Incremental refreshes poll for documents changed since their last watermark.
+        {"keys": [("updated_at", 1)], "name": "updated_at"},
+        # Server-side table sorts. Each sort breaks ties on _id so pages are stable, and MongoDB can walk these either way round.
+        {"keys": [("account_nickname", 1), ("_id", 1)], "name": "sort_account_nickname"},
+        {"keys": [("account_class", 1), ("_id", 1)], "name": "sort_account_class"},
+        {"keys": [("account_value", 1), ("_id", 1)], "name": "sort_account_value"},
+        {"keys": [("cash_available", 1), ("_id", 1)], "name": "sort_cash_available"},
+        {"keys": [("ytd_distributions", 1), ("_id", 1)], "name": "sort_ytd_distributions"},
+        {"keys": [("rmd_amount", 1), ("_id", 1)], "name": "sort_rmd_amount"},
+    ],
+    "clients": [
+        # The Overdue Reviews filter selects clients by a last_review_date cutoff.
+        {"keys": [("last_review_date", 1)], "name": "last_review_date"},
+        # Clients are otherwise only looked up by _id, which MongoDB always indexes.
+        {"keys": [("updated_at", 1)], "name": "updated_at"},
+        # Server-side table sorts on client columns, including days since the last review (a last_review_date sort).
+        {"keys": [("first_name", 1), ("_id", 1)], "name": "sort_first_name"},
+        {"keys": [("last_name", 1), ("_id", 1)], "name": "sort_last_name"},
+        {"keys": [("last_review_date", 1), ("_id", 1)], "name": "sort_last_review_date"},
+    ],
+}
+
+# The queries the dashboard and security layer run routinely. CheckQueryPlans() explains each of these
+# and reports any that still fall back to a collection scan or an in-memory sort. "sort" is optional.
+KNOWN_QUERIES = [
+    {"name": "Login lookup", "collection": "logins", "filter": {"username": "admin"}},
+    {"name": "Retirement accounts", "collection": "accounts", "filter": {"account_class": "retirement"}},
+    {"name": "Non-retirement accounts", "collection": "accounts", "filter": {"account_class": "non-retirement"}},
+    {"name": "RMD status", "collection": "accounts", "filter": {"account_class": "retirement", "rmd_amount": {"$gt": 0}}},
+    {"name": "Accounts for a client", "collection": "accounts", "filter": {"client_id": None}},
+    {"name": "Overdue reviews", "collection": "clients", "filter": {"last_review_date": {"$lte": datetime.datetime(1970, 1, 1)}}},
+    {"name": "Accounts for overdue clients", "collection": "accounts", "filter": {"client_id": {"$in": []}}},
+    {"name": "Changed accounts", "collection": "accounts", "filter": {"updated_at": {"$gt": datetime.datetime(1970, 1, 1)}}},
+    {"name": "Changed clients", "collection": "clients", "filter": {"updated_at": {"$gt": datetime.datetime(1970, 1, 1)}}},
+    {"name": "Table sorted by account value", "collection": "accounts", "filter": {}, "sort": [("account_value", -1), ("_id", 1)]},
+    {"name": "Table sorted by last name", "collection": "clients", "filter": {}, "sort": [("last_name", 1), ("_id", 1)]},
+    {"name": "Table sorted by days since review", "collection": "clients", "filter": {}, "sort": [("last_review_date", 1), ("_id", 1)]},
+]
+
+#######################################################################################################################################
+
+# Creates the registered indexes for one logical collection. Safe to call on every startup; existing indexes are left alone.
+# collectionName overrides the physical collection name (used for the configurable logins collection).
+# Returns the list of index names that are in place, or an empty list if they could not be created.
+def EnsureIndexes(database, logicalName, collectionName=None):
+
+    specs = INDEX_REGISTRY.get(logicalName, [])
+    if not specs:
+        return []
+
+    collectionName = collectionName or logicalName
+    models = [IndexModel(spec["keys"], **{option: value for option, value in spec.items() if option != "keys"}) for spec in specs]
+
+    # Index creation needs the createIndex privilege and fails on data that breaks a unique constraint.
+    # Neither should stop the application from starting, so both are reported and skipped.
+    try:
+        names = database[collectionName].create_indexes(models)
+        print(f"Indexes ensured on {collectionName}: {', '.join(names)}")
+        return names
+    except errors.OperationFailure as operationFailure:
+        print(f"Unable to ensure indexes on {collectionName}: {operationFailure}")
+    except Exception as exception:
+        print(f"An unexpected exception occurred while ensuring indexes on {collectionName}: {exception}")
+    return []
+
+# Returns every stage name used by an explain() plan, walking nested inputStage/inputStages and newer queryPlan layouts.
+def CollectPlanStages(plan):
+
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(CollectPlanStages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(CollectPlanStages(value))
+    return stages
+
+# Explains each known query and reports whether its winning plan uses an index.
+# collectionNames maps logical names to physical ones where they differ (e.g. {"logins": "CS499_logins"}).
+# Returns a list of {"name", "collection", "stages", "collscan", "blockingSort"} reports.
+def CheckQueryPlans(database, collectionNames=None, queries=None):
+
+    collectionNames = collectionNames or {}
+    reports = []
+
+    for query in queries or KNOWN_QUERIES:
+        collectionName = collectionNames.get(query["collection"], query["collection"])
+        report = {"name": query["name"], "collection": collectionName, "stages": [], "collscan": None, "blockingSort": None}
+
+        try:
+            cursor = database[collectionName].find(query["filter"])
+            if query.get("sort"):
+                cursor = cursor.sort(query["sort"])
+            explanation = cursor.explain()
+            report["stages"] = CollectPlanStages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+            report["collscan"] = "COLLSCAN" in report["stages"]
+            report["blockingSort"] = "SORT" in report["stages"]
+        except errors.OperationFailure as operationFailure:
+            print(f"Unable to explain '{query['name']}': {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred while explaining '{query['name']}': {exception}")
+
+        reports.append(report)
+
+    return reports
+
+# Prints a CheckQueryPlans() report and returns the number of queries still doing a collection scan or an in-memory sort.
+def PrintQueryPlanReport(reports):
+
+    scans = 0
+    for report in reports:
+        if report["collscan"] is None:
+            status = "UNKNOWN"
+        elif report["collscan"]:
+            status = "COLLSCAN"
+            scans += 1
+        elif report["blockingSort"]:
+            status = "SORT"
+            scans += 1
+        else:
+            status = "indexed"
+        print(f"{status:>9}  {report['name']} ({report['collection']}): {' <- '.join(report['stages'])}")
+
+    print(f"{scans} of {len(reports)} known queries still use a collection scan or an in-memory sort.")
+    return scans
+
+#######################################################################################################################################
+
+# Run directly to ensure every registered index and/or check the known query plans:
+#   python ClientDataIndexes.py [--ensure] [--check]
+# Uses the [SLLogin] service credentials, which need the createIndex privilege for --ensure.
+def main():
+
+    # Imported here so the registry itself can be imported without the connection module's side effects.
+    from ClientDataConnection import GetConnectionManager
+
+    arguments = sys.argv[1:] or ["--ensure", "--check"]
+
+    manager = GetConnectionManager()
+    if manager.config is None:
+        return 1
+
+    try:
+        USER = manager.config.get("SLLogin", "USER")
+        PASS = manager.config.get("SLLogin", "PASS")
+        loginCollection = manager.config.get("SLLogin", "COL")
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        print("Unable to read the [SLLogin] credentials from the configuration file.")
+        return 1
+
+    database = manager.GetDatabase(USER, PASS)
+    if database is None:
+        return 1
+
+    collectionNames = {"logins": loginCollection}
+
+    if "--ensure" in arguments:
+        for logicalName in INDEX_REGISTRY:
+            EnsureIndexes(database, logicalName, collectionNames.get(logicalName))
+
+    scans = 0
+    if "--check" in arguments:
+        scans = PrintQueryPlanReport(CheckQueryPlans(database, collectionNames))
+
+    manager.CloseAll()
+    return 1 if scans else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# **************************************************
+#
+# Filename: ClientDataRateLimiter.py
+# Version: 1.0.0
+# Purpose: Turn away excess login attempts before they reach the database, using in-memory token buckets
+#          keyed by client IP address and by username.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The buckets are per process. Running several dashboard processes gives each its own allowance.
+# * Buckets are bounded by least-recently-used eviction. An attacker rotating through more keys than the bound can push a bucket out,
+#   which resets it to full. The account lockout in the SecurityLayer still applies behind it.
+# * Behind a proxy, every request appears to come from the proxy's address unless the proxy's forwarding headers are trusted upstream.
+#
+# **************************************************
+
+# General utility imports
+import threading                        # For guarding the buckets against concurrent callbacks
+import time                             # For refilling the buckets
+from collections import OrderedDict     # For least-recently-used eviction of buckets
+
+# Usernames longer than this are cut short before being used as a key, so oversized input can't inflate the buckets' memory.
+MAX_KEY_LENGTH = 256
+
+class TokenBucketLimiter:
+
+    """ Token buckets keyed by an arbitrary string, with a bounded number of buckets """
+
+    def __init__(self, capacity=10, refillPerSecond=0.5, maxKeys=10000):
+
+        # Each key may make capacity attempts in a burst, then refillPerSecond attempts per second after that.
+        self.capacity = float(capacity)
+        self.refillPerSecond = float(refillPerSecond)
+        self.maxKeys = maxKeys
+
+        # key -> [tokens, last refill time], in least- to most-recently-used order.
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Counters, so we can see how much is being turned away.
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    # Takes a token from key's bucket. Returns True if there was one (the attempt may go ahead), False if the bucket is empty.
+    def Allow(self, key):
+
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [self.capacity, now]
+                self.buckets[key] = bucket
+                while len(self.buckets) > self.maxKeys:
+                    self.buckets.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refillPerSecond)
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                self.rejected += 1
+                return False
+
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+    # Returns the limiter's counters and current size.
+    def GetStats(self):
+
+        with self.lock:
+            return {
+                "buckets": len(self.buckets),
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "evictions": self.evictions
+            }
+
+class LoginRateLimiter:
+
+    """ Per-IP and per-username login attempt limits, checked before any database work """
+
+    def __init__(self, ipLimiter=None, userLimiter=None):
+
+        # An address gets a bigger allowance than a username, since several people may share one address.
+        self.ipLimiter = ipLimiter or TokenBucketLimiter(capacity=20, refillPerSecond=1)
+        self.userLimiter = userLimiter or TokenBucketLimiter(capacity=5, refillPerSecond=0.1)
+
+    # Builds a limiter from the optional [RateLimit] section of a ConfigParser, keeping the defaults for anything that isn't specified.
+    @classmethod
+    def FromConfig(cls, config):
+
+        maxKeys = config.getint("RateLimit", "MAX_KEYS", fallback=10000)
+        return cls(
+            TokenBucketLimiter(config.getfloat("RateLimit", "IP_BURST", fallback=20),
+                               config.getfloat("RateLimit", "IP_PER_SECOND", fallback=1), maxKeys),
+            TokenBucketLimiter(config.getfloat("RateLimit", "USER_BURST", fallback=5),
+                               config.getfloat("RateLimit", "USER_PER_SECOND", fallback=0.1), maxKeys)
+        )
+
+    # Checks a login attempt from ipAddress for username. Returns True if it may go ahead, False if it should be turned away.
+    # The address is checked first, so a flood from one address doesn't use up the allowance of the usernames it tries.
+    def Allow(self, ipAddress, username):
+
+        if not self.ipLimiter.Allow(str(ipAddress or "unknown")):
+            print(f"Login attempt from {ipAddress} rate limited.")
+            return False
+
+        if not self.userLimiter.Allow(str(username or "").strip().lower()[:MAX_KEY_LENGTH]):
+            print(f"Login attempt for {username} rate limited.")
+            return False
+
+        return True
+
+    # Returns the counters of both limiters.
+    def GetStats(self):
+
+        return {"ip": self.ipLimiter.GetStats(), "username": self.userLimiter.GetStats()}
@@ -0,0 +1,348 @@
+# **************************************************
+#
+# Filename: ClientDataRefresh.py
+# Version: 1.0.0
+# Purpose: Keep the dashboard's merged accounts/clients frame up to date by applying only the documents that changed since the last refresh.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Change streams need a replica set. On a standalone server (like the bundled mongod.conf) the refresher polls the updated_at watermark instead.
+# * In polling mode, documents written without an updated_at stamp (raw bulk_write calls, outside tools) are only noticed when
+#   they change the collection's document count.
+#
+# **************************************************
+
+# PyMongo
+from pymongo import errors
+
+# Plotting Routines for graphs, charts, etc.
+import pandas as pd
+
+# Merged frame schema
+from ClientDataSchema import ApplyFrameSchema
+
+# Shared overlap-window polling
+from ClientDataCache import ChangedSinceWatermark
+
+# General utility imports
+import datetime     # For watermark arithmetic and day rollover detection
+import threading    # For the optional background refresh thread
+
+class MergedFrameRefresher:
+
+    """ Incrementally maintained accounts -> clients merged DataFrame """
+
+    def __init__(self, crud, accountFields, clientFields, mode="auto", accountsCollection="accounts", clientsCollection="clients"):
+
+        self.crud = crud
+        self.accountFields = list(accountFields)
+        self.clientFields = list(clientFields)
+        self.accountsCollection = accountsCollection
+        self.clientsCollection = clientsCollection
+
+        # "changestream", "poll", or "auto" to use a change stream when the server supports one and poll otherwise.
+        self.mode = mode
+        self.activeMode = None
+
+        # Store some default values for polling.
+        self.pollOverlapSeconds = 2         # Re-check this far behind the watermark to allow for clock skew between writers.
+        self.maxStreamBatch = 10000         # A burst of more changes than this is cheaper to apply with a full reload.
+
+        # The merged frame, indexed by account _id. Holds client_id and last_review_date alongside the displayed fields.
+        self.frame = None
+        # Bumped every time the frame's contents change, so callers can tell when their own copies are stale.
+        self.version = 0
+        self.lock = threading.RLock()
+
+        # Change stream mode state.
+        self.stream = None
+
+        # Polling mode state: the newest updated_at seen per collection, and the stamps applied inside the overlap window.
+        self.watermarks = {accountsCollection: None, clientsCollection: None}
+        self.recentStamps = {accountsCollection: {}, clientsCollection: {}}
+        self.clientCount = 0
+
+        # days_since_last_review goes stale at midnight even when no documents change.
+        self.daysComputedOn = None
+
+        # Background refresh thread, if started.
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    #######################################################################################################################################
+
+    #########################
+    # Loading and Refreshing
+    #########################
+
+    # Builds the merged frame from scratch. Returns the new version number.
+    def Load(self):
+
+        with self.lock:
+            # Start watching (or note the watermarks) before reading, so anything written during the load is applied on the next refresh.
+            self.CloseChangeStream()
+            if self.mode in ("auto", "changestream"):
+                self.OpenChangeStream()
+
+            if self.stream is None:
+                self.activeMode = "poll"
+                for collectionName in self.watermarks:
+                    self.watermarks[collectionName] = self.LatestStamp(collectionName)
+                    self.recentStamps[collectionName] = {}
+                self.clientCount = self.CountDocuments(self.clientsCollection)
+
+            self.frame = self.FetchRows(None)
+            self.daysComputedOn = datetime.date.today()
+            self.version += 1
+
+            print(f"Merged frame loaded ({len(self.frame)} rows, {self.activeMode} mode, version {self.version}).")
+            return self.version
+
+    # Applies whatever has changed since the last refresh. Returns the current version number,
+    # which only moves if the frame's contents actually changed.
+    def Refresh(self):
+
+        with self.lock:
+            if self.frame is None:
+                return self.Load()
+
+            if self.stream is not None:
+                changed = self.ApplyStreamChanges()
+            else:
+                changed = self.ApplyPolledChanges()
+
+            if self.RecomputeDays():
+                changed = True
+
+            if changed:
+                self.version += 1
+            return self.version
+
+    # Returns the merged frame as the dashboard displays it: no ObjectIds, no helper columns, compact dtypes.
+    # This runs on every snapshot rebuild, so it doesn't measure memory; call ApplyFrameSchema(..., report=True) directly to see the savings.
+    def Frame(self):
+
+        with self.lock:
+            if self.frame is None:
+                return None
+            helpers = ["client_id"] + (["last_review_date"] if "last_review_date" not in self.clientFields else [])
+            return ApplyFrameSchema(self.frame.drop(columns=helpers, errors="ignore").reset_index(drop=True))
+
+    # Runs the merge pipeline for the accounts matching accountFilter and returns them as a frame indexed by account _id.
+    # The cache is bypassed because these reads exist precisely to pick up the latest writes.
+    def FetchRows(self, accountFilter):
+
+        pipeline = self.crud.BuildMergedPipeline(accountFilter, self.accountFields, self.clientFields + ["last_review_date"], self.clientsCollection, keepIds=True)
+        rows = self.crud.aggregate(self.accountsCollection, pipeline, useCache=False)
+
+        columns = ["_id", "client_id"] + self.accountFields + self.clientFields + ["last_review_date", "days_since_last_review"]
+        return pd.DataFrame(rows, columns=list(dict.fromkeys(columns))).set_index("_id")
+
+    # Replaces the rows for the given accounts (and every account belonging to the given clients) and drops deleted accounts.
+    # Only the affected accounts are read back from the database.
+    def ApplyChanges(self, accountIds, deletedAccountIds, clientIds):
+
+        if deletedAccountIds:
+            self.frame = self.frame.drop(index=list(deletedAccountIds), errors="ignore")
+
+        matches = []
+        if accountIds:
+            matches.append({"_id": {"$in": list(accountIds)}})
+        if clientIds:
+            matches.append({"client_id": {"$in": list(clientIds)}})
+        if not matches:
+            return bool(deletedAccountIds)
+
+        rows = self.FetchRows(matches[0] if len(matches) == 1 else {"$or": matches})
+
+        # Anything asked for but not returned has been deleted (or no longer exists), so it is dropped along with the rows being replaced.
+        stale = set(accountIds) | set(rows.index)
+        self.frame = pd.concat([self.frame.drop(index=list(stale), errors="ignore"), rows])
+        return True
+
+    # Recomputes days_since_last_review for every row once the date has rolled over since the last computation.
+    # Returns True if it did.
+    def RecomputeDays(self):
+
+        today = datetime.date.today()
+        if self.daysComputedOn == today or self.frame is None:
+            return False
+
+        lastReview = pd.to_datetime(self.frame["last_review_date"], errors="coerce")
+        self.frame["days_since_last_review"] = (pd.Timestamp.now() - lastReview).dt.days
+        self.daysComputedOn = today
+        return True
+
+    #######################################################################################################################################
+
+    #########################
+    # Change Stream Mode
+    #########################
+
+    # Opens a change stream on the accounts and clients collections. Leaves self.stream as None if the server can't provide one.
+    def OpenChangeStream(self):
+
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": [self.accountsCollection, self.clientsCollection]},
+            "operationType": {"$in": ["insert", "update", "replace", "delete", "drop", "rename", "dropDatabase", "invalidate"]}
+        }}]
+
+        try:
+            # A short await keeps each refresh from blocking when nothing has changed.
+            self.stream = self.crud.database.watch(pipeline, max_await_time_ms=50)
+            self.activeMode = "changestream"
+        except errors.OperationFailure as operationFailure:     # Thrown on standalone servers, which don't support change streams.
+            print(f"Change streams unavailable, falling back to polling: {operationFailure}")
+            self.stream = None
+        except Exception as exception:
+            print(f"An unexpected exception occurred while opening a change stream, falling back to polling: {exception}")
+            self.stream = None
+
+    def CloseChangeStream(self):
+
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception as exception:
+                print(f"An unexpected exception occurred while closing the change stream: {exception}")
+            self.stream = None
+
+    # Drains the pending change events and applies them. Returns True if the frame changed.
+    def ApplyStreamChanges(self):
+
+        accountIds, deletedAccountIds, clientIds = set(), set(), set()
+
+        try:
+            for _ in range(self.maxStreamBatch):
+                change = self.stream.try_next()
+                if change is None:
+                    break
+
+                operation = change["operationType"]
+                # Anything that replaces or removes a whole collection means starting over.
+                if operation not in ("insert", "update", "replace", "delete"):
+                    self.Load()
+                    return True
+
+                documentId = change["documentKey"]["_id"]
+                if change["ns"]["coll"] == self.clientsCollection:
+                    clientIds.add(documentId)
+                elif operation == "delete":
+                    deletedAccountIds.add(documentId)
+                    accountIds.discard(documentId)
+                else:
+                    accountIds.add(documentId)
+                    deletedAccountIds.discard(documentId)
+            else:
+                # Too many changes to be worth applying one at a time.
+                self.Load()
+                return True
+
+        except errors.PyMongoError as pyMongoError:     # A lost stream can't be trusted to resume cleanly, so reload.
+            print(f"Change stream error, reloading the merged frame: {pyMongoError}")
+            self.Load()
+            return True
+
+        return self.ApplyChanges(accountIds, deletedAccountIds, clientIds)
+
+    #######################################################################################################################################
+
+    #########################
+    # Polling Mode
+    #########################
+
+    # Returns the newest updated_at stamp in a collection, or None if nothing is stamped yet.
+    def LatestStamp(self, collectionName):
+
+        field = self.crud.updatedAtField
+        try:
+            latest = self.crud.database[collectionName].find_one({field: {"$type": "date"}}, {field: 1}, sort=[(field, -1)])
+            return latest[field] if latest else None
+        except errors.PyMongoError as pyMongoError:
+            print(f"Unable to read the latest {field} from {collectionName}: {pyMongoError}")
+            return None
+
+    def CountDocuments(self, collectionName):
+
+        try:
+            return self.crud.database[collectionName].estimated_document_count()
+        except errors.PyMongoError as pyMongoError:
+            print(f"Unable to count {collectionName}: {pyMongoError}")
+            return None
+
+    # Returns the _ids of documents in collectionName stamped since the watermark, advancing the watermark past them.
+    # The query looks back pollOverlapSeconds to catch writes stamped by a slightly slow clock; stamps already applied are skipped.
+    def ChangedSince(self, collectionName):
+
+        documents, self.watermarks[collectionName] = ChangedSinceWatermark(
+            self.crud.database[collectionName], self.crud.updatedAtField, self.watermarks[collectionName],
+            self.recentStamps[collectionName], self.pollOverlapSeconds)
+        return [document["_id"] for document in documents]
+
+    # Polls both collections for stamped changes and applies them. Deletions are picked up by comparing document counts,
+    # since a deleted document leaves no stamp behind. Returns True if the frame changed.
+    def ApplyPolledChanges(self):
+
+        try:
+            accountIds = set(self.ChangedSince(self.accountsCollection))
+            clientIds = set(self.ChangedSince(self.clientsCollection))
+            changed = self.ApplyChanges(accountIds, set(), clientIds)
+
+            # If the account count no longer matches, diff the _ids (an index-only read) to find what was added or removed.
+            if self.CountDocuments(self.accountsCollection) != len(self.frame):
+                knownIds = set(self.frame.index)
+                currentIds = {document["_id"] for document in self.crud.database[self.accountsCollection].find({}, {"_id": 1})}
+                if self.ApplyChanges(currentIds - knownIds, knownIds - currentIds, set()):
+                    changed = True
+
+            # A deleted client leaves its accounts pointing at nothing, so re-join any account whose client has gone.
+            clientCount = self.CountDocuments(self.clientsCollection)
+            if clientCount != self.clientCount:
+                self.clientCount = clientCount
+                currentClientIds = {document["_id"] for document in self.crud.database[self.clientsCollection].find({}, {"_id": 1})}
+                orphanedClientIds = set(self.frame["client_id"].dropna()) - currentClientIds
+                if self.ApplyChanges(set(), set(), orphanedClientIds):
+                    changed = True
+
+            return changed
+
+        except errors.PyMongoError as pyMongoError:
+            print(f"Polling for changes failed; keeping the current frame: {pyMongoError}")
+            return False
+
+    #######################################################################################################################################
+
+    #########################
+    # Background Refresh
+    #########################
+
+    # Starts a daemon thread that calls Refresh() every intervalSeconds.
+    def Start(self, intervalSeconds=5):
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.stopEvent.clear()
+
+        def RefreshLoop():
+            while not self.stopEvent.wait(intervalSeconds):
+                try:
+                    self.Refresh()
+                except Exception as exception:      # Keep the thread alive through unexpected errors; the next pass will try again.
+                    print(f"An unexpected exception occurred during background refresh: {exception}")
+
+        self.thread = threading.Thread(target=RefreshLoop, name="MergedFrameRefresher", daemon=True)
+        self.thread.start()
+
+    # Stops the background thread (if any) and closes the change stream.
+    def Stop(self):
+
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self.CloseChangeStream()
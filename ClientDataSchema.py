@@ -0,0 +1,99 @@
+# **************************************************
+#
+# Filename: ClientDataSchema.py
+# Version: 1.0.0
+# Purpose: Define the memory-compact dtypes of the merged accounts/clients frame and convert frames to them.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Money is held as integer cents, so anything reading the frame directly has to divide by 100. ClientDataSerialization does this for the DataTable.
+#
+# **************************************************
+
+# Plotting Routines for graphs, charts, etc.
+import pandas as pd
+
+#########################
+# Merged Frame Schema
+#########################
+
+# The columns the dashboard's merged frame keeps, in display order, and how each one is stored:
+#   "category" - repeated, low-cardinality strings (names, account classes, nicknames built from a small set of account types)
+#   "cents"    - currency as nullable 64-bit integer cents, so sums are exact and there are no float rounding surprises
+#   "days"     - nullable 32-bit integer day counts. Out-of-range values (placeholder review dates, bad data) are clipped to fit.
+# Anything not listed here (SSN, date_of_birth, ObjectIds, helper columns) is dropped.
+MERGED_FRAME_SCHEMA = {
+    "first_name": "category",
+    "last_name": "category",
+    "account_nickname": "category",
+    "account_class": "category",
+    "account_value": "cents",
+    "cash_available": "cents",
+    "ytd_distributions": "cents",
+    "rmd_amount": "cents",
+    "days_since_last_review": "days",
+}
+
+# The pandas dtype behind each schema kind.
+SCHEMA_DTYPES = {
+    "category": "category",
+    "cents": "Int64",
+    "days": "Int32",
+}
+
+# The smallest and largest values a "days" column can hold.
+DAYS_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+# Returns a copy of frame with only the schema's columns, converted to the schema's dtypes.
+# Columns the schema lists but the frame lacks are added as empty columns, so downstream code can rely on them.
+# With report=True, the memory usage before and after is printed.
+def ApplyFrameSchema(frame, schema=MERGED_FRAME_SCHEMA, report=False):
+
+    if frame is None:
+        return None
+
+    before = MemoryUsage(frame) if report else None
+    compact = pd.DataFrame(index=frame.index)
+
+    for column, kind in schema.items():
+        values = frame[column] if column in frame.columns else pd.Series(None, index=frame.index, dtype="object")
+
+        if kind == "cents":
+            values = (pd.to_numeric(values, errors="coerce") * 100).round().astype("Int64")
+        elif kind == "days":
+            values = pd.to_numeric(values, errors="coerce").round().clip(*DAYS_RANGE).astype(SCHEMA_DTYPES[kind])
+        else:
+            values = values.astype(SCHEMA_DTYPES[kind])
+
+        compact[column] = values
+
+    if report:
+        after = MemoryUsage(compact)
+        print(f"Merged frame memory: {FormatBytes(before)} -> {FormatBytes(after)} ({len(frame)} rows, {100 * (1 - after / before) if before else 0:.0f}% smaller).")
+
+    return compact
+
+# Returns the deep memory usage of a frame in bytes, counting the Python string objects held by object columns.
+def MemoryUsage(frame):
+
+    return int(frame.memory_usage(deep=True).sum())
+
+# Returns a memory usage figure with a sensible unit.
+def FormatBytes(size):
+
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+# Returns a per-column comparison of a frame's memory usage before and after ApplyFrameSchema: {column: (bytesBefore, bytesAfter)}.
+def MemoryReport(frame, schema=MERGED_FRAME_SCHEMA):
+
+    compact = ApplyFrameSchema(frame, schema)
+    before = frame.memory_usage(deep=True, index=False)
+    after = compact.memory_usage(deep=True, index=False)
+    return {column: (int(before.get(column, 0)), int(after.get(column, 0))) for column in list(frame.columns) + [column for column in compact.columns if column not in frame.columns]}
@@ -15,16 +15,26 @@
 # **************************************************
 
 # PyMongo
-from pymongo import MongoClient
 from pymongo import errors
+from pymongo import ReturnDocument
 
 # General utility imports
-import hashlib      # For password hashing
 import secrets      # For token generation
-import datetime     # For timestamp generation
 import configparser # For parsing the configuration file
 import uuid         # For generating unique user IDs (UUIDs)
 
+# Shared connection pool
+from ClientDataConnection import GetConnectionManager
+
+# Index registry
+from ClientDataIndexes import EnsureIndexes
+
+# Session stores
+from ClientDataSessionStore import InMemorySessionStore, MongoSessionStore, SessionReaper, UtcNow
+
+# Password hashing service
+from ClientDataHashing import PasswordHasher
+
 class SecurityLayer:
     def __init__ (self):
         
@@ -33,9 +43,15 @@ class SecurityLayer:
         self.sessionLifespan = 600          # Lifespan of session in seconds since last activity. Also used for account lockouts.
         self.tokenSize = 32                 # Number of bytes that a security token should contain. 32 should be adequate for our purposes.
                 
-        # Store active user sessions in a local dictionary.
-        # <IMPROVEMENT>: A more robust database-centric solution would improve scaling and usability.
-        self.activeSessions = {}
+        # Store active user sessions in a session store. Sessions start out local to this process;
+        # with [Sessions] STORE = mongo they are moved into MongoDB once the database is connected, so every worker shares them.
+        self.sessionStore = InMemorySessionStore(self.sessionLifespan)
+        
+        # Expired sessions are removed in the background by the reaper, rather than waiting for ValidateSession to run into them.
+        self.sessionReaper = None
+        
+        # Passwords are hashed with a salted KDF in a bounded worker pool. The defaults are replaced by the [Hashing] settings below.
+        self.hasher = PasswordHasher()
         
         # Load the configuration details into a ConfigParser
         self.config = self.LoadConfig("./config/CS499_secure.ini")
@@ -44,6 +60,10 @@ class SecurityLayer:
         if (self.config is None):
             print("Failed to load configuration file. Closing the security layer.")
             return
+        
+        # Build the password hasher and start its workers before any database connections or background threads exist,
+        # so the worker processes start out clean.
+        self.hasher = self.CreatePasswordHasher(self.config)
             
         # Establish a connection to the database using the credentials from the configuration file.
         self.database = self.ConnectToDatabase(self.config)
@@ -65,7 +85,12 @@ class SecurityLayer:
                 print(f"Failed to connect to the {collectionName} collection.")
                 return
             
-            # Establish a collection shortcut for later use.
+            # Make sure the login lookups are index-backed and usernames stay unique. This is a no-op once the index exists.
+            EnsureIndexes(self.database, "logins", collectionName)
+            
+            # Switch to the configured session store and start reaping its expired sessions.
+            self.sessionStore = self.CreateSessionStore(self.config)
+            self.StartSessionReaper(self.config)
         
         except errors.ConnectionFailure as e:     # Thrown for connection errors
             print(f"Connection error: {e}")
@@ -92,7 +117,7 @@ class SecurityLayer:
                 "hashed_password": hashed_password,
                 "role": permissions,
                 "isLocked": False,
-                "lastLoginAttempt": datetime.datetime.now(),
+                "lastLoginAttempt": self.SessionTime(),
                 "recentFailedAttempts": 0
             }
             
@@ -134,37 +159,99 @@ class SecurityLayer:
             return None
         return config
         
+    # Builds the password hasher from the [Hashing] settings (ALGORITHM, SCRYPT_N/R/P or PBKDF2_ITERATIONS, WORKERS, MAX_PENDING)
+    # and starts its workers. Falls back to the default scrypt settings if they can't be read.
+    def CreatePasswordHasher(self, config):
+        
+        try:
+            hasher = PasswordHasher.FromConfig(config)
+        except ValueError as e:         # Thrown for an unknown algorithm or a setting that isn't a number.
+            print(f"Invalid password hashing setting in the configuration file: {e}. Using the default scrypt settings.")
+            hasher = PasswordHasher()
+        
+        try:
+            hasher.Start()
+            print(f"Password hashing: {hasher.algorithm} {hasher.parameters} on {hasher.maxWorkers} workers.")
+        except Exception as e:          # Catch-all. The pool is started again on first use.
+            print(f"An unexpected exception occurred while starting the password hashing workers: {e}")
+        return hasher
+    
+    # Builds the session store named by the [Sessions] STORE setting: "memory" (the default) or "mongo".
+    # The MongoDB store keeps sessions in the [Sessions] COL collection, so they are shared between workers and survive restarts.
+    def CreateSessionStore(self, config):
+        
+        storeType = config.get("Sessions", "STORE", fallback="memory").strip().lower()
+        if storeType != "mongo":
+            return InMemorySessionStore(self.sessionLifespan)
+        
+        try:
+            store = MongoSessionStore(
+                self.database[config.get("Sessions", "COL", fallback="CS499_sessions")],
+                self.sessionLifespan,
+                cacheSeconds=config.getfloat("Sessions", "CACHE_SECONDS", fallback=5),
+                flushSeconds=config.getfloat("Sessions", "FLUSH_SECONDS", fallback=15)
+            )
+            print(f"Sessions are stored in MongoDB collection {store.collection.name}.")
+            return store
+        except ValueError as e:         # Thrown if one of the numeric settings isn't a number.
+            print(f"Invalid session store setting in the configuration file: {e}. Keeping sessions in memory.")
+        except Exception as e:          # Catch-all
+            print(f"An unexpected exception occurred while creating the session store: {e}. Keeping sessions in memory.")
+        return InMemorySessionStore(self.sessionLifespan)
+    
+    # Starts the background reaper for the session store, running every [Sessions] REAP_INTERVAL_SECONDS.
+    def StartSessionReaper(self, config):
+        
+        try:
+            interval = config.getfloat("Sessions", "REAP_INTERVAL_SECONDS", fallback=30)
+        except ValueError as e:         # Thrown if the setting isn't a number.
+            print(f"Invalid session reaper interval in the configuration file: {e}. Using 30 seconds.")
+            interval = 30
+        
+        self.sessionReaper = SessionReaper(self.sessionStore, interval)
+        self.sessionReaper.Start()
+    
+    # Returns the session gauges: live sessions, the reaper's heap size, the estimated memory they hold and how many sessions have been reaped.
+    def GetSessionGauges(self):
+        return self.sessionStore.GetGauges()
+    
+    # Stops the reaper and closes the session store, writing back any pending session activity. Called when the application shuts down.
+    def CloseSessions(self):
+        if self.sessionReaper is not None:
+            self.sessionReaper.Stop()
+        self.sessionStore.Close()
+    
+    # Shuts down the password hashing workers. Called when the application shuts down.
+    def ClosePasswordHasher(self):
+        self.hasher.Close()
+    
     # Similar to the LoadConfig function, this is primarily used during initialization but has been separated out for maintainability and encapsulation.
-    # This function returns a MongoClient that connects to the server and can be used for the rest of the class.
-    # <IMPROVEMENT> Separate out into a Connection module and generalize for re-use here and in the other modules.
+    # This function returns the database from the shared, pooled MongoClient for the security layer's service credentials.
     def ConnectToDatabase(self, config):
         
-        # Collect credentials and database details from the config file.
+        # Collect credentials from the config file. Server and pool details are handled by the shared connection manager.
         # While it's no longer an external file, try-except is still good practice for the likely scenarios.
         try:
             USER = config.get("SLLogin", "USER")
             PASS = config.get("SLLogin", "PASS")
-            HOST = config.get("Server", "HOST")
-            PORT = config.getint("Server", "PORT")
-            DB = config.get("Server", "DB")
             
-        except configparser.NoSectionError:     # Thrown if 'CRUDLogin' or 'Server' are not sections within the config file.
+        except configparser.NoSectionError:     # Thrown if 'SLLogin' is not a section within the config file.
             print("Unable to connect to the database. One of the specified sections does not exist in the configuration file.")
             return None
-        except configparser.NoOptionError:      # Thrown if 'USER', 'HOST', etc. are not keys within the config file.
+        except configparser.NoOptionError:      # Thrown if 'USER' or 'PASS' are not keys within the config file.
             print("Unable to connect to the database. One of the specified keys does not exist in the configuration file.")
             return None
         
-        # Connect to MongoDB using those credentials.
+        # Pull the database from the shared client for those credentials.
         try:
-            database = MongoClient('mongodb://%s:%s@%s:%d/%s' % (USER,PASS,HOST,PORT,DB))[DB]
+            database = GetConnectionManager().GetDatabase(USER, PASS)
             
             # Verify success, then return the database for use.
             if database is not None:
-                print(f"Connected to database: {DB}, type {type(database)}")
+                print(f"Connected to database: {database.name}, type {type(database)}")
                 return database
             else:
-                print(f"Failed to connected to the {DB} database.")
+                print(f"Failed to connect to the database.")
                 return None
             
         except errors.ConnectionFailure as e:     # Thrown if there is some kind of connection error.
@@ -177,37 +264,118 @@ class SecurityLayer:
 
     
     # Function to authenticate a login attempt by verifying the provided credentials against the credentials stored in the database.
-    # Just provides a boolean authentication and the dashboard should call success or failure accordingly for session management purposes.
+    # Returns a boolean. The outcome is recorded here, so the dashboard only needs to call LoginSuccess for a session token.
+    # A login takes at most two database operations:
+    #   1. CheckLoginAttempt fetches the user, lifts an expired lock and, if the account is still locked, counts the attempt as a failure.
+    #   2. RecordLoginSuccess or RecordLoginFailure resets the failures (storing an upgraded hash if needed) or counts the failure and locks at the threshold.
+    # Unknown users and locked accounts are turned away after the first.
     def AuthenticateUser(self, username, password):
         
-        # Verify user exists.
-        user = self.VerifyUser(username)
+        # Fetch the user, with their lock status brought up to date.
+        user = self.CheckLoginAttempt(username)
         
         # If they don't exist, reject the login attempt.
-        # Cannot trigger a LoginFailure() for the user since the user does not exist.
-        # <IMPROVEMENT> Expand the user session to include pre-login periods so that each IP address only has so many login attempts before they are locked out.
+        # There's no user to record a failure against.
         # <IMPROVEMENT> Communicate to the dashboard the reason why the login failed so the user can decide how to proceed.
         if user is None:
             print(f"Login attempt for {username} failed. No matching user.")
             return False
         
-        # Before we test the login credentials, check the account's locked status.
+        # A locked account is rejected without checking the password. The attempt has already been counted.
         # <IMPROVEMENT> Communicate to the dashboard the reason why the login failed so the user can decide how to proceed.
-        if self.GetAccountLocked(user):
+        if user.get("isLocked"):
             print(f"Login attempt for {username} failed; account is locked.")
             return False
         
-        # Hash the supplied password using SHA-256
-        hashedPassword = self.HashPassword(password)
-        
         # Retrieve the stored password hash from user data
         storedPasswordHash = user.get("hashed_password")
         
-        # Verify hashed credentials against each other.
-        # This will return a simple boolean result, so we can just return it directly.
-        # <IMPROVEMENT> Communicate to the dashboard the reason why the login failed (if it did) so the user can decide how to proceed.
+        # Verify the supplied password against the stored hash. The hasher reads the algorithm, cost and salt from the stored hash itself,
+        # and tells us whether it was made with older settings (or is a legacy SHA-256 hash) and should be replaced.
         # <CORRECTION> This should be reworked to return the token directly rather than rely on the client to request it separate from verification.
-        return self.VerifyPassword(hashedPassword, storedPasswordHash)
+        try:
+            match, needsRehash = self.hasher.Verify(password, storedPasswordHash)
+        except Exception as e:          # Catch-all
+            print(f"Password verification error: {e}")
+            match, needsRehash = False, False
+        
+        if not match:
+            self.RecordLoginFailure(username)
+            return False
+        
+        # Now that we know the password, an outdated hash is upgraded to the current settings in the same write that resets the failures.
+        self.RecordLoginSuccess(username, self.HashPassword(password) if needsRehash else None)
+        return True
+    
+    # First half of a login: fetches the user in one find_one_and_update, bringing their lock up to date on the server as it does.
+    # A lock older than the session lifespan is lifted. If the account is still locked, the attempt is counted as a failure (extending the lock).
+    # Returns the user as it stands afterwards, or None if there is no such user.
+    # Times come from the server's clock ($$NOW), so every worker agrees on when a lock expires.
+    def CheckLoginAttempt(self, username):
+        
+        lastAttempt = {"$ifNull": ["$lastLoginAttempt", {"$toDate": 0}]}
+        lockExpired = {"$gt": [{"$subtract": ["$$NOW", lastAttempt]}, self.sessionLifespan * 1000]}
+        
+        try:
+            return self.collection.find_one_and_update(
+                {"username": username},
+                [
+                    {"$set": {"loginLocked": {"$and": [{"$eq": ["$isLocked", True]}, {"$not": [lockExpired]}]}}},
+                    {"$set": {
+                        "isLocked": "$loginLocked",
+                        "recentFailedAttempts": {"$cond": ["$loginLocked", {"$add": [{"$ifNull": ["$recentFailedAttempts", 0]}, 1]}, "$recentFailedAttempts"]},
+                        "lastLoginAttempt": {"$cond": ["$loginLocked", "$$NOW", "$lastLoginAttempt"]}
+                    }},
+                    {"$unset": "loginLocked"}
+                ],
+                projection={"username": 1, "hashed_password": 1, "isLocked": 1, "recentFailedAttempts": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except errors.OperationFailure as e:        # Throws if the operation fails for some reason
+            print(f"MongoDB login check failed. Username: {username} -- Error: {e}")
+            return None
+        except Exception as e:          # Catch-all
+            print(f"An unexpected exception occurred during the login check: Username: {username} -- Error: {e}")
+            return None
+    
+    # Records a successful login in one update: clears the recent failures, stamps the attempt time and, if given, stores the upgraded password hash.
+    def RecordLoginSuccess(self, username, hashedPassword=None):
+        
+        changes = {"recentFailedAttempts": 0, "lastLoginAttempt": "$$NOW"}
+        if hashedPassword is not None:
+            changes["hashed_password"] = {"$literal": hashedPassword}
+        
+        try:
+            self.collection.update_one({"username": username}, [{"$set": changes}])
+            if hashedPassword is not None:
+                print(f"Upgraded the stored password hash for {username} to {self.hasher.algorithm}.")
+            return True
+        except errors.OperationFailure as e:        # Throws if the operation fails for some reason
+            print(f"MongoDB login success update failed. Username: {username} -- Error: {e}")
+            return False
+        except Exception as e:          # Catch-all
+            print(f"An unexpected exception occurred while recording a login success: Username: {username} -- Error: {e}")
+            return False
+    
+    # Records a failed login in one update: counts the failure, stamps the attempt time and locks the account once the failures reach the threshold.
+    # The count is incremented on the server, so concurrent failures can't overwrite each other.
+    def RecordLoginFailure(self, username):
+        
+        try:
+            self.collection.update_one({"username": username}, [
+                {"$set": {
+                    "recentFailedAttempts": {"$add": [{"$ifNull": ["$recentFailedAttempts", 0]}, 1]},
+                    "lastLoginAttempt": "$$NOW"
+                }},
+                {"$set": {"isLocked": {"$or": [{"$eq": ["$isLocked", True]}, {"$gte": ["$recentFailedAttempts", self.loginFailureThreshold]}]}}}
+            ])
+            return True
+        except errors.OperationFailure as e:        # Throws if the operation fails for some reason
+            print(f"MongoDB login failure update failed. Username: {username} -- Error: {e}")
+            return False
+        except Exception as e:          # Catch-all
+            print(f"An unexpected exception occurred while recording a login failure: Username: {username} -- Error: {e}")
+            return False
         
     
     # Function for verifying that a given user is present in the login database. If so, return the user data for use.
@@ -223,16 +391,17 @@ class SecurityLayer:
             print(f"Username {username} not found.")
             return None
     
-    # Password hashing function for login attempts and registration
+    # Password hashing function for registration and rehashing.
+    # Returns the stored form, algorithm$parameters$salt$hash, made with a fresh salt and the configured KDF and cost.
     def HashPassword(self, password):
         
-        # We'll use the SHA-256 algorithm from the hashlib library to handle this.
-        # <IMPROVEMENT> Implement salting prior to the hashing. Be sure to store the generated salt to the login database and update any existing logins accordingly.
+        # The KDF runs in the hasher's worker pool. It is salted, so hashing the same password twice gives different results;
+        # use hasher.Verify() rather than comparing hashes to check a password.
         try:
-            hashedPassword = hashlib.sha256(password.encode()).hexdigest()
+            hashedPassword = self.hasher.Hash(password)
             
-            # Hashlib won't give us an error if the hashing fails so to verify that the hashing was successful, we check for the correct length.
-            if len(hashedPassword) != 64:
+            # Verify the hashing was successful by checking the stored form can be read back.
+            if self.hasher.NeedsRehash(hashedPassword):
                 print("Password hashing failed.")
                 return None
             else:
@@ -242,81 +411,21 @@ class SecurityLayer:
             print(f"Hashing error: {e}")
             return None
     
-    # Function to verify password hashes match using hashlib.
-    def VerifyPassword(self, inputPasswordHash, storedPasswordHash):
-        
-        # Secrets provides a secure comparison function to protect the intrinsic information about the passwords.
-        # This function takes two hashes and returns a boolean based on their comparison, so we can pass that straight on.
-        match = secrets.compare_digest(inputPasswordHash, storedPasswordHash)
-        return match
-        
-        
+    
     # Function for handling successful login attempts. Called by the dashboard after a successful AuthenticateUser
     # Returns a security token.
     def LoginSuccess(self, username):
         
         # A successful authentication requires that the user and their credentials have been verified, so we can skip straight to functionality.
-                
-        # Firstly, a successful login attempt should clear the recent failures.
-        # We'll update the last login attempt at the same time just for completeness's sake.
-        self.UpdateDatabase(username, { 
-                    "recentFailedAttempts" : 0,
-                    "lastLoginAttempt": datetime.datetime.now()
-                })
-        
-        # Second, generate an active session for the user and return it.
+        # AuthenticateUser has already cleared the recent failures, so all that's left is to generate an active session for the user and return it.
         return self.GenerateActiveSession(username)
     
-    # Function to handle account locking and unlocking.
-    # Accepts a database document of the user's information.
-    # Returns a boolean for whether the account is currently locked after processing is complete.
-    def GetAccountLocked(self, user):
-        
-        # First, check to see if the user is currently locked. If it isn't, we can carry on as normal.
-        accountLocked = user.get("isLocked")
-        if not accountLocked:
-            return False
-            
-        # Store the username for future use.
-        username = user.get("username")
-        
-        # Since the account is locked, first check to see when the last login attempt took place. If it's beyond the lockout duration, we can unlock it.
-        lastLoginAttempt = user.get("lastLoginAttempt")
-        # Subtracting two datetime objects results in a timedelta object, which lets us pull total_seconds() directly.
-        if (datetime.datetime.now() - lastLoginAttempt).total_seconds() > self.sessionLifespan:
-            # If it's been longer than the session lifespan, unlock the account and return that there is no lock.
-            self.AccountLock(username, False)
-            return False
-        else:
-            # Otherwise, it's locked and this is a failed login attempt.
-            return True
-    
-    # Function for handling failed login attempts. Called by the dashboard after a failed AuthenticateUser
-    # <CORRECTION> This should be handled automatically rather than rely on the client to report accurately.
+    # Function for handling failed login attempts that happen outside AuthenticateUser, which records its own failures.
+    # Unknown usernames match nothing, so nothing is recorded for them.
     def LoginFailure(self, username):
         
-        # There are situations where a login can fail but not be attributed to any specific user.
-        # Retrieve the user information.
-        user = self.VerifyUser(username)
-        
-        # if the user doesn't exist, we're done.
-        # <IMPROVEMENT> Expand the user session to include pre-login periods so that each IP address only has so many login attempts before they are locked out.
-        if user is None:
-            return
-        
-        # Otherwise, the user exists so we can use their data.
-        recentFailedAttempts = user.get("recentFailedAttempts", 0) + 1
-        
-        # A failed login attempt should increment the recent failed attempts and last login attempt time.
-        self.UpdateDatabase(username, { 
-                        "recentFailedAttempts" : recentFailedAttempts,
-                        "lastLoginAttempt": datetime.datetime.now()
-                    })
-        
-        # Check against threshold
-        if recentFailedAttempts >= self.loginFailureThreshold:
-            # Lock if threshold exceeded
-            self.AccountLock(username, True)
+        # Counting the failure and locking at the threshold is a single update on the server.
+        self.RecordLoginFailure(username)
         
     # Function to handle locking accounts after several failed login attempts and unlocking as needed.
     def AccountLock(self, username, lockStatus):
@@ -332,7 +441,7 @@ class SecurityLayer:
         # We have the first one, so we need to generate the last two.
         
         # Generate an initial lastActivity timestamp.
-        lastActivity = datetime.datetime.now()
+        lastActivity = self.SessionTime()
         
         # Generate a security token.
         securityToken = self.GenerateSecurityToken()
@@ -340,14 +449,13 @@ class SecurityLayer:
         # Generate a UUID for the session
         sessionID = self.GenerateUUID()
         
-        # The security layer stores all active sessions in self.activeSessions for verification purposes.
-        # <IMPROVEMENT>: A more robust database-centric solution would improve scaling and usability.        
+        # The security layer stores all active sessions in its session store for verification purposes.
         sessionData = {
             "username": username,
             "token": securityToken,
             "lastActive": lastActivity
         }
-        self.activeSessions[sessionID] = sessionData
+        self.sessionStore.Put(sessionID, sessionData)
         
         # Finally, return the relevant session details for transmission to the user and local storage.
         return {"UUID": sessionID, "token": securityToken}
@@ -372,12 +480,12 @@ class SecurityLayer:
         
         try:
             # Confirm the UUID is present. If it isn't, reject validation.
-            if UUID not in self.activeSessions:
+            session = self.sessionStore.Get(UUID)
+            if session is None:
                 return False
             
-            # The session exists at this point. Get a reference to the session and current time since we'll be using both a few times.
-            session = self.activeSessions[UUID]
-            currentTime = datetime.datetime.now()
+            # The session exists at this point. Get the current time since we'll be using it a few times.
+            currentTime = self.SessionTime()
             
             # Confirm the UUID has not yet expired. If it has, end the session and reject validation.
             if (currentTime - session["lastActive"]).total_seconds() > self.sessionLifespan:
@@ -392,7 +500,7 @@ class SecurityLayer:
             # We only reach this point if the session exists and is currently valid.
             
             # Update the session's last active time and confirm validity.
-            session["lastActive"] = currentTime
+            self.sessionStore.Touch(UUID, currentTime)
             return True
             
         except KeyError as e:           # Thrown if the key requested 'lastActive', 'token' are not present. Should never happen. Should.
@@ -406,13 +514,14 @@ class SecurityLayer:
     
     # Function to end an active session. Called only when validation identifies an expired session.
     def EndActiveSession(self, UUID):
-        # Technically it's not necessary to verify the UUID is in the dictionary since we only get here if it is, but it won't hurt anything either.
-        if UUID in self.activeSessions:
-            # activeSessions is a dictionary of dictionaries, so we need to purge the session dictionary and THEN purge the activeSessions entry.
-            self.activeSessions[UUID].clear()       # Clears out all elements of the dictionary contained at self.activeSessions[UUID]
-            del self.activeSessions[UUID]           # Deletes the UUID entry in self.activeSessions.
-            
+        # The session store removes the session (and, for the MongoDB store, its cached copy). Unknown UUIDs are ignored.
+        self.sessionStore.Delete(UUID)
         return
+    
+    # Returns the current time for session timestamps, in UTC.
+    # The MongoDB session store's TTL index compares lastActive against the server's UTC clock, so local times would expire sessions early or late.
+    def SessionTime(self):
+        return UtcNow()
         
     # Function to update database values for a given user. Only called after verification is completed.
     # Accepts the target username and a dictionary of {field : newValue}. Returns boolean for success or failure.
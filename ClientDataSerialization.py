@@ -0,0 +1,100 @@
+# **************************************************
+#
+# Filename: ClientDataSerialization.py
+# Version: 1.0.0
+# Purpose: Turn the dashboard's DataFrames into DataTable payloads quickly, working column by column instead of row by row.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * orjson is optional. Without it, payloads are still built column-wise but Dash falls back to its default JSON encoder.
+#
+# **************************************************
+
+# Plotting Routines for graphs, charts, etc.
+import numpy as np
+import pandas as pd
+
+# General utility imports
+import json         # Fallback encoder when orjson isn't installed
+
+# orjson is a much faster JSON encoder, but the dashboard runs without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The currency columns, which are rounded to cents before they're sent to the browser.
+MONEY_COLUMNS = ["account_value", "cash_available", "ytd_distributions", "rmd_amount"]
+
+# Points Dash's response encoder (plotly's JSON engine) at orjson when it's available.
+# Returns the name of the engine in use.
+def ConfigureJsonEngine():
+
+    if orjson is None:
+        print("orjson not installed; Dash will use its default JSON encoder.")
+        return "json"
+
+    try:
+        import plotly.io.json as plotlyJson
+        plotlyJson.config.default_engine = "orjson"
+        return "orjson"
+    except Exception as exception:     # An older plotly without engine selection. Nothing else depends on this, so carry on.
+        print(f"Unable to switch the JSON engine to orjson: {exception}")
+        return "json"
+
+# Converts one column to a plain Python list, rounding money to cents and turning missing values into None (JSON null).
+# Money held as integer cents (see ClientDataSchema) is converted back to dollars on the way out.
+def ColumnToList(series, isMoney=False):
+
+    dtype = series.dtype
+
+    # Categoricals: look each code up in the (small) list of categories. Code -1 (missing) lands on the trailing None.
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = series.cat.categories.tolist() + [None]
+        return [categories[code] for code in series.cat.codes.to_numpy().tolist()]
+
+    if isMoney and dtype.kind in "iu":
+        values = series.to_numpy(dtype="float64", na_value=np.nan) / 100
+    elif dtype.kind == "f":
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+    elif dtype.kind in "iub" and not series.hasnans:
+        return series.to_numpy().tolist()
+    else:
+        # Nullable integers with gaps, objects and datetimes: fall back to pandas for the missing-value check.
+        return series.astype(object).where(series.notna(), None).tolist()
+
+    if isMoney:
+        values = np.round(values, 2)
+    missing = np.isnan(values)
+    result = values.tolist()
+    if missing.any():
+        for index in np.flatnonzero(missing):
+            result[index] = None
+    return result
+
+# Builds the DataTable 'data' payload (a list of row dictionaries) from a DataFrame.
+# Each column is converted to a Python list in one vectorized step and the rows are zipped together at the end,
+# which avoids the per-cell overhead of DataFrame.to_dict('records').
+# columns limits the payload to the columns the table displays; any that are missing from the frame are skipped.
+def SerializeTableRecords(frame, columns=None, moneyColumns=MONEY_COLUMNS):
+
+    if frame is None:
+        return []
+
+    columns = [column for column in (columns or list(frame.columns)) if column in frame.columns]
+    moneyColumns = set(moneyColumns)
+    columnLists = [ColumnToList(frame[column], column in moneyColumns) for column in columns]
+
+    return [dict(zip(columns, row)) for row in zip(*columnLists)]
+
+# Encodes the DataTable payload straight to JSON bytes, using orjson if it is installed.
+# Useful for endpoints or stores that ship table data outside of a Dash callback.
+def EncodeTableJson(frame, columns=None, moneyColumns=MONEY_COLUMNS):
+
+    records = SerializeTableRecords(frame, columns, moneyColumns)
+    if orjson is not None:
+        return orjson.dumps(records)
+    return json.dumps(records, default=str).encode()
@@ -0,0 +1,445 @@
+# **************************************************
+#
+# Filename: ClientDataSessionStore.py
+# Version: 1.0.0
+# Purpose: Hold the SecurityLayer's active sessions, either in this process or in MongoDB so every dashboard worker shares them.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The MongoDB store caches sessions for cacheSeconds. A session ended by one worker stays valid in the other workers' caches until then.
+# * lastActive is written back at most every flushSeconds, so other workers may see a session as up to that much older than it is.
+#
+# **************************************************
+
+# PyMongo
+from pymongo import errors
+from pymongo import UpdateOne, IndexModel
+
+# General utility imports
+import datetime                         # For session expiry times
+import heapq                            # For the expiry-ordered min-heap the reaper works from
+import sys                              # For the memory gauge
+import threading                        # For guarding the cache and running the write-behind flush and the reaper
+import time                             # For cache ages
+from collections import OrderedDict     # For least-recently-used ordering of cached sessions
+
+# Returns the current time for session timestamps: naive UTC, which is what PyMongo hands back and what MongoDB's TTL monitor compares against.
+def UtcNow():
+
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+# Returns an estimate, in bytes, of the memory held by a mapping of session UUID -> session dictionary.
+def SessionMemory(sessions):
+
+    size = sys.getsizeof(sessions)
+    for UUID, session in sessions.items():
+        size += sys.getsizeof(UUID) + sys.getsizeof(session)
+        size += sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in session.items())
+    return size
+
+class ExpiryHeap:
+
+    """ A min-heap of (expiresAt, UUID), so the next session to expire is always on top """
+
+    # Sessions are pushed once, with the expiry they had when they were stored. Activity doesn't push them again;
+    # instead, when an entry reaches the top, its session's current expiry is checked and the entry is pushed back if the session
+    # has been active since (a lazy re-push). Every operation is O(log n) and the heap holds at most one entry per session.
+
+    def __init__(self):
+
+        self.heap = []
+        self.tracked = set()                # UUIDs with an entry in the heap
+
+    # Adds a session's expiry time, unless the session already has an entry (which will be re-pushed if the session is still live
+    # when it reaches the top). Returns True if an entry was added.
+    def Push(self, UUID, expiresAt):
+
+        if UUID in self.tracked:
+            return False
+        self.tracked.add(UUID)
+        heapq.heappush(self.heap, (expiresAt, UUID))
+        return True
+
+    # Pops every entry due by now and returns the UUIDs that really have expired.
+    # expiresAt(UUID) gives the session's current expiry, or None if it is already gone.
+    def PopExpired(self, now, expiresAt):
+
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            _, UUID = heapq.heappop(self.heap)
+            current = expiresAt(UUID)
+            if current is None:
+                self.tracked.discard(UUID)
+                continue
+            if current > now:
+                heapq.heappush(self.heap, (current, UUID))
+                continue
+            self.tracked.discard(UUID)
+            expired.append(UUID)
+        return expired
+
+    # Returns the number of entries in the heap.
+    def __len__(self):
+
+        return len(self.heap)
+
+    # Returns an estimate, in bytes, of the memory the heap holds.
+    def MemoryUsage(self):
+
+        return sys.getsizeof(self.heap) + sum(sys.getsizeof(entry) for entry in self.heap) + sys.getsizeof(self.tracked)
+
+class InMemorySessionStore:
+
+    """ Sessions in a dictionary local to this process. Fast, but not shared between workers and lost on restart """
+
+    def __init__(self, lifespanSeconds=600):
+
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+        # Sessions expire lifespanSeconds after their last activity. The reaper removes them in expiry order using this heap.
+        self.lifespan = datetime.timedelta(seconds=lifespanSeconds)
+        self.expiries = ExpiryHeap()
+        self.reaped = 0
+
+    # Returns the session {"username", "token", "lastActive"} for a UUID, or None.
+    def Get(self, UUID):
+
+        return self.sessions.get(UUID)
+
+    # Stores a new session.
+    def Put(self, UUID, sessionData):
+
+        with self.lock:
+            self.sessions[UUID] = sessionData
+            self.expiries.Push(UUID, sessionData["lastActive"] + self.lifespan)
+
+    # Records the session's latest activity.
+    def Touch(self, UUID, lastActive):
+
+        session = self.sessions.get(UUID)
+        if session is not None:
+            session["lastActive"] = lastActive
+
+    # Removes a session.
+    def Delete(self, UUID):
+
+        with self.lock:
+            session = self.sessions.pop(UUID, None)
+        if session is not None:
+            session.clear()
+
+    # Returns the number of sessions held.
+    def Count(self):
+
+        return len(self.sessions)
+
+    # Returns when a session expires, or None if there is no such session.
+    def ExpiresAt(self, UUID):
+
+        session = self.sessions.get(UUID)
+        if session is None or session.get("lastActive") is None:
+            return None
+        return session["lastActive"] + self.lifespan
+
+    # Removes every session that has expired by now. Returns how many were removed.
+    def ReapExpired(self, now=None):
+
+        now = now or UtcNow()
+        with self.lock:
+            expired = self.expiries.PopExpired(now, self.ExpiresAt)
+            for UUID in expired:
+                session = self.sessions.pop(UUID, None)
+                if session is not None:
+                    session.clear()
+            self.reaped += len(expired)
+        return len(expired)
+
+    # Returns the live session count, the heap size, the estimated memory both hold and how many sessions have been reaped.
+    def GetGauges(self):
+
+        with self.lock:
+            return {
+                "liveSessions": len(self.sessions),
+                "heapEntries": len(self.expiries),
+                "memoryBytes": SessionMemory(self.sessions) + self.expiries.MemoryUsage(),
+                "reaped": self.reaped
+            }
+
+    # Nothing to release for the in-memory store.
+    def Close(self):
+
+        return
+
+class MongoSessionStore:
+
+    """ Sessions in a MongoDB collection shared by every worker, behind a small read-through cache """
+
+    def __init__(self, collection, lifespanSeconds, cacheSeconds=5, flushSeconds=15, maxCached=10000):
+
+        # Session documents: {"_id": UUID, "username", "token", "lastActive"}. A TTL index on lastActive has MongoDB remove
+        # sessions once they've been idle for the session lifespan, so abandoned sessions never pile up in the collection.
+        self.collection = collection
+        self.lifespanSeconds = lifespanSeconds
+
+        # Cached sessions are trusted for cacheSeconds before they're read again, so validating an active session is normally a dictionary lookup.
+        self.cacheSeconds = cacheSeconds
+        self.maxCached = maxCached
+        self.cache = OrderedDict()          # UUID -> (cachedAt, session)
+        self.lock = threading.Lock()
+
+        # MongoDB's TTL monitor removes expired session documents; the reaper removes their cached copies here, in expiry order.
+        self.lifespan = datetime.timedelta(seconds=lifespanSeconds)
+        self.expiries = ExpiryHeap()
+        self.reaped = 0
+
+        # lastActive updates are collected here and written in one bulk write every flushSeconds, instead of a write per validation.
+        self.flushSeconds = flushSeconds
+        self.pendingTouches = {}
+        self.stopEvent = threading.Event()
+        self.flushThread = None
+
+        # Counters, so we can see how often validation needs the database.
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.flushes = 0
+
+        self.EnsureIndexes()
+        self.StartFlushing()
+
+    # Creates the TTL index on lastActive. If it already exists with a different lifespan, its expiry is updated to match.
+    def EnsureIndexes(self):
+
+        try:
+            self.collection.create_indexes([IndexModel([("lastActive", 1)], name="lastActive_ttl", expireAfterSeconds=self.lifespanSeconds)])
+        except errors.OperationFailure as operationFailure:
+            # An index with the same name but another expireAfterSeconds is an IndexOptionsConflict; collMod changes it in place.
+            try:
+                self.collection.database.command("collMod", self.collection.name, index={"name": "lastActive_ttl", "expireAfterSeconds": self.lifespanSeconds})
+            except errors.OperationFailure:
+                print(f"Unable to ensure the session TTL index: {operationFailure}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred while ensuring the session TTL index: {exception}")
+
+    #########################
+    # Sessions
+    #########################
+
+    # Returns the session {"username", "token", "lastActive"} for a UUID, or None. Served from the cache when it's fresh enough.
+    # Unknown UUIDs aren't cached, so a session created by another worker is found straight away.
+    def Get(self, UUID):
+
+        now = time.monotonic()
+        with self.lock:
+            cached = self.cache.get(UUID)
+            if cached is not None and now - cached[0] <= self.cacheSeconds:
+                self.cache.move_to_end(UUID)
+                self.cacheHits += 1
+                return cached[1]
+            self.cacheMisses += 1
+
+        try:
+            document = self.collection.find_one({"_id": UUID})
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure while reading session {UUID}: {operationFailure}")
+            return None
+
+        if document is None:
+            with self.lock:
+                self.cache.pop(UUID, None)
+            return None
+
+        session = {"username": document.get("username"), "token": document.get("token"), "lastActive": document.get("lastActive")}
+        with self.lock:
+            # A touch this worker hasn't flushed yet is newer than what's in the database.
+            if UUID in self.pendingTouches and (session["lastActive"] is None or self.pendingTouches[UUID] > session["lastActive"]):
+                session["lastActive"] = self.pendingTouches[UUID]
+            self.CacheSession(UUID, session)
+        return session
+
+    # Stores a new session. Written straight away, so other workers can validate it on their next request.
+    def Put(self, UUID, sessionData):
+
+        self.collection.replace_one({"_id": UUID}, dict(sessionData), upsert=True)
+        with self.lock:
+            self.CacheSession(UUID, dict(sessionData))
+
+    # Records the session's latest activity. The cache is updated now; the database on the next flush.
+    def Touch(self, UUID, lastActive):
+
+        with self.lock:
+            cached = self.cache.get(UUID)
+            if cached is not None:
+                cached[1]["lastActive"] = lastActive
+            self.pendingTouches[UUID] = lastActive
+
+    # Removes a session from the cache and the database.
+    def Delete(self, UUID):
+
+        with self.lock:
+            self.cache.pop(UUID, None)
+            self.pendingTouches.pop(UUID, None)
+        try:
+            self.collection.delete_one({"_id": UUID})
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure while deleting session {UUID}: {operationFailure}")
+
+    # Returns the number of live sessions across every worker.
+    def Count(self):
+
+        try:
+            return self.collection.estimated_document_count()
+        except errors.OperationFailure as operationFailure:
+            print(f"Operation failure while counting sessions: {operationFailure}")
+            return 0
+
+    # Adds a session to the cache, evicting the least recently used entries beyond maxCached. Call with the lock held.
+    # A session that was evicted and is cached again may still have its heap entry, in which case Push leaves it at that one entry.
+    def CacheSession(self, UUID, session):
+
+        if session.get("lastActive") is not None:
+            self.expiries.Push(UUID, session["lastActive"] + self.lifespan)
+        self.cache[UUID] = (time.monotonic(), session)
+        self.cache.move_to_end(UUID)
+        while len(self.cache) > self.maxCached:
+            self.cache.popitem(last=False)
+
+    # Returns when a cached session expires, or None if it isn't cached. Call with the lock held.
+    def ExpiresAt(self, UUID):
+
+        cached = self.cache.get(UUID)
+        if cached is None or cached[1].get("lastActive") is None:
+            return None
+        return cached[1]["lastActive"] + self.lifespan
+
+    # Drops cached sessions that have expired by now, along with any activity still waiting to be written for them.
+    # The documents themselves are left to the TTL index. Returns how many were dropped.
+    def ReapExpired(self, now=None):
+
+        now = now or UtcNow()
+        with self.lock:
+            expired = self.expiries.PopExpired(now, self.ExpiresAt)
+            for UUID in expired:
+                self.cache.pop(UUID, None)
+                self.pendingTouches.pop(UUID, None)
+            self.reaped += len(expired)
+        return len(expired)
+
+    # Returns the live session count (across every worker), this worker's cached sessions, the heap size,
+    # the estimated memory the cache and heap hold and how many cached sessions have been reaped.
+    def GetGauges(self):
+
+        liveSessions = self.Count()
+        with self.lock:
+            return {
+                "liveSessions": liveSessions,
+                "cachedSessions": len(self.cache),
+                "heapEntries": len(self.expiries),
+                "memoryBytes": SessionMemory({UUID: session for UUID, (_, session) in self.cache.items()}) + sys.getsizeof(self.cache) + self.expiries.MemoryUsage(),
+                "reaped": self.reaped
+            }
+
+    #########################
+    # Write-Behind
+    #########################
+
+    # Writes every pending lastActive update in one unordered bulk write. $max keeps a slower worker from moving a session's time backwards.
+    # Returns the number of sessions written.
+    def Flush(self):
+
+        with self.lock:
+            touches = self.pendingTouches
+            self.pendingTouches = {}
+
+        if not touches:
+            return 0
+
+        try:
+            self.collection.bulk_write([UpdateOne({"_id": UUID}, {"$max": {"lastActive": lastActive}}) for UUID, lastActive in touches.items()], ordered=False)
+            self.flushes += 1
+        except errors.PyMongoError as exception:
+            # Put them back so the next flush tries again, unless a newer touch has arrived in the meantime.
+            print(f"Unable to write session activity: {exception}")
+            with self.lock:
+                for UUID, lastActive in touches.items():
+                    self.pendingTouches.setdefault(UUID, lastActive)
+            return 0
+        return len(touches)
+
+    # Starts the daemon thread that flushes pending touches every flushSeconds.
+    def StartFlushing(self):
+
+        def FlushLoop():
+            while not self.stopEvent.wait(self.flushSeconds):
+                self.Flush()
+
+        self.flushThread = threading.Thread(target=FlushLoop, name="session-store-flush", daemon=True)
+        self.flushThread.start()
+
+    # Stops the flush thread and writes anything still pending.
+    def Close(self):
+
+        self.stopEvent.set()
+        if self.flushThread is not None:
+            self.flushThread.join(timeout=self.flushSeconds)
+        self.Flush()
+
+    # Returns the cache's counters and size.
+    def GetStats(self):
+
+        with self.lock:
+            return {
+                "cached": len(self.cache),
+                "pendingTouches": len(self.pendingTouches),
+                "cacheHits": self.cacheHits,
+                "cacheMisses": self.cacheMisses,
+                "flushes": self.flushes
+            }
+
+class SessionReaper:
+
+    """ A daemon thread that removes expired sessions from a session store every few seconds """
+
+    def __init__(self, store, intervalSeconds=30):
+
+        self.store = store
+        self.intervalSeconds = intervalSeconds
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    # Runs one pass. Returns the number of sessions removed.
+    def RunOnce(self):
+
+        try:
+            reaped = self.store.ReapExpired()
+            if reaped:
+                print(f"Session reaper removed {reaped} expired session(s).")
+            return reaped
+        except Exception as exception:      # The reaper must keep running whatever goes wrong in one pass.
+            print(f"An unexpected exception occurred while reaping sessions: {exception}")
+            return 0
+
+    # Starts the reaper thread.
+    def Start(self):
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        def ReapLoop():
+            while not self.stopEvent.wait(self.intervalSeconds):
+                self.RunOnce()
+
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=ReapLoop, name="session-reaper", daemon=True)
+        self.thread.start()
+
+    # Stops the reaper thread.
+    def Stop(self):
+
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.intervalSeconds)
+            self.thread = None
@@ -0,0 +1,330 @@
+# **************************************************
+#
+# Filename: ClientDataSessions.py
+# Version: 1.0.0
+# Purpose: Keep each logged-in dashboard session's CRUD layer and data apart, keyed by the SecurityLayer session UUID,
+#          while sharing read-only snapshots and long-lived data services between sessions that ask for the same thing.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Shared snapshots are rebuilt by age, not by write. A write made through one session shows up in the other sessions' snapshots
+#   once the snapshot ages out, the same as the CRUD layer's query cache.
+# * The registry is per process. Running several dashboard processes gives each its own registry.
+#
+# **************************************************
+
+# General utility imports
+import threading                        # For guarding the registry against concurrent callbacks
+import time                             # For idle and snapshot age tracking
+from collections import OrderedDict     # For least-recently-used ordering of sessions
+from concurrent.futures import ThreadPoolExecutor   # For warming sessions' data up in the background
+
+class SessionState:
+
+    """ Everything one logged-in dashboard session owns """
+
+    def __init__(self, sessionID, username, crud=None):
+
+        # Who the session belongs to and the CRUD layer opened with their credentials.
+        # The CRUD layer may be opened later by the session's warm-up (see SessionStateRegistry.StartWarmup).
+        self.sessionID = sessionID
+        self.username = username
+        self.crud = crud
+
+        # Warm-up state: "pending", "loading", "ready" or "failed", how far along it is (0 to 1), and what it's doing.
+        self.status = "ready" if crud is not None else "pending"
+        self.progress = 1.0 if crud is not None else 0.0
+        self.message = ""
+
+        # The session's current frame and, if it came from a shared snapshot, that snapshot's key.
+        # The frame is read-only; it may be the very same object other sessions are looking at.
+        self.frame = None
+        self.frameKey = None
+
+        # Keys of the shared services (see SessionStateRegistry.GetShared) this session holds a reference to.
+        self.sharedKeys = set()
+
+        # The session's server-side table query, kept so it remembers where each page it has served ends (see DataTableQuery.KeysetPage).
+        self.tableQuery = None
+
+        self.lastActive = time.monotonic()
+
+    # Records warm-up progress. Called from the warm-up worker; the dashboard polls it.
+    def ReportProgress(self, progress, message):
+
+        self.status = "loading"
+        self.progress = progress
+        self.message = message
+        print(f"Session {self.sessionID} warm-up: {message} ({progress:.0%})")
+
+    # True once the session's data is loaded and its callbacks can be served.
+    def IsReady(self):
+
+        return self.status == "ready"
+
+class SessionStateRegistry:
+
+    """ Session states keyed by session UUID, with LRU eviction of idle sessions' frames and shared read-only snapshots """
+
+    def __init__(self, maxSessions=256, maxFrames=16, idleSeconds=600, snapshotSeconds=30, warmupWorkers=4):
+
+        # Bounds. At most maxSessions sessions are tracked and at most maxFrames of them hold on to a frame.
+        # Sessions idle for longer than idleSeconds are dropped entirely; snapshots older than snapshotSeconds are rebuilt on next use.
+        self.maxSessions = maxSessions
+        self.maxFrames = maxFrames
+        self.idleSeconds = idleSeconds
+        self.snapshotSeconds = snapshotSeconds
+
+        # Sessions in least- to most-recently-used order.
+        self.sessions = OrderedDict()
+
+        # Shared snapshots: key -> {"frame", "builtAt", "sessions"}. A snapshot lives as long as at least one session's frame is it.
+        self.snapshots = {}
+
+        # Shared services: key -> {"value", "close", "sessions"}. Closed once the last session holding them goes away.
+        self.shared = {}
+
+        # One lock for the registry's bookkeeping, plus one per key so identical builds run once while different keys build in parallel.
+        self.lock = threading.RLock()
+        self.keyLocks = {}
+
+        # Sessions' data is warmed up on these threads, so logins don't wait for it.
+        self.warmupExecutor = ThreadPoolExecutor(max_workers=warmupWorkers, thread_name_prefix="session-warmup")
+
+        # Counters, so we can see how much sharing and eviction is going on.
+        self.snapshotBuilds = 0
+        self.snapshotHits = 0
+        self.frameEvictions = 0
+        self.sessionEvictions = 0
+
+    #########################
+    # Sessions
+    #########################
+
+    # Adds (or replaces) a session's state. Idle sessions are pruned first so the registry stays within its bounds.
+    def Register(self, state):
+
+        with self.lock:
+            if state.sessionID in self.sessions:
+                self.Remove(state.sessionID)
+
+            self.PruneIdle()
+            while len(self.sessions) >= self.maxSessions:
+                oldestID = next(iter(self.sessions))
+                print(f"Session registry full. Evicting least recently used session {oldestID}.")
+                self.Remove(oldestID)
+                self.sessionEvictions += 1
+
+            self.sessions[state.sessionID] = state
+            return state
+
+    # Returns the state for a session UUID, or None if there is none, and marks it as the most recently used.
+    def Get(self, sessionID):
+
+        with self.lock:
+            state = self.sessions.get(sessionID)
+            if state is None:
+                return None
+            state.lastActive = time.monotonic()
+            self.sessions.move_to_end(sessionID)
+            return state
+
+    # Drops a session, releasing its frame and any shared services it was holding.
+    def Remove(self, sessionID):
+
+        with self.lock:
+            state = self.sessions.pop(sessionID, None)
+            if state is None:
+                return
+            self.ReleaseFrame(state)
+            for key in list(state.sharedKeys):
+                self.Release(state, key)
+
+    # Drops every session that has been idle for longer than idleSeconds. Returns how many were dropped.
+    def PruneIdle(self):
+
+        with self.lock:
+            cutoff = time.monotonic() - self.idleSeconds
+            expired = [sessionID for sessionID, state in self.sessions.items() if state.lastActive < cutoff]
+            for sessionID in expired:
+                self.Remove(sessionID)
+            self.sessionEvictions += len(expired)
+            return len(expired)
+
+    # Runs warmup(state) on a background worker, so the caller (the login) can return straight away.
+    # warmup reports its progress through state.ReportProgress; the state is marked ready when it returns and failed if it raises.
+    def StartWarmup(self, state, warmup):
+
+        state.status = "loading"
+        state.progress = 0.0
+        state.message = "Waiting to load"
+
+        def Run():
+            try:
+                warmup(state)
+
+                # If the session was dropped while it was loading, let go of whatever the warm-up picked up on its behalf.
+                with self.lock:
+                    if self.sessions.get(state.sessionID) is not state:
+                        self.ReleaseFrame(state)
+                        for key in list(state.sharedKeys):
+                            self.Release(state, key)
+
+                state.progress = 1.0
+                state.message = "Ready"
+                state.status = "ready"
+                print(f"Session {state.sessionID} warm-up complete.")
+            except Exception as exception:
+                state.message = f"Loading failed: {exception}"
+                state.status = "failed"
+                print(f"Session {state.sessionID} warm-up failed: {exception}")
+
+        return self.warmupExecutor.submit(Run)
+
+    #########################
+    # Frames and Snapshots
+    #########################
+
+    # Points a session at a frame of its own (not shared), then evicts idle sessions' frames if too many are held.
+    def SetFrame(self, state, frame):
+
+        with self.lock:
+            self.ReleaseFrame(state)
+            state.frame = frame
+            self.EvictFrames()
+
+    # Returns the shared snapshot for key, building it with builder() if it's missing or older than snapshotSeconds,
+    # and makes it the session's current frame. Sessions asking for the same key get the same (read-only) frame object.
+    def GetSnapshot(self, state, key, builder):
+
+        with self.lock:
+            keyLock = self.keyLocks.setdefault(key, threading.Lock())
+
+        # Only one build per key at a time. Anyone else asking for the same key waits here and then reuses the result.
+        with keyLock:
+            with self.lock:
+                entry = self.snapshots.get(key)
+                fresh = entry is not None and time.monotonic() - entry["builtAt"] <= self.snapshotSeconds
+
+            if fresh:
+                frame = entry["frame"]
+                self.snapshotHits += 1
+            else:
+                frame = builder()
+                self.snapshotBuilds += 1
+
+            with self.lock:
+                if not fresh:
+                    # Sessions already sharing this key move over to the rebuilt snapshot, so the old frame can be freed.
+                    entry = {"frame": frame, "builtAt": time.monotonic(), "sessions": set()}
+                    if key in self.snapshots:
+                        entry["sessions"] = self.snapshots[key]["sessions"]
+                        for sessionID in entry["sessions"]:
+                            if sessionID in self.sessions:
+                                self.sessions[sessionID].frame = frame
+                    self.snapshots[key] = entry
+
+                if state.frameKey != key:
+                    self.ReleaseFrame(state)
+                    entry["sessions"].add(state.sessionID)
+                state.frame = frame
+                state.frameKey = key
+                self.EvictFrames()
+
+        return frame
+
+    # Lets go of a session's frame. A shared snapshot nobody is looking at any more is dropped.
+    def ReleaseFrame(self, state):
+
+        with self.lock:
+            key = state.frameKey
+            state.frame = None
+            state.frameKey = None
+            if key is None or key not in self.snapshots:
+                return
+
+            entry = self.snapshots[key]
+            entry["sessions"].discard(state.sessionID)
+            if not entry["sessions"]:
+                del self.snapshots[key]
+
+    # Keeps the number of sessions holding a frame within maxFrames by releasing the least recently used sessions' frames.
+    # The sessions themselves stay logged in; their next request just rebuilds (or re-shares) a frame.
+    def EvictFrames(self):
+
+        with self.lock:
+            holding = [state for state in self.sessions.values() if state.frame is not None]
+            for state in holding[:max(0, len(holding) - self.maxFrames)]:
+                self.ReleaseFrame(state)
+                self.frameEvictions += 1
+
+    #########################
+    # Shared Services
+    #########################
+
+    # Returns the shared service for key, creating it with factory() the first time anyone asks.
+    # close(value) is called once the last session holding it is removed.
+    def GetShared(self, state, key, factory, close=None):
+
+        with self.lock:
+            keyLock = self.keyLocks.setdefault(key, threading.Lock())
+
+        with keyLock:
+            with self.lock:
+                entry = self.shared.get(key)
+            if entry is None:
+                entry = {"value": factory(), "close": close, "sessions": set()}
+                with self.lock:
+                    self.shared[key] = entry
+
+            with self.lock:
+                entry["sessions"].add(state.sessionID)
+                state.sharedKeys.add(key)
+                return entry["value"]
+
+    # Drops a session's hold on a shared service, closing the service if it was the last one.
+    def Release(self, state, key):
+
+        with self.lock:
+            state.sharedKeys.discard(key)
+            entry = self.shared.get(key)
+            if entry is None:
+                return
+
+            entry["sessions"].discard(state.sessionID)
+            if entry["sessions"]:
+                return
+            del self.shared[key]
+
+        if entry["close"] is not None:
+            try:
+                entry["close"](entry["value"])
+            except Exception as exception:
+                print(f"An unexpected exception occurred while closing shared service {key}: {exception}")
+
+    # Drops every session. Called when the dashboard shuts down so shared services (like background refreshers) are stopped.
+    def CloseAll(self):
+
+        self.warmupExecutor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            for sessionID in list(self.sessions):
+                self.Remove(sessionID)
+
+    # Returns the registry's counters and current sizes.
+    def GetStats(self):
+
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "warmingUp": sum(1 for state in self.sessions.values() if state.status == "loading"),
+                "framesHeld": sum(1 for state in self.sessions.values() if state.frame is not None),
+                "snapshots": len(self.snapshots),
+                "sharedServices": len(self.shared),
+                "snapshotBuilds": self.snapshotBuilds,
+                "snapshotHits": self.snapshotHits,
+                "frameEvictions": self.frameEvictions,
+                "sessionEvictions": self.sessionEvictions
+            }
@@ -0,0 +1,310 @@
+# **************************************************
+#
+# Filename: ClientDataSummary.py
+# Version: 1.0.0
+# Purpose: Maintain the book_summary collection, the dashboard's headline numbers (AUM, cash available, outstanding RMDs, overdue reviews)
+#          per account_class, so the summary tiles load from a handful of small documents instead of a scan of the book.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Per-write deltas read the affected accounts before and after each write, which isn't atomic with the write itself.
+#   Concurrent writes to the same accounts can leave the summary slightly off until the next Rebuild().
+# * Bulk writes, and writes touching too many accounts to track, mark the summary stale instead. It is rebuilt on a background thread
+#   minRebuildSeconds later, so the tiles can lag those writes by about that long plus the rebuild itself.
+# * Writes made outside the CRUD layer (or by another process) aren't seen at all. Run this file with --rebuild after them.
+#
+# **************************************************
+
+# PyMongo
+from pymongo import errors
+from pymongo import UpdateOne, DeleteMany
+
+# General utility imports
+import configparser     # For parsing the configuration file when run as a script
+import datetime         # For the overdue review cutoff
+import sys              # For command line arguments when run as a script
+import threading        # For running one rebuild at a time
+import time             # For the summary's age and the time of the last write
+
+# The numeric totals kept per account_class. Money is held in integer cents so repeated $inc deltas stay exact.
+SUMMARY_FIELDS = ["accountCount", "totalValueCents", "cashAvailableCents", "rmdOutstandingCents", "rmdAccounts"]
+
+# account_class values that are missing are summarized under this name.
+UNCLASSIFIED = "unclassified"
+
+# Converts a money field to whole cents inside an aggregation. Missing or unreadable values count as zero.
+def CentsExpression(fieldPath):
+
+    amount = {"$convert": {"input": fieldPath, "to": "double", "onError": 0, "onNull": 0}}
+    return {"$toLong": {"$round": [{"$multiply": [amount, 100]}, 0]}}
+
+# Each database's pending background rebuild, shared by every BookSummary in the process,
+# so a burst of bulk writes through any number of sessions' CRUD layers costs one rebuild.
+# database name -> {"changedAt": monotonic time or None, "timer": the scheduled rebuild or None, "lock": rebuild lock}
+summaryStates = {}
+summaryStatesLock = threading.Lock()
+
+class BookSummary:
+
+    """ The book_summary collection: one document of running totals per account_class """
+
+    def __init__(self, database, accountsCollection="accounts", clientsCollection="clients", summaryCollection="book_summary"):
+
+        self.database = database
+        self.accountsCollection = accountsCollection
+        self.clientsCollection = clientsCollection
+        self.summaryCollection = summaryCollection
+
+        # A review is overdue once this many whole days have passed since it, matching the dashboard's Overdue Reviews filter.
+        self.overdueDays = 365
+
+        # A stale summary is rebuilt in the background this long after the write that made it stale,
+        # so writes landing in the meantime are covered by the same rebuild.
+        self.minRebuildSeconds = 10
+
+        with summaryStatesLock:
+            self.state = summaryStates.setdefault(database.name, {"changedAt": None, "timer": None, "lock": threading.Lock()})
+
+    #########################
+    # Contributions
+    #########################
+
+    # Returns the _ids of the accounts a write to collectionName matching target could affect:
+    # the matching accounts themselves, or every account of the matching clients.
+    # limit=1 mirrors a delete_one. With maxAccounts, reading stops once more than that many accounts (or clients) match, so a broad
+    # write doesn't load every _id. Returns None for collections the summary doesn't depend on, or when more than maxAccounts match.
+    def AffectedAccounts(self, collectionName, target, limit=0, maxAccounts=0):
+
+        readLimit = limit or (maxAccounts + 1 if maxAccounts else 0)
+
+        if collectionName == self.accountsCollection:
+            accountIds = [account["_id"] for account in self.database[self.accountsCollection].find(target, {"_id": 1}, limit=readLimit)]
+
+        elif collectionName == self.clientsCollection:
+            clientIds = [client["_id"] for client in self.database[self.clientsCollection].find(target, {"_id": 1}, limit=readLimit)]
+            if maxAccounts and len(clientIds) > maxAccounts:
+                return None
+            if not clientIds:
+                return []
+            cursor = self.database[self.accountsCollection].find({"client_id": {"$in": clientIds}}, {"_id": 1},
+                                                                 limit=maxAccounts + 1 if maxAccounts else 0)
+            accountIds = [account["_id"] for account in cursor]
+
+        else:
+            return None
+
+        if maxAccounts and len(accountIds) > maxAccounts:
+            return None
+        return accountIds
+
+    # Returns what the given accounts currently add to the summary: {account_class: {field: total, "reviewDates": {day: accounts}}}.
+    # accountIds=None summarizes the whole book.
+    # Overdue reviews depend on today's date, so they're kept as a count of accounts per client review date and totalled on read.
+    def Contributions(self, accountIds=None):
+
+        if accountIds is not None and not accountIds:
+            return {}
+
+        rmdOutstanding = {"$max": [{"$subtract": [CentsExpression("$rmd_amount"), CentsExpression("$ytd_distributions")]}, 0]}
+        reviewDate = {"$convert": {"input": "$client.last_review_date", "to": "date", "onError": None, "onNull": None}}
+
+        pipeline = [{"$match": {"_id": {"$in": accountIds}}}] if accountIds is not None else []
+        pipeline += [
+            {"$lookup": {"from": self.clientsCollection, "localField": "client_id", "foreignField": "_id", "as": "client"}},
+            {"$unwind": {"path": "$client", "preserveNullAndEmptyArrays": True}},
+            {"$project": {
+                "accountClass": {"$ifNull": ["$account_class", UNCLASSIFIED]},
+                "reviewDay": {"$ifNull": [{"$dateToString": {"format": "%Y-%m-%d", "date": reviewDate}}, "none"]},
+                "value": CentsExpression("$account_value"),
+                "cash": CentsExpression("$cash_available"),
+                "rmdOutstanding": rmdOutstanding,
+            }},
+            {"$group": {
+                "_id": {"accountClass": "$accountClass", "reviewDay": "$reviewDay"},
+                "accountCount": {"$sum": 1},
+                "totalValueCents": {"$sum": "$value"},
+                "cashAvailableCents": {"$sum": "$cash"},
+                "rmdOutstandingCents": {"$sum": "$rmdOutstanding"},
+                "rmdAccounts": {"$sum": {"$cond": [{"$gt": ["$rmdOutstanding", 0]}, 1, 0]}},
+            }},
+        ]
+
+        contributions = {}
+        with self.database[self.accountsCollection].aggregate(pipeline, allowDiskUse=accountIds is None) as cursor:
+            for group in cursor:
+                accountClass = group["_id"]["accountClass"]
+                totals = contributions.setdefault(accountClass, dict.fromkeys(SUMMARY_FIELDS, 0) | {"reviewDates": {}})
+                for field in SUMMARY_FIELDS:
+                    totals[field] += group[field]
+                reviewDates = totals["reviewDates"]
+                reviewDates[group["_id"]["reviewDay"]] = reviewDates.get(group["_id"]["reviewDay"], 0) + group["accountCount"]
+        return contributions
+
+    #########################
+    # Maintenance
+    #########################
+
+    # Applies the difference between two Contributions() results to the summary documents with $inc, in one bulk write.
+    # Returns the number of summary documents touched.
+    def ApplyDelta(self, before, after):
+
+        operations = []
+        for accountClass in set(before) | set(after):
+            old = before.get(accountClass, {})
+            new = after.get(accountClass, {})
+
+            increments = {}
+            for field in SUMMARY_FIELDS:
+                difference = new.get(field, 0) - old.get(field, 0)
+                if difference:
+                    increments[field] = difference
+            oldDates = old.get("reviewDates", {})
+            newDates = new.get("reviewDates", {})
+            for day in set(oldDates) | set(newDates):
+                difference = newDates.get(day, 0) - oldDates.get(day, 0)
+                if difference:
+                    increments[f"reviewDates.{day}"] = difference
+
+            if increments:
+                operations.append(UpdateOne({"_id": accountClass}, {"$inc": increments, "$currentDate": {"updated_at": True}}, upsert=True))
+
+        if not operations:
+            return 0
+
+        self.database[self.summaryCollection].bulk_write(operations, ordered=False)
+        return len(operations)
+
+    # Records that the accounts or clients have changed in a way the deltas didn't capture, and schedules a background Rebuild()
+    # minRebuildSeconds from now unless one is already pending. Costs nothing on the database.
+    def MarkStale(self):
+
+        with summaryStatesLock:
+            self.state["changedAt"] = time.monotonic()
+            if self.state["timer"] is None:
+                self.ScheduleRebuild()
+
+    # Starts the timer for a background rebuild. Call with summaryStatesLock held.
+    def ScheduleRebuild(self):
+
+        timer = threading.Timer(self.minRebuildSeconds, self.RebuildInBackground)
+        timer.daemon = True
+        timer.name = "book-summary-rebuild"
+        self.state["timer"] = timer
+        timer.start()
+
+    # Runs on the timer thread. Rebuilds the summary, then schedules another rebuild if it was marked stale again while this one ran.
+    def RebuildInBackground(self):
+
+        startedAt = time.monotonic()
+        try:
+            with self.state["lock"]:
+                self.Rebuild()
+        except errors.PyMongoError as pyMongoError:
+            print(f"Background book summary rebuild failed: {pyMongoError}")
+        except Exception as exception:
+            print(f"An unexpected exception occurred during the background book summary rebuild: {exception}")
+
+        with summaryStatesLock:
+            self.state["timer"] = None
+            if self.state["changedAt"] is not None and self.state["changedAt"] >= startedAt:
+                self.ScheduleRebuild()
+
+    # Recomputes the whole summary from the book and replaces the stored documents. Use after bulk loads or to correct drift.
+    # Returns the account classes written.
+    def Rebuild(self):
+
+        contributions = self.Contributions()
+        operations = [
+            UpdateOne({"_id": accountClass}, {"$set": totals, "$currentDate": {"updated_at": True}}, upsert=True)
+            for accountClass, totals in contributions.items()
+        ]
+        # Classes that no longer have any accounts are removed.
+        operations.append(DeleteMany({"_id": {"$nin": list(contributions)}}))
+
+        self.database[self.summaryCollection].bulk_write(operations, ordered=False)
+        print(f"Book summary rebuilt: {', '.join(str(accountClass) for accountClass in contributions) or 'no accounts'}.")
+        return list(contributions)
+
+    #########################
+    # Reading
+    #########################
+
+    # Returns the summary tiles: {"classes": [one row per account_class], "total": the same figures for the whole book}.
+    # Each row holds accountCount, totalValue, cashAvailable, rmdOutstanding (in dollars), rmdAccounts and overdueReviews.
+    # This is a single read of the (small) summary collection; overdue reviews are totalled from the stored review dates.
+    def Read(self, now=None):
+
+        # Review days are stored as UTC dates, so the cutoff is taken in UTC too.
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        cutoff = (now - datetime.timedelta(days=self.overdueDays)).date().isoformat()
+
+        rows = []
+        for document in self.database[self.summaryCollection].find({}).sort("_id", 1):
+            rows.append({
+                "account_class": document["_id"],
+                "accountCount": document.get("accountCount", 0),
+                "totalValue": document.get("totalValueCents", 0) / 100,
+                "cashAvailable": document.get("cashAvailableCents", 0) / 100,
+                "rmdOutstanding": document.get("rmdOutstandingCents", 0) / 100,
+                "rmdAccounts": document.get("rmdAccounts", 0),
+                "overdueReviews": sum(count for day, count in document.get("reviewDates", {}).items() if day != "none" and day <= cutoff),
+            })
+
+        total = {"account_class": "total"}
+        for field in ["accountCount", "totalValue", "cashAvailable", "rmdOutstanding", "rmdAccounts", "overdueReviews"]:
+            total[field] = sum(row[field] for row in rows)
+        total["totalValue"] = round(total["totalValue"], 2)
+        total["cashAvailable"] = round(total["cashAvailable"], 2)
+        total["rmdOutstanding"] = round(total["rmdOutstanding"], 2)
+
+        return {"classes": rows, "total": total}
+
+#######################################################################################################################################
+
+# Run directly to rebuild the summary from scratch and print it:
+#   python ClientDataSummary.py [--rebuild] [--show]
+# Uses the [CRUDLogin] credentials.
+def main():
+
+    # Imported here so the summary itself can be imported without the connection module's side effects.
+    from ClientDataConnection import GetConnectionManager
+
+    arguments = sys.argv[1:] or ["--rebuild", "--show"]
+
+    manager = GetConnectionManager()
+    if manager.config is None:
+        return 1
+
+    try:
+        USER = manager.config.get("CRUDLogin", "USER")
+        PASS = manager.config.get("CRUDLogin", "PASS")
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        print("Unable to read the [CRUDLogin] credentials from the configuration file.")
+        return 1
+
+    database = manager.GetDatabase(USER, PASS)
+    if database is None:
+        return 1
+
+    summary = BookSummary(database)
+    try:
+        if "--rebuild" in arguments:
+            summary.Rebuild()
+        if "--show" in arguments:
+            tiles = summary.Read()
+            for row in tiles["classes"] + [tiles["total"]]:
+                print(f"{row['account_class']:>16}  accounts {row['accountCount']:>7}  AUM {row['totalValue']:>16,.2f}  cash {row['cashAvailable']:>14,.2f}  "
+                      f"RMDs outstanding {row['rmdOutstanding']:>13,.2f} ({row['rmdAccounts']})  overdue reviews {row['overdueReviews']}")
+    except errors.OperationFailure as operationFailure:
+        print(f"Operation failure while maintaining the book summary: {operationFailure}")
+        return 1
+    finally:
+        manager.CloseAll()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
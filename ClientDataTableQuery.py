@@ -0,0 +1,402 @@
+# **************************************************
+#
+# Filename: ClientDataTableQuery.py
+# Version: 1.0.0
+# Purpose: Serve the dashboard DataTable one page at a time, translating its filter_query and sort_by into MongoDB queries
+#          so sorting, filtering and paging happen in the database instead of in the browser.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Sorting on account and client columns at the same time can't be served by a single index, so those pages are joined and sorted in MongoDB with allowDiskUse.
+# * last_review_date may be stored as a date or as a string. MongoDB sorts all strings before all dates, so a book that mixes the two sorts in two runs.
+# * Only the filter syntax the DataTable itself generates (expressions joined with &&) is understood. Anything else is ignored and reported.
+# * Keyset paging only covers stepping forward one page at a time with no sort, or one account-column sort, and no client-column filter.
+#   Jumps to an arbitrary page, client-column sorts or filters, and multi-column sorts fall back to skip/limit, which reads through every earlier row.
+#
+# **************************************************
+
+# General utility imports
+from bson import json_util          # For turning filters into stable page position keys
+from collections import OrderedDict # For least-recently-used ordering of page positions
+import math     # For the page count
+import re       # For parsing filter expressions and building 'contains' matches
+import threading    # For guarding the page positions against concurrent callbacks
+
+#########################
+# Filter Query Parsing
+#########################
+
+# One DataTable filter expression, e.g. {account_value} >= 1000, {last_name} icontains "ho" or {rmd_amount} is blank.
+FILTER_EXPRESSION = re.compile(r"""^\{(?P<column>[^}]+)\}\s+(?P<operator>is blank|is nil|[a-z]+|[<>!=]=?)\s*(?P<value>.*)$""")
+
+# DataTable operators (and their symbolic spellings) mapped to MongoDB comparison operators.
+COMPARISON_OPERATORS = {
+    "=": "$eq", "eq": "$eq",
+    "!=": "$ne", "ne": "$ne",
+    "<": "$lt", "lt": "$lt",
+    "<=": "$lte", "le": "$lte",
+    ">": "$gt", "gt": "$gt",
+    ">=": "$gte", "ge": "$gte",
+}
+
+# Splits a filter_query into its && separated expressions, ignoring any && inside quoted values.
+def SplitFilterQuery(filterQuery):
+
+    return [part.strip() for part in re.split(r"""\s+&&\s+(?=(?:[^"'`]|"[^"]*"|'[^']*'|`[^`]*`)*$)""", filterQuery or "") if part.strip()]
+
+# Parses one filter expression into (column, operator, value, caseInsensitive), or None if it isn't understood.
+# Quoted values stay strings; bare values are read as numbers where possible.
+def ParseFilterExpression(expression):
+
+    match = FILTER_EXPRESSION.match(expression)
+    if match is None:
+        return None
+
+    column = match.group("column")
+    operator = match.group("operator")
+    value = match.group("value").strip()
+
+    # Case prefixes: icontains/ieq are case-insensitive, scontains/seq are explicitly case-sensitive.
+    caseInsensitive = False
+    if len(operator) > 2 and operator[0] in "is" and operator[1:] in COMPARISON_OPERATORS.keys() | {"contains", "datestartswith"}:
+        caseInsensitive = operator[0] == "i"
+        operator = operator[1:]
+
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+        value = value[1:-1]
+    elif value:
+        try:
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+        except ValueError:
+            pass
+
+    return column, operator, value, caseInsensitive
+
+class DataTableQuery:
+
+    """ Page, sort and filter queries for the merged accounts/clients table, run through ClientDataCRUD """
+
+    def __init__(self, crud, accountFields, clientFields, accountsCollection="accounts", clientsCollection="clients"):
+
+        # The CRUD layer the queries run through, and the columns the table shows from each collection.
+        self.crud = crud
+        self.accountFields = list(accountFields)
+        self.clientFields = list(clientFields)
+        self.accountsCollection = accountsCollection
+        self.clientsCollection = clientsCollection
+
+        # Columns holding numbers. A 'contains' filter on one of these is treated as an exact match, since there's no text to search.
+        self.numericFields = {"account_value", "cash_available", "ytd_distributions", "rmd_amount", "days_since_last_review"}
+
+        # Where each page the table has reached begins: (filter, sort, page size, page number) -> read_page continuation token.
+        # Keep one DataTableQuery per session so that paging forward resumes from the previous page instead of skipping over it.
+        self.pageTokens = OrderedDict()
+        self.maxPageTokens = 256
+        self.tokenLock = threading.Lock()
+
+    #########################
+    # Filters
+    #########################
+
+    # Turns a DataTable filter_query into (accountFilter, clientFilter) MongoDB filters.
+    # days_since_last_review becomes a range on the clients' last_review_date, so it is index-backed like the Overdue Reviews filter.
+    def BuildFilters(self, filterQuery):
+
+        accountConditions = []
+        clientConditions = []
+
+        for expression in SplitFilterQuery(filterQuery):
+            parsed = ParseFilterExpression(expression)
+            if parsed is None:
+                print(f"Unable to parse table filter expression: {expression}. Ignoring it.")
+                continue
+
+            column, operator, value, caseInsensitive = parsed
+            if column == "days_since_last_review":
+                condition = self.DaysCondition(operator, value)
+                target = clientConditions
+            elif column in self.accountFields:
+                condition = self.FieldCondition(column, operator, value, caseInsensitive)
+                target = accountConditions
+            elif column in self.clientFields:
+                condition = self.FieldCondition(column, operator, value, caseInsensitive)
+                target = clientConditions
+            else:
+                print(f"Table filter on unknown column {column}. Ignoring it.")
+                continue
+
+            if condition is None:
+                print(f"Unsupported table filter operator '{operator}' on {column}. Ignoring it.")
+                continue
+            target.append(condition)
+
+        return self.Combine(accountConditions), self.Combine(clientConditions)
+
+    # Builds the MongoDB condition for a filter expression on a stored field.
+    def FieldCondition(self, column, operator, value, caseInsensitive=False):
+
+        if operator == "is blank":
+            return {column: {"$in": [None, ""]}}
+        if operator == "is nil":
+            return {column: None}
+
+        if operator == "contains" and column in self.numericFields and not isinstance(value, str):
+            operator = "="
+
+        if operator in ("contains", "datestartswith"):
+            pattern = re.escape(str(value))
+            if operator == "datestartswith":
+                pattern = "^" + pattern
+            return {column: {"$regex": pattern, "$options": "i"} if caseInsensitive else {"$regex": pattern}}
+
+        mongoOperator = COMPARISON_OPERATORS.get(operator)
+        if mongoOperator is None:
+            return None
+
+        # A case-insensitive equality on text has to be a regex; everything else is a plain comparison.
+        if caseInsensitive and isinstance(value, str) and mongoOperator in ("$eq", "$ne"):
+            match = {"$regex": f"^{re.escape(value)}$", "$options": "i"}
+            return {column: match} if mongoOperator == "$eq" else {column: {"$not": match}}
+
+        return {column: {mongoOperator: value}}
+
+    # Builds the clients condition for a filter on the derived days_since_last_review, using the CRUD layer's days range filter.
+    def DaysCondition(self, operator, value):
+
+        if operator == "is blank" or operator == "is nil":
+            return {"last_review_date": {"$in": [None, ""]}}
+
+        mongoOperator = COMPARISON_OPERATORS.get(operator if operator != "contains" else "=")
+        if mongoOperator is None or isinstance(value, str):
+            return None
+
+        # Day counts are whole numbers, so strict bounds move to the next whole day.
+        days = math.floor(value) if mongoOperator in ("$lte", "$gt") else math.ceil(value)
+        if mongoOperator == "$eq":
+            return self.crud.DaysRangeFilter("last_review_date", days, days)
+        if mongoOperator == "$ne":
+            return {"$nor": [self.crud.DaysRangeFilter("last_review_date", days, days)]}
+        if mongoOperator == "$gte":
+            return self.crud.DaysRangeFilter("last_review_date", days, None)
+        if mongoOperator == "$gt":
+            return self.crud.DaysRangeFilter("last_review_date", days + 1, None)
+        if mongoOperator == "$lte":
+            return self.crud.DaysRangeFilter("last_review_date", None, days)
+        return self.crud.DaysRangeFilter("last_review_date", None, days - 1)
+
+    # ANDs a list of conditions together, returning {} for no conditions.
+    def Combine(self, conditions):
+
+        conditions = [condition for condition in conditions if condition]
+        if not conditions:
+            return {}
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    #########################
+    # Sorting
+    #########################
+
+    # Turns a DataTable sort_by list into [(field, direction, side)] where side is "account" or "client".
+    # Sorting by days since the last review is sorting by last_review_date the other way round.
+    def BuildSort(self, sortBy):
+
+        sort = []
+        for entry in sortBy or []:
+            column = entry.get("column_id")
+            direction = -1 if entry.get("direction") == "desc" else 1
+            if column == "days_since_last_review":
+                sort.append(("last_review_date", -direction, "client"))
+            elif column in self.accountFields:
+                sort.append((column, direction, "account"))
+            elif column in self.clientFields:
+                sort.append((column, direction, "client"))
+        return sort
+
+    # Turns a BuildSort list into a $sort document. _id breaks ties in the direction of the first sort column,
+    # matching read_page's order and letting a (field, _id) index be walked in either direction.
+    def SortSpec(self, sort):
+
+        sortSpec = {field: direction for field, direction, _ in sort}
+        sortSpec.setdefault("_id", sort[0][1] if sort else 1)
+        return sortSpec
+
+    #########################
+    # Pages
+    #########################
+
+    # Returns one page of the table as {"rows", "pageCurrent", "pageCount", "totalCount"}: the page's merged rows as dictionaries,
+    # the page actually served (requests past the end are moved back to the last page), how many pages the filter yields, and how many rows.
+    # baseAccountFilter/baseClientFilter come from the dashboard's own filter buttons and are combined with the table's filter_query.
+    def GetPage(self, pageCurrent, pageSize, sortBy=None, filterQuery=None, baseAccountFilter=None, baseClientFilter=None):
+
+        pageSize = pageSize or self.crud.defaultPageSize
+        accountFilter, clientFilter = self.BuildFilters(filterQuery)
+        accountFilter = self.Combine([baseAccountFilter, accountFilter])
+        clientFilter = self.Combine([baseClientFilter, clientFilter])
+        sort = self.BuildSort(sortBy)
+
+        # Client-side conditions are applied in MongoDB by looking up each account's client (see ClientMatchStages),
+        # so no list of client _ids is ever brought back and sent again.
+        matchedAccounts = accountFilter
+        total = self.CountAccounts(accountFilter, clientFilter)
+        pageCount = max(1, math.ceil(total / pageSize))
+        pageCurrent = min(max(0, pageCurrent or 0), pageCount - 1)
+        skip = pageCurrent * pageSize
+        page = {"rows": [], "pageCurrent": pageCurrent, "pageCount": pageCount, "totalCount": total}
+        if total == 0:
+            return page
+
+        sides = {side for _, _, side in sort}
+        if sides == {"client"} and not clientFilter and self.HasOrphanedAccounts(matchedAccounts):
+            # The client-driven pipeline only reaches accounts through their client, so accounts without one would be counted but never shown.
+            # Join from the accounts side instead, which keeps them (with empty client columns) like every other page does.
+            rows = self.crud.aggregate(self.accountsCollection, self.JoinSortedPipeline(matchedAccounts, sort, skip, pageSize), allowDiskUse=True)
+        elif sides == {"client"}:
+            rows = self.crud.aggregate(self.clientsCollection, self.ClientSortedPipeline(clientFilter, accountFilter, sort, skip, pageSize))
+        elif sides == {"client", "account"}:
+            rows = self.crud.aggregate(self.accountsCollection, self.JoinSortedPipeline(matchedAccounts, sort, skip, pageSize, clientFilter), allowDiskUse=True)
+        elif len(sort) <= 1 and not clientFilter:
+            rows = self.KeysetPage(matchedAccounts, sort, pageCurrent, pageSize)
+        else:
+            rows = self.crud.aggregate(self.accountsCollection, self.AccountSortedPipeline(matchedAccounts, sort, skip, pageSize, clientFilter))
+
+        page["rows"] = rows
+        return page
+
+    # Counts the accounts matching accountFilter whose client matches clientFilter.
+    # With a client filter, the count is driven from the (indexed) matching clients, each looking up its matching accounts by client_id.
+    def CountAccounts(self, accountFilter, clientFilter):
+
+        if not clientFilter:
+            return self.crud.count(self.accountsCollection, accountFilter)
+
+        accountMatch = [{"$match": {"$expr": {"$eq": ["$client_id", "$$clientId"]}}}]
+        if accountFilter:
+            accountMatch.append({"$match": accountFilter})
+        accountMatch.append({"$project": {"_id": 1}})
+
+        result = self.crud.aggregate(self.clientsCollection, [
+            {"$match": clientFilter},
+            {"$lookup": {"from": self.accountsCollection, "let": {"clientId": "$_id"}, "pipeline": accountMatch, "as": "account"}},
+            {"$group": {"_id": None, "total": {"$sum": {"$size": "$account"}}}},
+        ])
+        return result[0]["total"] if result else 0
+
+    # True if any of the matched accounts has no client. Those are invisible to the client-driven pipeline.
+    # One aggregation stops at the first account whose client lookup comes back empty. It goes through the CRUD layer's cache,
+    # which is invalidated by writes to either collection, so it is only paid again after a write.
+    def HasOrphanedAccounts(self, matchedAccounts):
+
+        pipeline = [{"$match": matchedAccounts}] if matchedAccounts else []
+        pipeline += [
+            {"$lookup": {"from": self.clientsCollection, "let": {"clientId": "$client_id"}, "as": "client",
+                         "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$clientId"]}}}, {"$project": {"_id": 1}}]}},
+            {"$match": {"client": {"$size": 0}}},
+            {"$limit": 1},
+            {"$project": {"_id": 1}},
+        ]
+        return bool(self.crud.aggregate(self.accountsCollection, pipeline))
+
+    # Stages that keep only the accounts whose client matches clientFilter, checked with an indexed lookup of each account's client.
+    # Returns no stages for an empty filter.
+    def ClientMatchStages(self, clientFilter):
+
+        if not clientFilter:
+            return []
+        return [
+            {"$lookup": {"from": self.clientsCollection, "let": {"clientId": "$client_id"}, "as": "matchedClient",
+                         "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$clientId"]}}}, {"$match": clientFilter}, {"$project": {"_id": 1}}]}},
+            {"$match": {"matchedClient": {"$ne": []}}},
+            {"$project": {"matchedClient": 0}},
+        ]
+
+    # Reads a page sorted by at most one account column with the CRUD layer's keyset read_page, then joins just that page to its clients.
+    # The first page, and any page directly after one already served, resume from a continuation token with a single index range scan.
+    # Any other page (a jump ahead, or a page whose position has been forgotten) is read with skip/limit instead.
+    def KeysetPage(self, matchedAccounts, sort, pageCurrent, pageSize):
+
+        sortKey, sortDirection = (sort[0][0], sort[0][1]) if sort else ("_id", 1)
+        positionKey = (json_util.dumps(matchedAccounts, sort_keys=True), sortKey, sortDirection, pageSize)
+
+        token = None
+        if pageCurrent > 0:
+            with self.tokenLock:
+                token = self.pageTokens.get(positionKey + (pageCurrent,))
+            if token is None:
+                return self.crud.aggregate(self.accountsCollection, self.AccountSortedPipeline(matchedAccounts, sort, pageCurrent * pageSize, pageSize))
+
+        projection = {"_id": 1} if sortKey == "_id" else {"_id": 1, sortKey: 1}
+        keysetPage = self.crud.read_page(self.accountsCollection, matchedAccounts, pageSize, sortKey, sortDirection, token, projection=projection)
+        if keysetPage["nextToken"] is not None:
+            with self.tokenLock:
+                self.pageTokens[positionKey + (pageCurrent + 1,)] = keysetPage["nextToken"]
+                self.pageTokens.move_to_end(positionKey + (pageCurrent + 1,))
+                while len(self.pageTokens) > self.maxPageTokens:
+                    self.pageTokens.popitem(last=False)
+
+        pageIds = [account["_id"] for account in keysetPage["results"]]
+        if not pageIds:
+            return []
+        return self.crud.aggregate(self.accountsCollection, self.AccountSortedPipeline({"_id": {"$in": pageIds}}, sort, 0, pageSize))
+
+    # Sorting by account fields (or not at all): the accounts are filtered, sorted and paged by index, and only the page's accounts are joined to their clients.
+    # A client filter is checked after the sort, so the accounts are still read in index order and the lookups stop once the page is full.
+    def AccountSortedPipeline(self, accountFilter, sort, skip, limit, clientFilter=None):
+
+        sortSpec = self.SortSpec(sort)
+
+        pipeline = [{"$match": accountFilter}] if accountFilter else []
+        pipeline += [{"$sort": sortSpec}] + self.ClientMatchStages(clientFilter) + [{"$skip": skip}, {"$limit": limit}]
+        return pipeline + self.crud.BuildMergedPipeline(None, self.accountFields, self.clientFields, self.clientsCollection)
+
+    # Sorting by client fields: the clients are walked in index order and each one's matching accounts are looked up,
+    # so the database stops as soon as the page is full instead of joining and sorting the whole book.
+    def ClientSortedPipeline(self, clientFilter, accountFilter, sort, skip, limit):
+
+        sortSpec = self.SortSpec(sort)
+
+        accountMatch = [{"$match": {"$expr": {"$eq": ["$client_id", "$$clientId"]}}}]
+        if accountFilter:
+            accountMatch.append({"$match": accountFilter})
+        accountMatch.append({"$sort": {"_id": 1}})
+
+        pipeline = [{"$match": clientFilter}] if clientFilter else []
+        pipeline += [
+            {"$sort": sortSpec},
+            {"$lookup": {"from": self.accountsCollection, "let": {"clientId": "$_id"}, "pipeline": accountMatch, "as": "account"}},
+            {"$unwind": "$account"},
+            {"$skip": skip},
+            {"$limit": limit},
+        ]
+
+        # Reshape to the same rows the account-driven pipeline produces.
+        projection = {"_id": 0, "last_review_date": 1}
+        for field in self.clientFields:
+            projection[field] = 1
+        for field in self.accountFields:
+            projection[field] = f"$account.{field}"
+        pipeline.append({"$project": projection})
+        pipeline.append({"$addFields": {"days_since_last_review": self.crud.DaysSinceExpression("$last_review_date")}})
+        if "last_review_date" not in self.clientFields:
+            pipeline.append({"$project": {"last_review_date": 0}})
+        return pipeline
+
+    # Sorting by both account and client fields: join first, then sort and page the joined rows.
+    def JoinSortedPipeline(self, accountFilter, sort, skip, limit, clientFilter=None):
+
+        sortSpec = self.SortSpec(sort)
+
+        # last_review_date is kept through the sort, since sorting by days since the last review sorts by it.
+        clientFields = self.clientFields if "last_review_date" in self.clientFields else self.clientFields + ["last_review_date"]
+        pipeline = self.crud.BuildMergedPipeline(accountFilter, self.accountFields, clientFields, self.clientsCollection, keepIds=True)
+        # The client filter is checked right after the account filter, so only accounts of matching clients are joined and sorted.
+        position = 1 if accountFilter else 0
+        pipeline[position:position] = self.ClientMatchStages(clientFilter)
+        pipeline += [{"$sort": sortSpec}, {"$skip": skip}, {"$limit": limit}, {"$project": {"_id": 0, "client_id": 0}}]
+        if "last_review_date" not in self.clientFields:
+            pipeline.append({"$project": {"last_review_date": 0}})
+        return pipeline
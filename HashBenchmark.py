@@ -0,0 +1,73 @@
+# **************************************************
+#
+# Filename: HashBenchmark.py
+# Version: 1.0.0
+# Purpose: Measure password hashing throughput (hashes per second, per core and in total through the worker pool)
+#          for the configured KDF settings, to help pick a cost factor.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Results depend heavily on the machine. Run it on the server the dashboard will be deployed to.
+#
+# **************************************************
+
+import configparser
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ClientDataHashing import PasswordHasher, DeriveKey
+
+# Returns the hashes per second of running function() count times.
+def Rate(function, count):
+
+    start = time.perf_counter()
+    function(count)
+    return count / (time.perf_counter() - start)
+
+def main():
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    config = configparser.ConfigParser()
+    config.read("./config/CS499_secure.ini")
+    hasher = PasswordHasher.FromConfig(config)
+    cores = os.cpu_count() or 1
+
+    # One core, in this process: what a single worker can do.
+    def SingleCore(count):
+        for index in range(count):
+            DeriveKey(hasher.algorithm, hasher.parameters, f"password{index}", os.urandom(16))
+
+    # Through the hasher, with as many concurrent callers as it has pending slots, the way a burst of logins would use it.
+    def Pool(count):
+        with ThreadPoolExecutor(max_workers=hasher.maxPending) as callers:
+            list(callers.map(hasher.Hash, (f"password{index}" for index in range(count))))
+
+    # The old unsalted SHA-256, for scale.
+    def Legacy(count):
+        for index in range(count):
+            hashlib.sha256(f"password{index}".encode()).hexdigest()
+
+    hasher.Start()
+    try:
+        print(f"Algorithm: {hasher.algorithm} {hasher.parameters}, workers: {hasher.maxWorkers}, cores: {cores}, hashes: {count}")
+        singleRate = Rate(SingleCore, count)
+        poolRate = Rate(Pool, count * hasher.maxWorkers)
+        legacyRate = Rate(Legacy, 100000)
+
+        print(f"  single core                {singleRate:12.1f} hashes/s   ({1000 / singleRate:.1f} ms per hash)")
+        print(f"  pool, {hasher.maxWorkers} workers             {poolRate:12.1f} hashes/s   ({poolRate / min(hasher.maxWorkers, cores):.1f} per core)")
+        print(f"  legacy SHA-256             {legacyRate:12.1f} hashes/s")
+    finally:
+        hasher.Close()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# **************************************************
+#
+# Filename: LoginBenchmark.py
+# Version: 1.0.0
+# Purpose: Compare login latency and database round trips between the original multi-step login flow
+#          (find the user, check the lock, then record the outcome) and the atomic AuthenticateUser, under concurrent load.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * Needs a running MongoDB and the [SLLogin] credentials. It creates and removes its own loginbench_* users in the logins collection.
+# * Passwords are hashed with a single PBKDF2 iteration here so the numbers show the database cost, not the KDF cost (see HashBenchmark.py).
+#
+# **************************************************
+
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import errors, monitoring
+
+from ClientDataConnection import GetConnectionManager
+from ClientDataHashing import PasswordHasher
+
+# Counts the commands sent to the server. Registered before any client is created, so it sees every one of them.
+class CommandCounter(monitoring.CommandListener):
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        with self.lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+counter = CommandCounter()
+monitoring.register(counter)
+
+# Imported after the listener is registered.
+from ClientDataSecurity import SecurityLayer
+
+USERS = {"loginbench_ok": "correct horse", "loginbench_bad": "battery staple"}
+
+# The login flow as it was: find the user, check (and maybe lift) the lock, then report the outcome,
+# which for a failure meant finding the user again and up to two more updates.
+def LegacyAuthenticate(sl, username, password):
+
+    user = sl.VerifyUser(username)
+    if user is None:
+        return False
+
+    if LegacyAccountLocked(sl, user):
+        LegacyLoginFailure(sl, username)
+        return False
+
+    if not sl.hasher.Verify(password, user.get("hashed_password"))[0]:
+        LegacyLoginFailure(sl, username)
+        return False
+
+    sl.UpdateDatabase(username, {"recentFailedAttempts": 0, "lastLoginAttempt": sl.SessionTime()})
+    return True
+
+# The old lock check: a locked account whose last attempt is older than the lockout is unlocked with another update.
+def LegacyAccountLocked(sl, user):
+
+    if not user.get("isLocked"):
+        return False
+    if (sl.SessionTime() - user.get("lastLoginAttempt")).total_seconds() > sl.sessionLifespan:
+        sl.AccountLock(user.get("username"), False)
+        return False
+    return True
+
+def LegacyLoginFailure(sl, username):
+
+    user = sl.VerifyUser(username)
+    if user is None:
+        return
+    recentFailedAttempts = user.get("recentFailedAttempts", 0) + 1
+    sl.UpdateDatabase(username, {"recentFailedAttempts": recentFailedAttempts, "lastLoginAttempt": sl.SessionTime()})
+    if recentFailedAttempts >= sl.loginFailureThreshold:
+        sl.AccountLock(username, True)
+
+# Resets the benchmark users to unlocked with no failures.
+def ResetUsers(sl):
+
+    sl.collection.update_many({"username": {"$in": list(USERS)}}, {"$set": {"isLocked": False, "recentFailedAttempts": 0}})
+
+# Runs attempts logins through authenticate with the given number of concurrent callers.
+# Returns (latencies in ms, commands per login).
+def Run(authenticate, username, password, attempts, callers):
+
+    def Attempt(_):
+        start = time.perf_counter()
+        authenticate(username, password)
+        return (time.perf_counter() - start) * 1000
+
+    before = counter.count
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        latencies = list(pool.map(Attempt, range(attempts)))
+    return latencies, (counter.count - before) / attempts
+
+def Report(label, latencies, commands):
+
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"  {label:<34} mean {statistics.mean(latencies):7.2f} ms   p50 {statistics.median(latencies):7.2f} ms   "
+          f"p95 {p95:7.2f} ms   {commands:4.2f} round trips/login")
+
+def main():
+
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    callers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    sl = SecurityLayer()
+    if sl.config is None or sl.database is None:
+        return 1
+
+    sl.ClosePasswordHasher()
+    sl.hasher = PasswordHasher("pbkdf2_sha256", {"i": 1}, maxWorkers=2)
+    try:
+        sl.collection.delete_many({"username": {"$in": list(USERS)}})
+        for username, password in USERS.items():
+            sl.collection.insert_one({"username": username, "hashed_password": sl.HashPassword(password), "role": "read",
+                                      "isLocked": False, "lastLoginAttempt": sl.SessionTime(), "recentFailedAttempts": 0})
+    except errors.PyMongoError as pyMongoError:
+        print(f"Unable to set up the benchmark users; is MongoDB running? {pyMongoError}")
+        sl.ClosePasswordHasher()
+        sl.CloseSessions()
+        GetConnectionManager().CloseAll()
+        return 1
+
+    scenarios = [
+        ("successful login", "loginbench_ok", USERS["loginbench_ok"]),
+        ("wrong password (locks after 5)", "loginbench_bad", "wrong"),
+        ("unknown user", "loginbench_nobody", "wrong"),
+    ]
+    flows = [
+        ("before", lambda username, password: LegacyAuthenticate(sl, username, password)),
+        ("after", sl.AuthenticateUser),
+    ]
+
+    try:
+        print(f"Logins per run: {attempts}, concurrent callers: {callers}")
+        for label, username, password in scenarios:
+            print(label)
+            for flowName, authenticate in flows:
+                ResetUsers(sl)
+                latencies, commands = Run(authenticate, username, password, attempts, callers)
+                Report(flowName, latencies, commands)
+    finally:
+        sl.collection.delete_many({"username": {"$in": list(USERS)}})
+        sl.ClosePasswordHasher()
+        sl.CloseSessions()
+        GetConnectionManager().CloseAll()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# **************************************************
+#
+# Filename: SchemaTestDriver.py
+# Version: 1.0.0
+# Purpose: Basic driver to check that ApplyFrameSchema converts the merged frame's columns to their compact dtypes,
+#          including values too large for the column's dtype.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+#
+# **************************************************
+
+import sys
+
+import pandas as pd
+
+from ClientDataSchema import ApplyFrameSchema, DAYS_RANGE
+
+# Prints a test's outcome and returns whether it passed.
+def Check(description, passed):
+
+    print(f"  {'passed' if passed else 'FAILED'}: {description}")
+    return passed
+
+def main():
+
+    results = []
+
+    print("Running tests.")
+    print("Test 1: Converting day counts...")
+    frame = pd.DataFrame({"days_since_last_review": [12.4, None, "unknown", 45000.0, 1e12, -1e12]})
+    try:
+        days = ApplyFrameSchema(frame)["days_since_last_review"]
+        results.append(Check("ordinary values are rounded", days[0] == 12))
+        results.append(Check("missing and unreadable values become <NA>", days[1:3].isna().all()))
+        results.append(Check("a review date about 123 years old is kept exactly", days[3] == 45000))
+        results.append(Check("values beyond the dtype's range are clipped to it", days[4] == DAYS_RANGE[1] and days[5] == DAYS_RANGE[0]))
+    except (TypeError, ValueError) as exception:
+        results.append(Check(f"day counts convert without error ({exception})", False))
+
+    print("Test 2: Converting money and filling in missing columns...")
+    compact = ApplyFrameSchema(pd.DataFrame({"account_value": [1234.56, "n/a"], "account_class": ["IRA", "IRA"]}))
+    results.append(Check("money is held as whole cents", compact["account_value"][0] == 123456 and pd.isna(compact["account_value"][1])))
+    results.append(Check("schema columns missing from the frame are added empty", compact["last_name"].isna().all()))
+    results.append(Check("columns are stored with the schema's dtypes",
+                         str(compact["account_class"].dtype) == "category" and str(compact["days_since_last_review"].dtype) == "Int32"))
+
+    print(f"{sum(results)} of {len(results)} checks passed.")
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -35,8 +35,8 @@ def main():
         print(f"Verification failed for {self.tempUsername}")
     
     print("Test 2: Testing password hashing...")
-    hashedPassword = securityLayer.HashPassword(self.tempPassword)
-    if securityLayer.VerifyPassword(hashedPassword, verifiedUser.get("hashed_password")):
+    # Stored hashes are salted, so the password is checked against the stored hash rather than hashed again and compared.
+    if securityLayer.hasher.Verify(self.tempPassword, verifiedUser.get("hashed_password"))[0]:
         print(f"Hashed password verification passed for {self.tempUsername}")
     else:
         print(f"Hashed password verification failed for {self.tempUsername}")
@@ -64,9 +64,9 @@ def main():
         print(f"Session Authentication failed for {self.tempUsername}")
         
     print("Test 6: Testing account lock...")
+    # The login in Test 3 was just now, so a locked account stays locked and the correct password is turned away.
     securityLayer.AccountLock(self.tempUsername, True)
-    verifiedUser = securityLayer.VerifyUser(self.tempUsername)
-    locked = securityLayer.GetAccountLocked(verifiedUser)
+    locked = not securityLayer.AuthenticateUser(self.tempUsername, self.tempPassword)
     if locked:
         print(f"Account locking passed for {self.tempUsername}")
     else:
@@ -74,8 +74,7 @@ def main():
         
     print("Test 7: Testing account unlock...")
     securityLayer.AccountLock(self.tempUsername, False)
-    verifiedUser = securityLayer.VerifyUser(self.tempUsername)
-    locked = securityLayer.GetAccountLocked(verifiedUser)
+    locked = not securityLayer.AuthenticateUser(self.tempUsername, self.tempPassword)
     if not locked:
         print(f"Account unlocking passed for {self.tempUsername}")
     else:
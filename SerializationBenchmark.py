@@ -0,0 +1,84 @@
+# **************************************************
+#
+# Filename: SerializationBenchmark.py
+# Version: 1.0.0
+# Purpose: Compare DataFrame.to_dict('records') against the column-wise DataTable serializer on a synthetic book of accounts.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The book is synthetic. Its shape follows the merged dashboard frame but the values are random.
+#
+# **************************************************
+
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ClientDataSerialization import SerializeTableRecords, EncodeTableJson, MONEY_COLUMNS, orjson
+
+# Builds a merged-frame lookalike with the dashboard's displayed columns.
+def BuildBook(rows, seed=499):
+
+    random = np.random.default_rng(seed)
+    retirement = random.random(rows) < 0.4
+    accountValue = random.uniform(10000, 2000000, rows)
+
+    return pd.DataFrame({
+        "first_name": random.choice(["Ayden", "Amelia", "Collins", "Zachary", "Lia"], rows),
+        "last_name": random.choice(["Walker", "Norris", "Lyons", "Holmes"], rows),
+        "account_nickname": random.choice(["Rollover IRA", "Traditional IRA", "Trust Account", "TOD Account"], rows),
+        "account_class": np.where(retirement, "retirement", "non-retirement"),
+        "account_value": accountValue,
+        "cash_available": accountValue * random.uniform(0.1, 0.15, rows),
+        "ytd_distributions": random.uniform(0, 50000, rows),
+        "rmd_amount": np.where(retirement, random.uniform(0, 80000, rows), np.nan),
+        "days_since_last_review": random.integers(0, 800, rows).astype(float),
+    })
+
+# Returns the best of several timings of function(), in seconds.
+def Time(function, repeats):
+
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = 5
+    book = BuildBook(rows)
+    columns = list(book.columns)
+
+    # What update_dashboard used to do: one dict per row, then Dash's encoder (stdlib json here) over the result.
+    def Baseline():
+        return json.dumps(book.to_dict('records'))
+
+    def ColumnWise():
+        return SerializeTableRecords(book, columns, MONEY_COLUMNS)
+
+    def ColumnWiseEncoded():
+        return EncodeTableJson(book, columns, MONEY_COLUMNS)
+
+    print(f"Rows: {rows}, best of {repeats}, encoder: {'orjson' if orjson is not None else 'json'}")
+    recordsTime = Time(lambda: book.to_dict('records'), repeats)
+    columnTime = Time(ColumnWise, repeats)
+    baselineTime = Time(Baseline, repeats)
+    encodedTime = Time(ColumnWiseEncoded, repeats)
+
+    print(f"  to_dict('records')              {recordsTime * 1000:9.1f} ms")
+    print(f"  SerializeTableRecords           {columnTime * 1000:9.1f} ms   ({recordsTime / columnTime:.1f}x)")
+    print(f"  to_dict('records') + json       {baselineTime * 1000:9.1f} ms")
+    print(f"  EncodeTableJson                 {encodedTime * 1000:9.1f} ms   ({baselineTime / encodedTime:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# **************************************************
+#
+# Filename: SessionStoreTestDriver.py
+# Version: 1.0.0
+# Purpose: Basic driver to check that the session stores reap expired sessions correctly, including sessions that were
+#          evicted from the MongoDB store's cache and cached again.
+#
+# Written: November 2023
+# Programmer: Jason Holmes
+# Contact Information: jason.holmes3@snhu.edu
+#
+# Current Known Issues:
+# * The MongoDB store runs against a small in-memory stand-in for its collection, so no database is needed.
+#   It covers the cache and expiry heap, not the TTL index or the write-behind flush.
+#
+# **************************************************
+
+import datetime
+import sys
+
+from ClientDataSessionStore import InMemorySessionStore, MongoSessionStore, UtcNow
+
+# The few collection methods MongoSessionStore uses, backed by a dictionary of session documents.
+class SessionCollection:
+
+    def __init__(self):
+        self.documents = {}
+
+    def create_indexes(self, indexes):
+        return [index.document["name"] for index in indexes]
+
+    def replace_one(self, target, document, upsert=False):
+        self.documents[target["_id"]] = dict(document, _id=target["_id"])
+
+    def find_one(self, target):
+        document = self.documents.get(target["_id"])
+        return dict(document) if document is not None else None
+
+    def delete_one(self, target):
+        self.documents.pop(target["_id"], None)
+
+    def bulk_write(self, operations, ordered=False):
+        pass
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+# Prints a test's outcome and returns whether it passed.
+def Check(description, passed):
+
+    print(f"  {'passed' if passed else 'FAILED'}: {description}")
+    return passed
+
+def main():
+
+    results = []
+    lifespanSeconds = 600
+    started = UtcNow() - datetime.timedelta(seconds=lifespanSeconds * 2)
+    later = UtcNow() + datetime.timedelta(seconds=lifespanSeconds * 2)
+
+    print("Running tests.")
+    print("Test 1: Evicting, re-caching and reaping sessions in the MongoDB store...")
+    store = MongoSessionStore(SessionCollection(), lifespanSeconds, cacheSeconds=60, flushSeconds=3600, maxCached=1)
+    try:
+        # With room for one cached session, putting A, B and C evicts A and B. Reading A back caches it again.
+        for UUID in ["A", "B", "C"]:
+            store.Put(UUID, {"username": UUID, "token": UUID, "lastActive": started})
+        store.Get("A")
+        results.append(Check("re-caching an evicted session keeps one heap entry per session", len(store.expiries) == 3))
+
+        # Only A is still cached; B and C have expired too but are only in the database, so their entries are simply dropped.
+        reaped = store.ReapExpired()
+        results.append(Check("every expired cached session is reaped", reaped == 1 and len(store.cache) == 0))
+        results.append(Check("the heap is empty after reaping", len(store.expiries) == 0))
+
+        # A reaped session that is read again is tracked again.
+        store.Get("B")
+        results.append(Check("a session cached after a reap is tracked again", len(store.expiries) == 1))
+        results.append(Check("it is reaped once it has expired", store.ReapExpired(later) == 1 and len(store.expiries) == 0))
+    finally:
+        store.Close()
+
+    print("Test 2: Replacing and reaping sessions in the in-memory store...")
+    store = InMemorySessionStore(lifespanSeconds)
+    store.Put("A", {"username": "A", "token": "A", "lastActive": started})
+    store.Put("A", {"username": "A", "token": "A2", "lastActive": started})
+    store.Put("B", {"username": "B", "token": "B", "lastActive": UtcNow()})
+    results.append(Check("replacing a session keeps one heap entry per session", len(store.expiries) == 2))
+    results.append(Check("only the expired session is reaped", store.ReapExpired() == 1 and store.Get("B") is not None))
+    results.append(Check("the live session is reaped once it has expired", store.ReapExpired(later) == 1 and store.Count() == 0))
+
+    print(f"{sum(results)} of {len(results)} checks passed.")
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())